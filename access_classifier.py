@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+from page_parser import parse_page_record
+
+
+##################################################################################################
+###################################### ACCESS CLASSIFIER #########################################
+##################################################################################################
+# phrase rules, in access_rules.json:
+#   geo_phrases (plus every geo term followed by every preposition) make an access point likely to be geographic
+#     "of screen": mobius<=cornelis (aqwwiki.wikidot.com/mobius)
+#     "stairs": towerofdoom6<=towerofdoom7 (http://aqwwiki.wikidot.com/tower-of-doom-6)
+#   non_geo_phrases make an access point unlikely to be geographic
+RULES_LOC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "access_rules.json")
+
+
+def load_access_rules(loc=RULES_LOC):
+    with open(loc, "r") as f:
+        rules = json.load(f)
+    geo_phrases = list(rules.get("geo_phrases", []))
+    for geo_term in rules.get("geo_terms", []):
+        for preposition in rules.get("prepositions", []):
+            geo_phrases.append(f"{geo_term} {preposition}")
+    return geo_phrases, list(rules.get("non_geo_phrases", []))
+
+
+# compiles phrase rules into a table of (phrase, geo weight, non-geo weight), with each distinct phrase listed once
+# (a phrase in both lists counts towards both)
+def compile_rules(geo_phrases, non_geo_phrases):
+    geo_set = set(geo_phrases)
+    non_geo_set = set(non_geo_phrases)
+    return tuple((phrase, int(phrase in geo_set), int(phrase in non_geo_set)) for phrase in sorted(geo_set | non_geo_set))
+
+
+# classifies access point text as geographic or not
+# a line is geographic if it has more than one word and contains at least as many geo phrases as non-geo phrases
+# (non geo takes precedence: no geo phrases but a non-geo phrase implies non-geo)
+# the text of an access point may list several ways to reach a room, one per line, and is geographic if any line is
+class AccessClassifier:
+    def __init__(self, rules_loc=RULES_LOC):
+        self.geo_phrases, self.non_geo_phrases = load_access_rules(rules_loc)
+        self.rules = compile_rules(self.geo_phrases, self.non_geo_phrases)
+
+    # tests one lowercase line against every phrase (plain substring tests beat a combined regex on lines this short)
+    def is_line_geographic(self, s_lower):
+        geo_flag = 0
+        non_geo_flag = 0
+        for phrase, geo_weight, non_geo_weight in self.rules:
+            if phrase in s_lower:
+                geo_flag += geo_weight
+                non_geo_flag += non_geo_weight
+        return geo_flag >= non_geo_flag
+
+    def is_access_geographic(self, s):
+        # reject empty and one-word lines
+        # (typically a hyperlink with no explanation of the connection, see aqwwiki.wikidot.com/escherion-s-tower)
+        if len(s.split(" ")) <= 1:
+            return False
+        return self.is_line_geographic(s.lower())
+
+    # be careful of multiple inline access methods (e.g. http://aqwwiki.wikidot.com/mobius)
+    def is_loc_geographic(self, s):
+        return any(self.is_access_geographic(s_line) for s_line in s.split("\n") if len(s_line) > 0)
+
+    # batch version of is_access_geographic, returning a boolean array
+    # access lines repeat heavily across pages and crawls, so each distinct line is only classified once
+    def classify_lines(self, lines):
+        decisions = {line: " " in line and self.is_line_geographic(line.lower()) for line in dict.fromkeys(lines)}
+        return np.array([decisions[line] for line in lines], dtype=bool)
+
+    # batch version of is_loc_geographic, returning a boolean array
+    # (empty lines are never geographic, so they needn't be dropped)
+    def classify_access_points(self, texts):
+        lines = "\n".join(texts).split("\n") if len(texts) > 0 else []
+        owners = np.repeat(np.arange(len(texts)), [s.count("\n") + 1 for s in texts])
+        is_geographic = self.classify_lines(lines)
+        return np.bincount(owners[is_geographic], minlength=len(texts)) > 0
+
+
+##################################################################################################
+##################################### RECLASSIFY ACCESS LINES ####################################
+##################################################################################################
+# access point text of every location page in an archive (see page_archive.py) or directory of saved pages
+def load_access_lines(loc):
+    if os.path.isdir(loc):
+        from bench_parse import load_corpus
+        corpus = load_corpus(loc)
+    else:
+        from page_archive import PageArchive
+        archive = PageArchive(loc)
+        corpus = [(key.strip("/"), archive.get(key)) for key in sorted(archive)]
+        archive.close()
+
+    access_lines = []
+    for name, page_text in corpus:
+        try:
+            record = parse_page_record(name, page_text)
+        except AttributeError:
+            continue
+        if record is not None and record.is_location:
+            access_lines.extend(record.access_lines)
+    return access_lines
+
+
+def main(args):
+    access_lines = load_access_lines(args.pages)
+    classifier = AccessClassifier(args.rules)
+
+    start = time.perf_counter()
+    is_geographic = classifier.classify_access_points(access_lines)
+    batch_time = time.perf_counter() - start
+    start = time.perf_counter()
+    is_geographic_serial = np.array([classifier.is_loc_geographic(s) for s in access_lines], dtype=bool)
+    serial_time = time.perf_counter() - start
+    print(f"{len(access_lines)} access points, {int(np.sum(is_geographic))} geographic")
+    print(f"batch: {1000 * batch_time:.1f} ms, one at a time: {1000 * serial_time:.1f} ms, "
+          f"{int(np.sum(is_geographic != is_geographic_serial))} decisions differ")
+
+    # decisions that change under another set of rules
+    if args.compare_rules is not None:
+        is_geographic_new = AccessClassifier(args.compare_rules).classify_access_points(access_lines)
+        changed = np.flatnonzero(is_geographic != is_geographic_new)
+        print(f"{len(changed)} access points change with {args.compare_rules}")
+        for idx in changed[:args.show]:
+            print(f"  {'geo' if is_geographic_new[idx] else 'non-geo':>7}: {access_lines[idx].strip()!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify access points of saved AQW Wiki pages")
+    parser.add_argument("pages", help="Page archive (zip or tar) or directory of saved wiki pages")
+    parser.add_argument("--rules", default=RULES_LOC, help="JSON file of phrase rules")
+    parser.add_argument("--compare_rules", default=None, help="JSON file of phrase rules to compare decisions against")
+    parser.add_argument("--show", default=20, type=int, help="Number of changed access points to show")
+    args = parser.parse_args()
+    main(args)
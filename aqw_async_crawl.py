@@ -0,0 +1,246 @@
+import asyncio
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import requests
+
+from page_cache import get_page_text
+from crawl_frontier import BFSFrontier
+from telemetry import metrics, timed_call
+
+
+##################################################################################################
+################################## TOKEN BUCKET RATE LIMITER #####################################
+##################################################################################################
+# global requests-per-second budget shared by every crawl worker
+# (bursts of up to `capacity` requests are allowed after idle periods)
+# tokens are reserved under a thread lock, so one bucket can be shared by async workers and threads alike
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    # takes a token, returning how long the caller must wait before it can be used
+    # (tokens may be reserved ahead of time, so they are handed out in arrival order)
+    def reserve(self):
+        # an unlimited bucket never waits
+        if self.rate is None or self.rate == float("inf"):
+            return 0
+        with self.lock:
+            self.refill()
+            self.tokens -= 1
+            return max(0, -self.tokens / self.rate)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            metrics.inc("sleep_seconds_total", delay, reason="rate_limit")
+        return None
+
+    # blocking version of acquire, for threads
+    def wait(self):
+        delay = self.reserve()
+        metrics.sleep(delay, "rate_limit")
+        return None
+
+
+##################################################################################################
+#################################### CONCURRENT WIKI CRAWL #######################################
+##################################################################################################
+# crawls outward from starting_rooms with up to `concurrency` requests in flight
+# parse_page(room, page_text) returns a page result (or None if the page text is unusable)
+# get_children(result) returns the rooms to expand from a page result
+# rooms are taken from `frontier` (breadth first by default) and expanded while within `degree` hops
+# a room is fetched at most once, but is re-expanded if later reached by a shorter path
+# if a journal is given, progress is recorded to it and any progress it already holds is resumed
+# if parsers > 0, fetched pages are streamed through a bounded queue to a pool of `parsers` processes
+# (parse_page must then be picklable), otherwise pages are parsed in the fetching threads
+# pages that can't be retrieved get a None result and are retried (up to retry_passes times) once the frontier is exhausted
+# if starting_room_stream is given, each list of rooms it yields is added to the starting rooms as it arrives
+# (it is iterated in a thread, so it may block, e.g. on requests for region pages)
+# requests are limited to requests_per_second, or to the budget of a given limiter (a TokenBucket)
+# returns page results and hop distances from the starting rooms
+async def crawl_async(starting_rooms, parse_page, get_children, degree=16, base_url="http://aqwwiki.wikidot.com/",
+                      concurrency=8, requests_per_second=1, cache=None, journal=None, frontier=None,
+                      parsers=0, parse_queue_size=None, retry_passes=1, verbose=2, starting_room_stream=None,
+                      limiter=None):
+    loop = asyncio.get_running_loop()
+    if limiter is None:
+        limiter = TokenBucket(requests_per_second)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    if parsers > 0:
+        parse_executor = ProcessPoolExecutor(max_workers=parsers)
+        # fetchers wait once this many pages are waiting to be parsed
+        parse_queue = asyncio.Queue(maxsize=2*parsers if parse_queue_size is None else parse_queue_size)
+    if frontier is None:
+        frontier = BFSFrontier()
+
+    fetches = {} # room -> task resolving to its page result
+    hops = {} # room -> smallest hop distance it has been scheduled with
+    results = {} # room -> page result, in completion order
+    in_progress = [0]
+    frontier_changed = asyncio.Event()
+
+    def schedule(room, room_hops, parent=None):
+        if room in hops and hops[room] <= room_hops:
+            return None
+        hops[room] = room_hops
+        frontier.push(room, room_hops, parent)
+        frontier_changed.set()
+        if journal is not None:
+            journal.record_scheduled(room, room_hops)
+        return None
+
+    async def fetch_text(room):
+        url = f"{base_url}/{room}"
+        # fresh cached pages don't count against the request budget
+        if cache is not None:
+            page_text = await loop.run_in_executor(executor, cache.fresh_text, url)
+            if page_text is not None:
+                return page_text
+        await limiter.acquire()
+        return await loop.run_in_executor(executor, get_page_text, url, cache)
+
+    async def parse(room, page_text):
+        if parsers == 0:
+            return await loop.run_in_executor(executor, parse_page, room, page_text)
+        parsed = loop.create_future()
+        await parse_queue.put((room, page_text, parsed))
+        return await parsed
+
+    # hands queued pages to the process pool, one page at a time per parser
+    # (parse times are measured in the parser processes, and recorded here)
+    async def parser():
+        while True:
+            room, page_text, parsed = await parse_queue.get()
+            try:
+                result, wall, _ = await loop.run_in_executor(parse_executor, timed_call, parse_page, room, page_text)
+                metrics.observe("page_parse_seconds", wall)
+                metrics.inc("pages_parsed_total")
+                parsed.set_result(result)
+            except Exception as e:
+                parsed.set_exception(e)
+
+    async def fetch_room(room):
+        try:
+            page_text = await fetch_text(room)
+            result = await parse(room, page_text)
+            if result is None:
+                # if this fails, then the request failed, try again once
+                if cache is not None:
+                    cache.invalidate(f"{base_url}/{room}")
+                page_text = await fetch_text(room)
+                result = await parse(room, page_text)
+                if result is None:
+                    print(f"{room} text issue")
+        except requests.RequestException as e:
+            # the http client already retried, so give up on this page for now
+            print(f"{room} request failed: {e}")
+            result = None
+        if journal is not None and result is not None:
+            journal.record_page(room, result)
+        results[room] = result
+        return result
+
+    async def expand_room(room, room_hops):
+        if room not in fetches:
+            fetches[room] = asyncio.ensure_future(fetch_room(room))
+        result = await fetches[room]
+        if result is not None:
+            for child in get_children(result):
+                frontier.seen(child)
+                if room_hops < degree:
+                    if verbose > 1 and child not in hops:
+                        print(f"[{len(results)}] {str(room)}<={child}")
+                    schedule(child, room_hops + 1, room)
+        if journal is not None:
+            journal.record_expanded(room, room_hops)
+        return None
+
+    # schedules starting rooms as the stream yields them
+    # (the stream counts as in progress, so workers wait for it rather than stopping on an empty frontier)
+    async def feed_starting_rooms():
+        stream = iter(starting_room_stream)
+        try:
+            while True:
+                rooms = await loop.run_in_executor(None, next, stream, None)
+                if rooms is None:
+                    break
+                for room in rooms:
+                    schedule(room, 0)
+        finally:
+            in_progress[0] -= 1
+            frontier_changed.set()
+
+    # workers stop once the frontier is empty and no room is still being expanded
+    async def worker():
+        while True:
+            while len(frontier) == 0:
+                if in_progress[0] == 0:
+                    return None
+                frontier_changed.clear()
+                await frontier_changed.wait()
+            room, room_hops = frontier.pop()
+            # skip entries superseded by a shorter path
+            if room_hops > hops[room]:
+                continue
+            in_progress[0] += 1
+            try:
+                await expand_room(room, room_hops)
+            finally:
+                in_progress[0] -= 1
+                frontier_changed.set()
+
+    if journal is not None and len(journal.scheduled) > 0:
+        # resume: completed pages are not fetched again and the pending frontier is restored
+        for room, result in journal.results.items():
+            results[room] = result
+            fetches[room] = loop.create_future()
+            fetches[room].set_result(result)
+        journal.restore_frontier(frontier, hops)
+    else:
+        for starting_room in starting_rooms:
+            schedule(starting_room, 0)
+
+    # run workers until the frontier is exhausted, surfacing the first worker error (if any)
+    # then put failed rooms back on the frontier and run them again
+    workers = []
+    parser_tasks = [asyncio.ensure_future(parser()) for _ in range(parsers)]
+    feeder = None
+    if starting_room_stream is not None:
+        in_progress[0] += 1
+        feeder = asyncio.ensure_future(feed_starting_rooms())
+    try:
+        for retry_pass in range(retry_passes + 1):
+            if retry_pass > 0:
+                failed_rooms = [room for room, result in results.items() if result is None]
+                if len(failed_rooms) == 0:
+                    break
+                if verbose > 0:
+                    print(f"Retrying {len(failed_rooms)} failed webpages.")
+                for room in failed_rooms:
+                    del fetches[room]
+                    del results[room]
+                    frontier.push(room, hops[room])
+            workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+            await asyncio.gather(*workers)
+            if feeder is not None:
+                # surface any error from the stream
+                await feeder
+    finally:
+        for task in workers + parser_tasks + ([feeder] if feeder is not None else []):
+            task.cancel()
+        executor.shutdown(wait=False)
+        if parsers > 0:
+            parse_executor.shutdown(wait=False, cancel_futures=True)
+    return results, hops
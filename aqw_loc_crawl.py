@@ -1,85 +1,55 @@
 import os
+import sys
 import json
-import requests
-from bs4 import BeautifulSoup
-import networkx as nx
-import numpy as np
-import random
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MaxNLocator
-from urllib.parse import urljoin
 import time
-
+import hashlib
+import asyncio
 import argparse
+import xml.etree.ElementTree as ET
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import parsedate_to_datetime
+
+import numpy as np
 
-from aqw_region_pull import get_region_to_loc_dict
-from graph_plotting import multi_component_graph, to_cytoscape
-from graph_tools import remove_unreciprocated_nodes, try_remove_edge, assign_by_neighbor
+from stage_cache import StageCache, hash_object, hash_file, hash_graph
+from telemetry import metrics, timed_call
+
+# third-party libraries and the modules built on them are imported by the functions that need them
+# (requests, bs4 and networkx by the crawl, matplotlib and packcircles by the plots, ...), so each subcommand
+# only loads what it uses: a crawl worker never loads plotting libraries, and a route query barely loads anything
 
 
 ##################################################################################################
 ############################ DEFINE INVALID VALID ROOM CONNECTIONS ###############################
 ##################################################################################################
-# terms that make the access point likely to be geographic
-geo_terms = ["north", "south", "east", "west", "northeast", "northwest", "southeast", "southwest"]
-prepositions = ["of", "at"]
-
-geo_phrases = []
-# mobius<=cornelis (aqwwiki.wikidot.com/mobius)
-geo_phrases.append("of screen")
-# towerofdoom6<=towerofdoom7 (http://aqwwiki.wikidot.com/tower-of-doom-6)
-geo_phrases.append("stairs")
-# general direction terms
-for geoterm in geo_terms:
-    for preposition in prepositions:
-        geo_phrases.append(f"{geoterm} {preposition}")
-
-# terms that make the accesss point unlikely to be geographic
-non_geo_phrases = ["join", "talk", "button", "map", "event hub", "statue"]
+# phrase rules for the geo condition are loaded from access_rules.json (on first use)
+geo_classifier = None
+
+
+def get_geo_classifier():
+    global geo_classifier
+    if geo_classifier is None:
+        from access_classifier import AccessClassifier
+        geo_classifier = AccessClassifier()
+    return geo_classifier
+
+
 def is_access_geographic(s):
-    # not geographic, return false
-    # (typically if there's a hyperlink but no explanation of connection)
-    if len(s) == 0:
-        return False
-
-    # reject one-word lines
-    # (see aqwwiki.wikidot.com/escherion-s-tower)
-    if len(s.split(" ")) <= 1:
-        return False
-
-    s_lower = s.lower()
-
-    non_geo_flag = 0
-    geo_flag = 0
-
-    for phrase in geo_phrases:
-        if phrase in s_lower:
-            geo_flag += 1
-
-    # non geo takes precedence
-    # no geo phrases but a non-geo phrase implies non-geo
-    for phrase in non_geo_phrases:
-        # be careful of multiple inline access methods (e.g. http://aqwwiki.wikidot.com/mobius)
-        if phrase in s_lower:
-            non_geo_flag += 1
-
-    if geo_flag >= non_geo_flag:
-        return True
-    else:
-        return False
+    return get_geo_classifier().is_access_geographic(s)
 
 
 # loop to handle cases when an access point may connect to a room in
 # multiple ways
 def is_loc_geographic(s):
-    s_split = [t for t in s.split("\n") if len(t)>0]
-    if len(s_split) == 1:
-        return is_access_geographic(s_split[0])
-    else:
-        for s_line in s_split:
-            if is_access_geographic(s_line):
-                return True
-        return False
+    return get_geo_classifier().is_loc_geographic(s)
+
+
+# batch version of is_loc_geographic, the geo condition of the crawl (the access points of a page are
+# classified in one call, see page_record_outputs)
+def classify_geographic(access_lines):
+    return get_geo_classifier().classify_access_points(access_lines)
 
 
 ##################################################################################################
@@ -87,217 +57,115 @@ def is_loc_geographic(s):
 ##################################################################################################
 # base url for wiki
 BASE_URL = "http://aqwwiki.wikidot.com/"
-def get_connected_rooms(map_extension, return_map_name=True, return_permanence=True, condition=None, sleep_duration=1):
-    if condition is None:
-        condition = lambda x: True
+# list of regions of the wiki
+REGION_LIST_URL = "http://aqwwiki.wikidot.com/locations"
+def get_connected_rooms(map_extension, return_map_name=True, return_permanence=True, condition=None, sleep_duration=1, base_url=BASE_URL, cache=None,
+                        limiter=None, return_page_hash=False):
+    import requests
+    from page_cache import get_page_text
+
+    # sleep to avoid overwhelming server (cached pages are served without a request)
+    # (or wait for a shared rate limiter, when other requests are made at the same time, e.g. for region pages)
+    if limiter is not None:
+        wait = limiter.wait
+    else:
+        wait = lambda: metrics.sleep(sleep_duration, "politeness")
+
+    # scrape html and parse it
+    url = f"{base_url}/{map_extension}"
+    try:
+        page_text = get_page_text(url, cache=cache, wait=wait)
+        outputs = parse_connected_rooms(map_extension, page_text,
+                                        return_map_name=return_map_name,
+                                        return_permanence=return_permanence,
+                                        condition=condition,
+                                        return_page_hash=return_page_hash)
+        if outputs is None:
+            # if this fails, then the request failed, wait and try again
+            if cache is not None:
+                cache.invalidate(url)
+            page_text = get_page_text(url, cache=cache, wait=wait)
+            outputs = parse_connected_rooms(map_extension, page_text,
+                                            return_map_name=return_map_name,
+                                            return_permanence=return_permanence,
+                                            condition=condition,
+                                            return_page_hash=return_page_hash)
+            # if it fails again print the map extension
+            if outputs is None:
+                print(f"{map_extension} text issue")
+    except requests.RequestException as e:
+        # the http client already retried, so give up on this page for now
+        print(f"{map_extension} request failed: {e}")
+        return None
+    return outputs
 
-    # sleep to avoid overwhelming server
-    time.sleep(sleep_duration)
 
-    # scrape html and get page-content
-    url = f"{BASE_URL}/{map_extension}"
-    res = requests.get(url)
-    map_site = BeautifulSoup(res.text, "html.parser")
-    map_site_content = map_site.find("div", id="page-content")
+# parses the html of a wiki page into access points, map name and permanence (and the sha256 of the page, see page_hash)
+# returns None if the page has no tags (typically because the request failed)
+def parse_connected_rooms(map_extension, page_text, return_map_name=True, return_permanence=True, condition=None, return_page_hash=False):
+    from page_parser import parse_page_record
 
-    try:
-        # verify that map_extension is a location
-        is_location = "location" in map_site.find("div", {"class": "page-tags"}).get_text()
-    except AttributeError:
-        # if this fails, then the request failed, wait and try again
-        time.sleep(sleep_duration)
-        res = requests.get(url)
-        map_site = BeautifulSoup(res.text, "html.parser")
-        map_site_content = map_site.find("div", id="page-content")
-        # if it fails again raise an error and print the map extension
-        try:
-            is_location = "location" in map_site.find("div", {"class": "page-tags"}).get_text()
-        except:
-            print(f"{map_extension} text issue")
-            return None
+    start = time.perf_counter()
+    record = parse_page_record(map_extension, page_text)
+    metrics.observe("page_parse_seconds", time.perf_counter() - start)
+    metrics.inc("pages_parsed_total")
+    if record is None:
+        return None
+    outputs = page_record_outputs(record, return_map_name=return_map_name, return_permanence=return_permanence, condition=condition)
+    if return_page_hash:
+        outputs.append(page_hash(page_text))
+    return outputs
+
+
+# sha256 of the text of a wiki page, recorded in crawl outputs so a recrawl can tell which pages changed since
+def page_hash(page_text):
+    return hashlib.sha256(page_text.encode("utf-8")).hexdigest()
+
+
+# converts a PageRecord into access points (filtered by condition), map name and permanence
+# condition takes the access point texts of the page and returns whether to keep each one (see classify_geographic)
+def page_record_outputs(record, return_map_name=True, return_permanence=True, condition=None):
+    map_extension = record.map_extension
 
     # handle case where link is not to a location
-    if not is_location:
+    if not record.is_location:
         # no access points if not a location
-        hrefs = []
-        outputs = [hrefs]
+        outputs = [[]]
         if return_map_name:
             # name based purely on map extension (+ N/A to flag it as not a location)
             outputs.append(f"{map_extension}: N/A")
         if return_permanence:
             # we can still check its seasonality, technically (but it doesn't mean the same thing)
-            is_seasonal = "seasonal" in map_site.find("div", {"class": "page-tags"}).get_text()
-            is_rare = "rare" in map_site.find("div", {"class": "page-tags"}).get_text()
-            is_permanent = is_seasonal == False and is_rare == False
-            outputs.append(is_permanent)
-        # return outputs without further processing
+            outputs.append(record.is_permanent)
         return outputs
 
-    # if it is a location, find the "access points" header which precedes a list of access points
-    access_header = map_site_content.find("strong", string=lambda s: s and "access points" in s.lower())
-    # get its parent
-    access_header_parent = access_header.parent
-    # get all text of parent
-    extra_text_in_header = access_header_parent.get_text().lower().split("access points")[-1]
-
-    # check if there's significant text in the header after "access points" are mentioned
-    if len(extra_text_in_header) > 4:
-        # we assume in this case that access points are included inline with the header
-        # we assume this will be something like "/join map_name", not a meaningful access point
-        extra_text_in_header.strip(":").strip()
+    # access points included inline with the header are not meaningful access points
+    if record.inline_access:
         hrefs = []
-        outputs = [hrefs]
-        if return_map_name:
-            # determine map name
-            map_name_text = map_site.find("strong", string=lambda s: s and "map name" in s.lower())
-            map_name = map_name_text.next_sibling.strip()
-            outputs.append(map_name)
-        if return_permanence:
-            # determine seasonality
-            is_seasonal = "seasonal" in map_site.find("div", {"class": "page-tags"}).get_text()
-            is_rare = "rare" in map_site.find("div", {"class": "page-tags"}).get_text()
-            is_permanent = is_seasonal == False and is_rare == False
-            outputs.append(is_permanent)
-        return outputs
-
-    # get sibling following the "access points" header parent
-    # this will contain the list of access points if they weren't in the header
-    access_list = access_header_parent.find_next_sibling()
-
-    # check if next sibling is None
-    tries = 0
-    while access_list is None and tries < 5:
-        access_header_parent = access_header_parent.parent
-        if access_header_parent is None:
-            break
-        else:
-            access_list = access_header_parent.find_next_sibling()
-            tries +=1
-
-    # check if next sibling is a div
-    if access_list.name == "div":
-        # if it is, access points are likely in collapsible content
-        # we descend structure to find the contained ul / list
-        access_list = access_list.find("div", {"class": "collapsible-block-unfolded"})
-        access_list = access_list.find("div", {"class": "collapsible-block-content"})
-        access_list = access_list.find("ul")
-
-    # otherwise, we assume the next sibling is the ul / list of access points itself
-    access_list_cond = []
-    # loop through li elements, get text, and check if it satisfies the condition
-    for a in access_list.find_all("li", recursive=False):
-        # strip links
-        # non_link_text = ''.join(item.get_text() for item in a.contents if not item.name == 'a').strip()
-        # if condition(non_link_text):
-        #     access_list_cond.append(a)
-        if condition(a.get_text()):
-            access_list_cond.append(a)
-
-    # find all links in the list of access point and record them all
-    hrefs = []
-    for a in access_list_cond:
-        for link in a.find_all("a", href=True, recursive=False):
-            link_href = link["href"].strip("/")
-            if not "." in link_href:
-                hrefs.append(link_href)
-
-    # add links to outputs
+    else:
+        hrefs = record.hrefs(None if condition is None else condition(list(record.access_lines)))
     outputs = [hrefs]
 
     # determine map name
     if return_map_name:
-        map_name_text = map_site.find("strong", string=lambda s: s and "map name" in s.lower())
-        map_name = map_name_text.next_sibling.get_text().strip()
-        if len(map_name) == 0:
+        if record.map_name is None:
+            raise AttributeError(f"{map_extension} has no map name")
+        map_name = record.map_name
+        if len(map_name) == 0 and not record.inline_access:
             map_name = f"/{map_extension}"
         outputs.append(map_name)
 
     # determine permanence (based on seasonality, rarity of room) of room
     if return_permanence:
-        is_seasonal = "seasonal" in map_site.find("div", {"class": "page-tags"}).get_text()
-        is_rare = "rare" in map_site.find("div", {"class": "page-tags"}).get_text()
-        is_permanent = is_seasonal == False and is_rare == False
-        outputs.append(is_permanent)
+        outputs.append(record.is_permanent)
 
     # return outputs
     return outputs
 
 
-##################################################################################################
-################################## RECURSIVE WIKI CRAWL ##########################################
-##################################################################################################
-def aqw_wiki_crawl(starting_rooms, degree = 16, pursue_impermanent=False, condition="none", sleep_duration = 1, verbose=2):
-    if condition == "none":
-        condition_func = None
-    elif condition == "geo":
-        condition_func = is_loc_geographic
-
-    # time the crawl
-    start = time.time()
-    
-    # instantiate global variables
-    visited = set()
-    link_to_name_dict = {}
-    link_to_permanence_dict = {}
-    G = nx.DiGraph()
-    query_counter = [0]
-
-    # define recursive function
-    # (recursively traverses all access points to a room)
-    def expand_graph(room, degree, pursue_impermanent=False, sleep_duration=1, verbose=2):
-        # retrieve access points, room name
-        result = get_connected_rooms(room, 
-                                     return_map_name=True, 
-                                     return_permanence=True,
-                                     condition=condition_func,
-                                     sleep_duration=sleep_duration)
-        if result is None:
-            return None
-        else:
-            access_points, map_name, is_permanent = result
-
-        query_counter[0] = query_counter[0] + 1
-    
-        # update room info
-        visited.add(room)
-        link_to_name_dict[room] = map_name
-        link_to_permanence_dict[room] = is_permanent
-
-        # if the access point is permanent or we pursue impermanent access points...
-        if is_permanent or pursue_impermanent:
-            # add room access points to graph
-            for access_point in access_points:
-                G.add_edge(access_point, room)
-
-            # filter access points to those we haven't visited
-            new_rooms = set(access_points) - visited
-            # if new rooms exist and degree > 0, traverse access points of each new room
-            if degree > 0 and len(new_rooms) > 0:
-                for new_room in new_rooms:
-                    if verbose > 1:
-                        print(f"[{len(visited)}] {str(room)}<={new_room}")
-                    expand_graph(new_room, 
-                                 degree = degree - 1, 
-                                 pursue_impermanent=pursue_impermanent,
-                                 sleep_duration=sleep_duration,
-                                 verbose=verbose)
-        return None
-
-    non_location_links = ["game-menu", "maps"]
-    for starting_room in starting_rooms:
-        if starting_room not in visited and not starting_room in non_location_links:
-            # run recursive function
-            expand_graph(starting_room, 
-                         degree=degree, 
-                         pursue_impermanent=pursue_impermanent, 
-                         sleep_duration=sleep_duration,
-                         verbose=verbose)
-
-    end = time.time()
-    crawl_time = end - start
-    if verbose > 0:
-        print(f"{query_counter[0]} webpages crawled.")
-        print(f"Crawl of degree {degree} complete in {crawl_time} seconds.")
+# manual corrections to connections listed on the WiKi
+def fix_wiki_edges(G):
+    from graph_tools import try_remove_edge
 
     # add links missed on the WiKi
     G.add_edge("mobius", "greenguard-west")
@@ -347,81 +215,574 @@ def aqw_wiki_crawl(starting_rooms, degree = 16, pursue_impermanent=False, condit
     try_remove_edge(G, "yokai-star-river", "akiba")
 
     try_remove_edge(G, "battleon", "grimskull-annex")
+    return G
+
+
+# labels each node of G with its hop distance from the starting rooms
+# (access points of the outermost crawled rooms are one hop further than the rooms listing them)
+def label_hops(G, hops):
+    for node in G.nodes():
+        if node in hops:
+            G.nodes[node]["hops"] = hops[node]
+        else:
+            successor_hops = [hops[successor] for successor in G.successors(node) if successor in hops]
+            if len(successor_hops) > 0:
+                G.nodes[node]["hops"] = min(successor_hops) + 1
+    return G
+
+
+##################################################################################################
+######################################### WIKI CRAWL #############################################
+##################################################################################################
+def aqw_wiki_crawl(starting_rooms, degree = 16, pursue_impermanent=False, condition="none", sleep_duration = 1, verbose=2,
+                   concurrency=1, requests_per_second=None, base_url=BASE_URL, cache=None, journal_loc=None, resume=False,
+                   order="bfs", region_to_loc_dict=None, parsers=0, retry_passes=1, region_stream=None, limiter=None):
+    import networkx as nx
+    from aqw_async_crawl import crawl_async
+    from crawl_journal import CrawlJournal
+    from crawl_frontier import make_frontier
+
+    if condition == "none":
+        condition_func = None
+    elif condition == "geo":
+        condition_func = classify_geographic
+
+    # time the crawl
+    start = time.time()
+    crawl_timestamp = start
+    
+    # instantiate global variables
+    visited = set()
+    link_to_name_dict = {}
+    link_to_permanence_dict = {}
+    link_to_access_points_dict = {}
+    link_to_page_hash_dict = {}
+    G = nx.DiGraph()
+    query_counter = [0]
+
+    non_location_links = ["game-menu", "maps"]
+
+    # journal progress so an interrupted crawl can be resumed
+    if journal_loc is None:
+        journal = None
+    else:
+        journal_params = {"starting_rooms": sorted(starting_rooms),
+                          "degree": degree,
+                          "pursue_impermanent": pursue_impermanent,
+                          "condition": condition}
+        journal = CrawlJournal(journal_loc, journal_params, resume=resume)
+        if verbose > 0 and len(journal.results) > 0:
+            print(f"Resuming crawl with {len(journal.results)} webpages already crawled.")
+
+    # records a page result
+    # (results journaled before page hashes were recorded don't have one)
+    def record_room(room, result):
+        access_points, map_name, is_permanent = result[:3]
+        query_counter[0] = query_counter[0] + 1
+
+        # update room info
+        visited.add(room)
+        link_to_name_dict[room] = map_name
+        link_to_permanence_dict[room] = is_permanent
+        link_to_access_points_dict[room] = access_points
+        if len(result) > 3:
+            link_to_page_hash_dict[room] = result[3]
+
+        # if the access point is permanent or we pursue impermanent access points, add room access points to graph
+        if is_permanent or pursue_impermanent:
+            for access_point in access_points:
+                G.add_edge(access_point, room)
+        return None
+
+    # locations of regions from region_stream (pairs of region and locations) become starting rooms as they arrive
+    # and are added to region_to_loc_dict (region ordering needs every region up front, so the stream is drained first)
+    starting_rooms = list(starting_rooms)
+    if region_stream is not None and region_to_loc_dict is None:
+        region_to_loc_dict = {}
+    if region_stream is not None and order == "region":
+        for region, locs in region_stream:
+            region_to_loc_dict[region] = locs
+            starting_rooms.extend(locs)
+        region_stream = None
+
+    def stream_starting_rooms():
+        for region, locs in region_stream:
+            region_to_loc_dict[region] = locs
+            starting_rooms.extend(locs)
+            yield [room for room in locs if room not in non_location_links]
+
+    # rooms wait in the frontier with their hop distance from the starting rooms
+    frontier = make_frontier(order, region_to_loc_dict)
+    hops = {}
+    # rooms whose pages couldn't be retrieved, retried once the frontier is exhausted
+    failed_rooms = set()
+
+    # adds a room to the frontier if it is new or was reached by a shorter path
+    def schedule(room, room_hops, parent=None):
+        if room in hops and hops[room] <= room_hops:
+            return None
+        hops[room] = room_hops
+        frontier.push(room, room_hops, parent)
+        if journal is not None:
+            journal.record_scheduled(room, room_hops)
+        return None
+
+    # crawls rooms until the frontier is exhausted
+    # rooms are expanded while within `degree` hops of the starting rooms
+    # (a room reached again by a shorter path is re-expanded from its recorded access points, not refetched)
+    def expand_frontier():
+        while len(frontier) > 0:
+            room, room_hops = frontier.pop()
+            # skip entries superseded by a shorter path
+            if room_hops > hops[room]:
+                continue
+
+            if room not in visited:
+                # retrieve access points, room name (from the journal if resuming)
+                if journal is not None and room in journal.results:
+                    result = journal.results[room]
+                else:
+                    result = get_connected_rooms(room, 
+                                                 return_map_name=True, 
+                                                 return_permanence=True,
+                                                 condition=condition_func,
+                                                 sleep_duration=sleep_duration,
+                                                 base_url=base_url,
+                                                 cache=cache,
+                                                 limiter=limiter,
+                                                 return_page_hash=True)
+                    if journal is not None and result is not None:
+                        journal.record_page(room, result)
+                if result is not None:
+                    record_room(room, result)
+                else:
+                    failed_rooms.add(room)
+
+            # traverse access points of the room
+            if room in visited and (link_to_permanence_dict[room] or pursue_impermanent):
+                for access_point in link_to_access_points_dict[room]:
+                    frontier.seen(access_point)
+                    if room_hops < degree:
+                        if verbose > 1 and access_point not in hops:
+                            print(f"[{len(visited)}] {str(room)}<={access_point}")
+                        schedule(access_point, room_hops + 1, room)
+            if journal is not None:
+                journal.record_expanded(room, room_hops)
+        return None
+
+    try:
+        if concurrency > 1 or parsers > 0:
+            # concurrent crawl, politeness is enforced by a shared rate limiter instead of sleeps
+            if requests_per_second is None:
+                requests_per_second = 1 / sleep_duration if sleep_duration > 0 else np.inf
+            # (a partial of module-level functions, so it can be sent to parser processes)
+            parse_page = partial(parse_connected_rooms,
+                                 return_map_name=True,
+                                 return_permanence=True,
+                                 condition=condition_func,
+                                 return_page_hash=True)
+            # only expand access points of permanent rooms (unless we pursue impermanent access points)
+            get_children = lambda result: result[0] if result[2] or pursue_impermanent else []
+            results, hops = asyncio.run(crawl_async([room for room in starting_rooms if room not in non_location_links],
+                                                    parse_page,
+                                                    get_children,
+                                                    degree=degree,
+                                                    base_url=base_url,
+                                                    concurrency=concurrency,
+                                                    requests_per_second=requests_per_second,
+                                                    cache=cache,
+                                                    journal=journal,
+                                                    frontier=frontier,
+                                                    parsers=parsers,
+                                                    retry_passes=retry_passes,
+                                                    verbose=verbose,
+                                                    starting_room_stream=None if region_stream is None else stream_starting_rooms(),
+                                                    limiter=limiter))
+            # fold page results into the graph exactly as the serial crawl does
+            for room, result in results.items():
+                if result is not None:
+                    record_room(room, result)
+                else:
+                    failed_rooms.add(room)
+        else:
+            # serial crawl, sleeping before each request, or waiting on the limiter if one is given
+            # (region pages are pulled at the same time, so they must share its budget)
+            if journal is not None and len(journal.scheduled) > 0:
+                # resume: completed pages are not fetched again and the pending frontier is restored
+                for room, result in journal.results.items():
+                    record_room(room, result)
+                journal.restore_frontier(frontier, hops)
+            else:
+                for starting_room in starting_rooms:
+                    if not starting_room in non_location_links:
+                        schedule(starting_room, 0)
+            expand_frontier()
+            if region_stream is not None:
+                for rooms in stream_starting_rooms():
+                    for starting_room in rooms:
+                        schedule(starting_room, 0)
+                    expand_frontier()
+
+            # retry pages that failed, continuing the crawl from any that now succeed
+            for _ in range(retry_passes):
+                failed_rooms = failed_rooms - visited
+                if len(failed_rooms) == 0:
+                    break
+                if verbose > 0:
+                    print(f"Retrying {len(failed_rooms)} failed webpages.")
+                for room in failed_rooms:
+                    frontier.push(room, hops[room])
+                failed_rooms = set()
+                expand_frontier()
+    finally:
+        # flush any buffered journal records (also on errors and Ctrl-C)
+        if journal is not None:
+            journal.close()
+    failed_rooms = failed_rooms - visited
+    label_hops(G, hops)
 
-    crawl_params = {"starting_rooms": starting_rooms,
+    end = time.time()
+    crawl_time = end - start
+    if verbose > 0:
+        print(f"{query_counter[0]} webpages crawled.")
+        if len(failed_rooms) > 0:
+            print(f"{len(failed_rooms)} webpages could not be retrieved.")
+        print(f"Crawl of degree {degree} complete in {crawl_time} seconds.")
+
+    # add links missed on the WiKi (and remove spurious ones)
+    fix_wiki_edges(G)
+
+    crawl_params = {"starting_rooms": list(dict.fromkeys(starting_rooms)),
                     "degree": degree,
+                    "order": order,
                     "pursue_impermanent": pursue_impermanent,
                     "condition": condition,
                     "sleep_duration": sleep_duration,
+                    "concurrency": concurrency,
+                    "parsers": parsers,
+                    "requests_per_second": requests_per_second,
                     "verbose": verbose}
     output_dict = {"crawl_params": crawl_params,
+                   "crawl_timestamp": crawl_timestamp,
+                   "crawl_time": crawl_time,
+                   "requests": query_counter[0],
+                   "link_to_name_dict": link_to_name_dict,
+                   "link_to_permanence_dict": link_to_permanence_dict,
+                   "link_to_access_points_dict": link_to_access_points_dict,
+                   "link_to_hops_dict": {room: hops[room] for room in visited},
+                   "link_to_page_hash_dict": link_to_page_hash_dict,
+                   "failed_pages": sorted(failed_rooms),
+                   "DiGraph": G}
+    return output_dict
+
+
+##################################################################################################
+################################## INCREMENTAL WIKI RECRAWL ######################################
+##################################################################################################
+# returns the set of wiki extensions changed since the timestamp `since` according to the site-changes feed
+# returns None if the feed is unavailable or doesn't reach back far enough to cover all changes
+def get_changed_pages(since, base_url=BASE_URL, sleep_duration=1):
+    import requests
+    from http_client import http_get
+
+    metrics.sleep(sleep_duration, "politeness")
+    try:
+        res = http_get(f"{base_url}/feed/site-changes.xml")
+        feed = ET.fromstring(res.content)
+    except (requests.RequestException, ET.ParseError):
+        return None
+
+    changed_pages = set()
+    oldest_change = np.inf
+    for item in feed.iter("item"):
+        try:
+            change_time = parsedate_to_datetime(item.findtext("pubDate")).timestamp()
+        except (TypeError, ValueError):
+            return None
+        oldest_change = min(oldest_change, change_time)
+        if change_time >= since:
+            changed_pages.add(item.findtext("link").strip().strip("/").split("/")[-1])
+
+    # the feed only lists the most recent changes, so older changes may be missing
+    if oldest_change > since:
+        return None
+    return changed_pages
+
+
+# updates the outputs of a previous crawl, refetching only pages that changed since then
+# changed pages are found with the site-changes feed, falling back on per-page validators in the cache
+# (if neither is available every previously crawled page is refetched)
+def aqw_wiki_recrawl(previous_outputs, starting_rooms=None, use_feed=True, sleep_duration=1, verbose=2, base_url=BASE_URL, cache=None):
+    import requests
+    import networkx as nx
+    from page_cache import get_page_text
+
+    crawl_params = previous_outputs["crawl_params"].copy()
+    degree = crawl_params["degree"]
+    pursue_impermanent = crawl_params["pursue_impermanent"]
+    condition = crawl_params["condition"]
+    if starting_rooms is None:
+        starting_rooms = crawl_params["starting_rooms"]
+    if condition == "none":
+        condition_func = None
+    elif condition == "geo":
+        condition_func = classify_geographic
+
+    # time the crawl
+    start = time.time()
+
+    link_to_name_dict = previous_outputs["link_to_name_dict"].copy()
+    link_to_permanence_dict = previous_outputs["link_to_permanence_dict"].copy()
+    link_to_access_points_dict = previous_outputs.get("link_to_access_points_dict", None)
+    G_prev = previous_outputs["DiGraph"]
+    if link_to_access_points_dict is None:
+        # older outputs don't record access points, so recover them from the raw graph
+        link_to_access_points_dict = {room: list(G_prev.predecessors(room)) if room in G_prev else [] for room in link_to_name_dict}
+    else:
+        link_to_access_points_dict = link_to_access_points_dict.copy()
+    # sha256 of each page as the previous crawl saw it (see page_hash)
+    link_to_page_hash_dict = previous_outputs.get("link_to_page_hash_dict", {}).copy()
+    query_counter = [0]
+    # rooms whose pages couldn't be retrieved (previously crawled ones keep what the previous crawl recorded)
+    failed_rooms = set()
+
+    def update_room(room, result):
+        access_points, map_name, is_permanent, page_sha256 = result
+        link_to_name_dict[room] = map_name
+        link_to_permanence_dict[room] = is_permanent
+        link_to_access_points_dict[room] = access_points
+        link_to_page_hash_dict[room] = page_sha256
+        return None
+
+    def fetch_room(room):
+        if cache is not None:
+            cache.invalidate(f"{base_url}/{room}")
+        result = get_connected_rooms(room,
+                                     return_map_name=True,
+                                     return_permanence=True,
+                                     condition=condition_func,
+                                     sleep_duration=sleep_duration,
+                                     base_url=base_url,
+                                     cache=cache,
+                                     return_page_hash=True)
+        if result is not None:
+            query_counter[0] = query_counter[0] + 1
+            update_room(room, result)
+        else:
+            failed_rooms.add(room)
+        return result
+
+    # determine which previously crawled pages changed and refetch them
+    changed_pages = None
+    if use_feed and previous_outputs.get("crawl_timestamp", None) is not None:
+        changed_pages = get_changed_pages(previous_outputs["crawl_timestamp"], base_url=base_url, sleep_duration=sleep_duration)
+    if changed_pages is not None:
+        # (pages the previous crawl couldn't retrieve may have changed before it, so they are refetched too)
+        changed_pages = (changed_pages | set(previous_outputs.get("failed_pages", []))) & set(link_to_name_dict.keys())
+        for room in changed_pages:
+            fetch_room(room)
+    else:
+        # refetch every page (revalidating it if there is a page cache), only pages that differ from what the
+        # previous crawl saw are reparsed
+        # (compared by hash rather than by whether the cache changed, since the cache is shared with other runs,
+        # and pages without a recorded hash count as changed)
+        changed_pages = set()
+        for room in list(link_to_name_dict.keys()):
+            url = f"{base_url}/{room}"
+            try:
+                if cache is not None:
+                    metrics.sleep(sleep_duration, "politeness")
+                    page_text, _ = cache.conditional_fetch(url)
+                else:
+                    page_text = get_page_text(url, wait=lambda: metrics.sleep(sleep_duration, "politeness"))
+            except requests.RequestException as e:
+                # the http client already retried, so keep the page as previously crawled
+                print(f"{room} request failed: {e}")
+                failed_rooms.add(room)
+                continue
+            if page_hash(page_text) == link_to_page_hash_dict.get(room, None):
+                continue
+            changed_pages.add(room)
+            result = parse_connected_rooms(room, page_text,
+                                           return_map_name=True,
+                                           return_permanence=True,
+                                           condition=condition_func,
+                                           return_page_hash=True)
+            if result is None:
+                fetch_room(room)
+            else:
+                query_counter[0] = query_counter[0] + 1
+                update_room(room, result)
+    if verbose > 0:
+        print(f"{len(changed_pages)} webpages changed since previous crawl.")
+
+    # walk the updated access points from the starting rooms, fetching newly discovered rooms
+    # (rooms at hop distance `degree` are recorded but not expanded, as in aqw_wiki_crawl)
+    non_location_links = ["game-menu", "maps"]
+    hops = {room: 0 for room in starting_rooms if room not in non_location_links}
+    frontier = deque(hops.keys())
+    reached = []
+    while len(frontier) > 0:
+        room = frontier.popleft()
+        if room not in link_to_name_dict:
+            if verbose > 1:
+                print(f"[{len(reached)}] new room {room}")
+            if fetch_room(room) is None:
+                continue
+        reached.append(room)
+        if (link_to_permanence_dict[room] or pursue_impermanent) and hops[room] < degree:
+            for access_point in link_to_access_points_dict[room]:
+                if access_point not in hops:
+                    hops[access_point] = hops[room] + 1
+                    frontier.append(access_point)
+
+    # drop rooms that are no longer reachable and rebuild the graph from the access points
+    link_to_name_dict = {room: link_to_name_dict[room] for room in reached}
+    link_to_permanence_dict = {room: link_to_permanence_dict[room] for room in reached}
+    link_to_access_points_dict = {room: link_to_access_points_dict[room] for room in reached}
+    G = nx.DiGraph()
+    for room in reached:
+        if link_to_permanence_dict[room] or pursue_impermanent:
+            for access_point in link_to_access_points_dict[room]:
+                G.add_edge(access_point, room)
+    label_hops(G, hops)
+    fix_wiki_edges(G)
+
+    prev_edges = set(G_prev.edges())
+    new_edges = set(G.edges())
+    recrawl_delta = {"changed_pages": sorted(changed_pages),
+                     "added_edges": sorted(new_edges - prev_edges),
+                     "removed_edges": sorted(prev_edges - new_edges)}
+
+    end = time.time()
+    crawl_time = end - start
+    if verbose > 0:
+        print(f"{query_counter[0]} webpages crawled.")
+        if len(failed_rooms) > 0:
+            print(f"{len(failed_rooms)} webpages could not be retrieved.")
+        print(f"{len(recrawl_delta['added_edges'])} edges added, {len(recrawl_delta['removed_edges'])} edges removed.")
+        print(f"Incremental crawl complete in {crawl_time} seconds.")
+
+    crawl_params["starting_rooms"] = starting_rooms
+    output_dict = {"crawl_params": crawl_params,
+                   "crawl_timestamp": start,
                    "crawl_time": crawl_time,
                    "requests": query_counter[0],
                    "link_to_name_dict": link_to_name_dict,
                    "link_to_permanence_dict": link_to_permanence_dict,
+                   "link_to_access_points_dict": link_to_access_points_dict,
+                   "link_to_hops_dict": {room: hops[room] for room in reached},
+                   "link_to_page_hash_dict": {room: link_to_page_hash_dict[room] for room in reached if room in link_to_page_hash_dict},
+                   "failed_pages": sorted(failed_rooms),
+                   "recrawl_delta": recrawl_delta,
                    "DiGraph": G}
     return output_dict
 
 
-# saves crawl outputs
-def save_crawl_outputs(crawl_outputs, loc="crawl_data.json"):
-    crawl_params = crawl_outputs["crawl_params"]
-    crawl_time = crawl_outputs["crawl_time"]
-    query_counter = crawl_outputs["requests"]
+# loads crawl outputs saved by save_crawl_outputs in the format returned by aqw_wiki_crawl
+# (only the raw digraph is read from a compact .npz store)
+def load_crawl_outputs(loc="crawl_data.json"):
+    import networkx as nx
+    from crawl_store import CrawlStore
+
+    if loc.endswith(".npz"):
+        store = CrawlStore(loc)
+        crawl_outputs = store.load_outputs(graphs=[])
+        crawl_outputs["DiGraph"] = store.graph("DiGraph_Raw")
+        return crawl_outputs
+    with open(loc, "r") as f:
+        crawl_output_json = json.load(f)
+    crawl_outputs = {k: v for k, v in crawl_output_json.items() if k not in ["DiGraph_Raw", "DiGraph_Proc", "Graph_Undir"]}
+    crawl_outputs["DiGraph"] = nx.node_link_graph(crawl_output_json["DiGraph_Raw"], directed=True)
+    return crawl_outputs
+
+
+# returns the raw digraph, and the processed digraph and the undirected graph of crawl outputs as compact graphs
+def build_output_graphs(crawl_outputs):
+    from compact_graph import CompactGraph
+
     link_to_name_dict = crawl_outputs["link_to_name_dict"]
     link_to_permanence_dict = crawl_outputs["link_to_permanence_dict"]
     G = crawl_outputs["DiGraph"]
 
-    crawl_output_json = {}
-    crawl_output_json["crawl_params"] = crawl_params
-    crawl_output_json["crawl_time"] = crawl_time
-    crawl_output_json["requests"] = query_counter
-    crawl_output_json["link_to_name_dict"] = link_to_name_dict.copy()
-    crawl_output_json["link_to_permanence_dict"] = link_to_permanence_dict.copy()
-    crawl_output_json["DiGraph_Raw"] = nx.node_link_data(G)
-
     # process digraph
     # remove non-permanent rooms, relabel nodes to correspond to names rather than wiki extensions
-    perm_links = {link for link, permanence in link_to_permanence_dict.items() if permanence}
-    G_perm = G.subgraph(perm_links).copy()
-    G_perm_relabel = nx.relabel_nodes(G_perm, link_to_name_dict)
+    G_compact = CompactGraph.from_networkx(G)
+    G_perm_relabel = G_compact.subgraph([link_to_permanence_dict.get(link, False) for link in G_compact.names]).relabel(link_to_name_dict)
     # remove links that have "N/A" in them, signifying that they aren't locations
-    loc_links = [loc for loc in list(G_perm_relabel.nodes()) if "N/A" not in loc]
-    G_perm_relabel = G_perm_relabel.subgraph(loc_links).copy()
-    crawl_output_json["DiGraph_Proc"] = nx.node_link_data(G_perm_relabel)
+    G_perm_relabel = G_perm_relabel.subgraph(["N/A" not in loc for loc in G_perm_relabel.names])
 
     # get undirected graph, keeping only reciprocated edges
-    edges_to_keep = [(u, v) for u, v in G_perm_relabel.edges() if G_perm_relabel.has_edge(v, u)]
-    G_perm_relabel_undir = nx.DiGraph()
-    G_perm_relabel_undir.add_edges_from(edges_to_keep)
-    G_perm_relabel_undir = G_perm_relabel_undir.to_undirected()
-    crawl_output_json["Graph_Undir"] = nx.node_link_data(G_perm_relabel_undir)  # convert to serializable format
+    G_perm_relabel_undir = G_perm_relabel.reciprocated()
+    return G, G_perm_relabel, G_perm_relabel_undir
+
+
+# saves crawl outputs, as JSON or (if loc ends in .npz) as a compact store (see crawl_store.py)
+# graphs already built by build_output_graphs can be passed in to avoid rebuilding them
+def save_crawl_outputs(crawl_outputs, loc="crawl_data.json", graphs=None):
+    import networkx as nx
+    from crawl_store import save_crawl_store
+
+    crawl_output_json = {}
+    crawl_output_json["crawl_params"] = crawl_outputs["crawl_params"]
+    crawl_output_json["crawl_time"] = crawl_outputs["crawl_time"]
+    crawl_output_json["requests"] = crawl_outputs["requests"]
+    crawl_output_json["link_to_name_dict"] = crawl_outputs["link_to_name_dict"].copy()
+    crawl_output_json["link_to_permanence_dict"] = crawl_outputs["link_to_permanence_dict"].copy()
+    for key in ["crawl_timestamp", "link_to_access_points_dict", "link_to_hops_dict", "link_to_page_hash_dict", "failed_pages", "recrawl_delta"]:
+        if key in crawl_outputs:
+            crawl_output_json[key] = crawl_outputs[key]
+    if graphs is None:
+        graphs = build_output_graphs(crawl_outputs)
+    G, G_perm_relabel, G_perm_relabel_undir = graphs
+
+    if loc.endswith(".npz"):
+        crawl_output_json["DiGraph_Raw"] = G
+        crawl_output_json["DiGraph_Proc"] = G_perm_relabel
+        crawl_output_json["Graph_Undir"] = G_perm_relabel_undir
+        save_crawl_store(crawl_output_json, loc)
+        return
+
+    # convert to serializable format
+    crawl_output_json["DiGraph_Raw"] = nx.node_link_data(G)
+    crawl_output_json["DiGraph_Proc"] = G_perm_relabel.node_link_data()
+    crawl_output_json["Graph_Undir"] = G_perm_relabel_undir.node_link_data()
 
     # save outputs
     with open(loc, "w") as f:
         json.dump(crawl_output_json, f, indent=4)
 
 
+# files written by plot_crawl_outputs (besides the cytoscape exports, see export_cytoscape)
+plot_output_files = ["aqw_graph_undir.svg", "aqw_graph_dir_raw.svg", "aqw_graph_dir_filt.svg", "aqw_nodes_degree.svg"]
+
+
+# plots crawl outputs and returns the paths of the files written
+# (png_dpi also rasterizes the graph figures to PNG, and pool is a concurrent.futures executor for layouts and renders)
 def plot_crawl_outputs(crawl_outputs, 
                        region_color_map, 
                        region_to_loc_map, 
-                       save_loc="", **kwargs):
+                       save_loc="", png_dpi=None, pool=None, **kwargs):
+    from compact_graph import as_compact
+    from graph_tools import remove_unreciprocated_nodes, assign_by_neighbor
+    from graph_analytics import level_profile, component_diameters
+    from graph_plotting import multi_component_graph, export_cytoscape
+    from graph_render import render_arrays, render_graph, render_nodes_degree
+
     region_color_map = region_color_map.copy()
     region_to_loc_map = region_to_loc_map.copy()
     
-    crawl_params = crawl_outputs["crawl_params"]
-    crawl_time = crawl_outputs["crawl_time"]
-    query_counter = crawl_outputs["requests"]
     link_to_name_dict = crawl_outputs["link_to_name_dict"]
-    link_to_permanence_dict = crawl_outputs["link_to_permanence_dict"]
 
-    Graph_Undir = nx.node_link_graph(crawl_outputs["Graph_Undir"], directed=False)
-    DiGraph_Proc = nx.node_link_graph(crawl_outputs["DiGraph_Proc"], directed=True)
-    all_nodes = set(list(Graph_Undir.nodes()) + list(DiGraph_Proc.nodes())) 
+    # graphs of crawl outputs may be compact graphs, networkx graphs or node-link data (loaded from JSON)
+    # they are processed as compact graphs, and only converted to networkx graphs for layouts and drawing
+    Graph_Undir_compact = as_compact(crawl_outputs["Graph_Undir"], directed=False)
+    DiGraph_Proc_compact = as_compact(crawl_outputs["DiGraph_Proc"], directed=True)
+    all_nodes = set(Graph_Undir_compact.names + DiGraph_Proc_compact.names)
 
     # filter out connections to hub nodes
     hub_nodes = ["battleon", "battleontown", "castle"]
-    DiGraph_Proc_filt = remove_unreciprocated_nodes(DiGraph_Proc, hub_nodes)
+    DiGraph_Proc_filt_compact = remove_unreciprocated_nodes(DiGraph_Proc_compact, hub_nodes)
 
     # remap to locations
     region_to_loc_map_filt = {}
@@ -444,160 +805,499 @@ def plot_crawl_outputs(crawl_outputs,
             loc_to_region_map[loc] = region
 
     # assign regions to colors
-    loc_to_region_map = assign_by_neighbor(Graph_Undir, loc_to_region_map)
-    loc_to_region_map = assign_by_neighbor(DiGraph_Proc_filt.to_undirected(), loc_to_region_map)
+    loc_to_region_map = assign_by_neighbor(Graph_Undir_compact, loc_to_region_map)
+    loc_to_region_map = assign_by_neighbor(DiGraph_Proc_filt_compact.to_undirected(), loc_to_region_map)
     
     for node in all_nodes - set(loc_to_region_map.keys()):
         loc_to_region_map[node] = "Unknown"
     
     loc_to_color_map = {k: region_color_map.get(v, "lightblue") for k, v in loc_to_region_map.items()}
 
+    Graph_Undir = Graph_Undir_compact.to_networkx()
+    DiGraph_Proc = DiGraph_Proc_compact.to_networkx()
+    DiGraph_Proc_filt = DiGraph_Proc_filt_compact.to_networkx()
+
+    # cytoscape elements are written as they are generated, alongside level-of-detail bundles
+    cytoscape_files = []
+    # figures are rendered from position arrays (see graph_render.py), in the pool's worker processes if there is one,
+    # so each graph renders while the next is laid out (renders time themselves, as telemetry stages of their own)
+    renders = []
+    def render(stage, function, *args, **render_kwargs):
+        if pool is None:
+            with metrics.stage(stage):
+                function(*args, **render_kwargs)
+        else:
+            renders.append((stage, pool.submit(timed_call, function, *args, **render_kwargs)))
+    def png_loc(name):
+        return None if png_dpi is None else f"{save_loc}/{name}.png"
+
     # plot undirected graph
     #################################################################################
-    pos = multi_component_graph(Graph_Undir, **kwargs)
-    fig, ax = plt.subplots(figsize=[48, 32])
+    with metrics.stage("layout_undir"):
+        pos = multi_component_graph(Graph_Undir, pool=pool, **kwargs)
     G = Graph_Undir.subgraph(pos.keys())
-    to_cytoscape(G, pos, loc_to_color_map, loc_to_region_map, f"{save_loc}/aqw_graph_undir_ct.json")
-    nx.draw(G, 
-            pos, 
-            with_labels=True, 
-            node_size=1000, 
-            node_color=[loc_to_color_map[node] for node in G.nodes()], 
-            ax=ax)
-    fig.tight_layout()
-    # fig.savefig(f"{save_loc}/aqw_graph_undir.png", dpi=300)
-    fig.savefig(f"{save_loc}/aqw_graph_undir.svg")
+    with metrics.stage("export_undir"):
+        cytoscape_files += export_cytoscape(G, pos, loc_to_color_map, loc_to_region_map,
+                                            save_loc=f"{save_loc}/aqw_graph_undir_ct.json",
+                                            bundle_loc=f"{save_loc}/aqw_graph_undir_ct")
+    render("render_undir", render_graph, *render_arrays(G, pos, loc_to_color_map), f"{save_loc}/aqw_graph_undir.svg",
+           png_loc=png_loc("aqw_graph_undir"), png_dpi=png_dpi, directed=False)
 
     # plot directed graph (unprocessed)
     #################################################################################
-    pos = multi_component_graph(DiGraph_Proc, **kwargs)
-    fig, ax = plt.subplots(figsize=[48, 32])
+    with metrics.stage("layout_dir_raw"):
+        pos = multi_component_graph(DiGraph_Proc, pool=pool, **kwargs)
     G = DiGraph_Proc.subgraph(pos.keys())
-    to_cytoscape(G, pos, loc_to_color_map, loc_to_region_map, f"{save_loc}/aqw_graph_dir_raw_ct.json")
-    nx.draw(G, 
-            pos, 
-            with_labels=True, 
-            node_size=1000, 
-            node_color=[loc_to_color_map.get(node, "lightblue") for node in G.nodes()], 
-            ax=ax)
-    fig.tight_layout()
-    # fig.savefig(f"{save_loc}/aqw_graph_dir_raw.png", dpi=300)
-    fig.savefig(f"{save_loc}/aqw_graph_dir_raw.svg")
+    with metrics.stage("export_dir_raw"):
+        cytoscape_files += export_cytoscape(G, pos, loc_to_color_map, loc_to_region_map,
+                                            save_loc=f"{save_loc}/aqw_graph_dir_raw_ct.json",
+                                            bundle_loc=f"{save_loc}/aqw_graph_dir_raw_ct")
+    render("render_dir_raw", render_graph, *render_arrays(G, pos, loc_to_color_map), f"{save_loc}/aqw_graph_dir_raw.svg",
+           png_loc=png_loc("aqw_graph_dir_raw"), png_dpi=png_dpi, directed=True)
 
     # plot directed graph (filtered)
     #################################################################################
-    pos = multi_component_graph(DiGraph_Proc_filt, **kwargs)
-    fig, ax = plt.subplots(figsize=[48, 32])
+    with metrics.stage("layout_dir_filt"):
+        pos = multi_component_graph(DiGraph_Proc_filt, pool=pool, **kwargs)
     G = DiGraph_Proc_filt.subgraph(pos.keys())
-    to_cytoscape(G, pos, loc_to_color_map, loc_to_region_map, f"{save_loc}/aqw_graph_dir_filt_ct.json")
-    nx.draw(G, 
-            pos, 
-            with_labels=True, 
-            node_size=1000, 
-            arrows=True,
-            node_color=[loc_to_color_map.get(node, "lightblue") for node in G.nodes()], 
-            ax=ax)
-    fig.tight_layout()
-    # fig.savefig(f"{save_loc}/aqw_graph_dir_filt.png", dpi=300)
-    fig.savefig(f"{save_loc}/aqw_graph_dir_filt.svg")
+    with metrics.stage("export_dir_filt"):
+        cytoscape_files += export_cytoscape(G, pos, loc_to_color_map, loc_to_region_map,
+                                            save_loc=f"{save_loc}/aqw_graph_dir_filt_ct.json",
+                                            bundle_loc=f"{save_loc}/aqw_graph_dir_filt_ct")
+    render("render_dir_filt", render_graph, *render_arrays(G, pos, loc_to_color_map), f"{save_loc}/aqw_graph_dir_filt.svg",
+           png_loc=png_loc("aqw_graph_dir_filt"), png_dpi=png_dpi, directed=True)
 
     # plot undirected graph size as fxn of degree
     #################################################################################
     max_degree_room = max(DiGraph_Proc.degree, key=lambda x: x[1])[0]
 
     # plot num nodes vs degree
-    fig, ax = plt.subplots(figsize=[6, 4])
-    nodes_from_start = []
-    degree = crawl_params["degree"]
-    diameters = [nx.diameter(DiGraph_Proc.subgraph(c).to_undirected()) for c in nx.weakly_connected_components(DiGraph_Proc)]
-    for k in range(max(diameters)+1):
-        nodes_within_k = nx.single_source_shortest_path_length(DiGraph_Proc, max_degree_room, cutoff=k).keys()
-        nodes_from_start.append(len(nodes_within_k))    
-    ax.plot(nodes_from_start, 'o-')
-    ax.xaxis.set_major_locator(MaxNLocator(integer=True))
-    ax.yaxis.set_major_locator(MaxNLocator(integer=True))
-    ax.set_xlabel(f"Degrees from {max_degree_room}")
-    ax.set_ylabel("Locations")
-    fig.tight_layout()
-    # fig.savefig(f"{save_loc}/aqw_nodes_degree.png", dpi=300)
-    fig.savefig(f"{save_loc}/aqw_nodes_degree.svg", dpi=300)
+    # one BFS gives the number of locations at every hop count, out to the largest component diameter
+    with metrics.stage("diameter"):
+        max_diameter = max(component_diameters(DiGraph_Proc))
+        nodes_within = np.cumsum(level_profile(DiGraph_Proc, [max_degree_room]))
+    nodes_from_start = nodes_within[np.minimum(np.arange(max_diameter+1), len(nodes_within)-1)]
+    render("render_nodes_degree", render_nodes_degree, nodes_from_start, max_degree_room, f"{save_loc}/aqw_nodes_degree.svg")
+
+    # wait for the renders (raising any of their errors)
+    for stage, future in renders:
+        _, wall, cpu = future.result()
+        metrics.record_stage(stage, wall, cpu)
+
+    png_files = [] if png_dpi is None else [png_loc(name[:-len(".svg")]) for name in plot_output_files if name.startswith("aqw_graph")]
+    return [f"{save_loc}/{name}" for name in plot_output_files] + png_files + cytoscape_files
 
 
 ##################################################################################################
 ######################################## MAIN FUNCTION ###########################################
 ##################################################################################################
-def main(args):
-    if args.degree == "inf":
-        degree = np.inf
-    else:
-        degree = args.degree
-    pursue_impermanent = args.pursue_impermanent
-    condition = args.condition # "geo" "none"
+# the pipeline runs as subcommands, each loading only the dependencies of its own stages
+#   regions: pulls the list of regions and the locations of each one (region_map.json)
+#   crawl: crawls the wiki and saves the crawl outputs (crawl_data.json and crawl_data.npz)
+#   build: rebuilds the processed graphs of the saved crawl, and their route indexes
+#   plot: plots the saved crawl
+#   query: answers route queries from the route indexes (see route_index.py)
+# without a subcommand, the whole pipeline runs (crawl, route indexes and plots)
+COMMANDS = ["regions", "crawl", "build", "plot", "query", "all"]
+
+
+# files of a run, in the working directory (shared between conditions) or its condition's sub-directory
+def output_locs(condition):
+    working_directory = os.getcwd()
+    os.makedirs(f"{working_directory}/{condition}", exist_ok=True)
+    return {"color_map": f"{working_directory}/region_color_map.json",
+            "region_map": f"{working_directory}/region_map.json",
+            "crawl_output": f"{working_directory}/{condition}/crawl_data.json",
+            "crawl_store": f"{working_directory}/{condition}/crawl_data.npz",
+            "journal": f"{working_directory}/{condition}/crawl_journal.jsonl",
+            "stage_manifest": f"{working_directory}/{condition}/stage_manifest.json",
+            "layout_cache": f"{working_directory}/{condition}/layout_cache",
+            "metrics": f"{working_directory}/{condition}/metrics"}
+
+
+# where pages come from: the wiki (through the page cache, if any), or an archive replayed instead of it
+# returns the cache, the archive (to close once done), and the politeness settings and rate limiter to use
+def open_page_source(args):
+    from http_client import configure_client, set_default_client
+    from page_cache import PageCache
+    from page_archive import PageArchive, ReplayClient, CaptureClient
+    from aqw_async_crawl import TokenBucket
+
     sleep_duration = args.sleep_duration
-    verbose = args.verbose
+    requests_per_second = args.requests_per_second
+    client = configure_client(timeout=args.timeout, max_retries=args.max_retries, pool_size=max(args.concurrency, 10))
+    if args.cache_dir is None:
+        cache = None
+    else:
+        cache = PageCache(args.cache_dir, fresh_for=args.cache_fresh_for, max_size=args.cache_max_size)
+
+    # replay pages from an archive instead of the wiki, or capture the pages of a live crawl to an archive
+    # (the page cache is bypassed so every page passes through the archive)
+    archive = None
+    if args.replay_archive is not None:
+        archive = PageArchive(args.replay_archive)
+        set_default_client(ReplayClient(archive))
+        cache = None
+        sleep_duration = 0
+        requests_per_second = np.inf
+    elif args.capture_archive is not None:
+        archive = PageArchive(args.capture_archive, mode="w")
+        set_default_client(CaptureClient(client, archive))
+        cache = None
+
+    # regions are pulled concurrently within the crawl's request budget
+    if requests_per_second is None:
+        limiter = TokenBucket(1 / sleep_duration if sleep_duration > 0 else np.inf)
+    else:
+        limiter = TokenBucket(requests_per_second)
+    return {"cache": cache,
+            "archive": archive,
+            "sleep_duration": sleep_duration,
+            "requests_per_second": requests_per_second,
+            "limiter": limiter}
 
-    region_list_url = "http://aqwwiki.wikidot.com/locations"
-    working_directory = os.getcwd()
-    color_map_loc = f"{working_directory}/region_color_map.json"
-    region_map_loc = f"{working_directory}/region_map.json"
 
-    os.makedirs(f"{working_directory}/{condition}", exist_ok=True)
-    crawl_output_loc = f"{working_directory}/{condition}/crawl_data.json"
+# list of regions, and a stream of the locations of each region (as their pages arrive)
+def pull_regions(source):
+    from aqw_region_pull import get_region_dict, iter_region_to_loc
 
-    # determine which regions contain which locations
-    region_to_loc_dict = get_region_to_loc_dict(region_url=region_list_url)
-    with open(f"{working_directory}/region_map.json", "w") as f:
+    # (region pages are pulled while the crawl runs, so the two stages overlap)
+    with metrics.stage("region_pull"):
+        region_dict = get_region_dict(REGION_LIST_URL, cache=source["cache"], limiter=source["limiter"])
+    region_stream = metrics.timed_iter("region_pull",
+                                       iter_region_to_loc(region_dict, region_url=REGION_LIST_URL, limiter=source["limiter"], cache=source["cache"]))
+    return region_dict, region_stream
+
+
+# saves the region map, in the order regions are listed
+def save_region_map(region_dict, region_to_loc_dict, loc):
+    region_to_loc_dict = {k: region_to_loc_dict[k] for k in region_dict.keys() if k in region_to_loc_dict}
+    with open(loc, "w") as f:
         json.dump(region_to_loc_dict, f, indent=4)
 
-    # pick a starting room in each non-empty region
-    starting_rooms = [v for k in region_to_loc_dict.keys() for v in region_to_loc_dict[k]]
-    starting_rooms = list(set(starting_rooms))
+
+def run_regions(args, locs, source):
+    region_dict, region_stream = pull_regions(source)
+    region_to_loc_dict = dict(region_stream)
+    with metrics.stage("save"):
+        save_region_map(region_dict, region_to_loc_dict, locs["region_map"])
+    if args.verbose > 0:
+        print(f"{len(region_to_loc_dict)} regions with {sum(len(v) for v in region_to_loc_dict.values())} locations.")
+
+
+# crawls the wiki and saves the crawl outputs, returning them with the processed graphs as compact graphs
+def run_crawl(args, locs, stages, source):
+    from crawl_store import CrawlStore
+
+    if args.degree == "inf":
+        degree = np.inf
+    else:
+        degree = int(args.degree)
+    pursue_impermanent = args.pursue_impermanent
+    condition = args.condition # "geo" "none"
+    sleep_duration = source["sleep_duration"]
+    cache = source["cache"]
+
+    # stages are skipped when their inputs and outputs are unchanged since the last run
+    # the wiki itself is an input of the crawl, so the crawl can only be skipped when replaying an archive
+    # (whose contents are hashed) or when told to reuse the previous crawl
+    crawl_inputs = hash_object({"degree": degree,
+                                "pursue_impermanent": pursue_impermanent,
+                                "condition": condition,
+                                "replay_archive": None if args.replay_archive is None else hash_file(args.replay_archive)})
+    skip_crawl = (args.reuse_crawl or args.replay_archive is not None) and not args.incremental and stages.is_fresh("crawl", crawl_inputs)
+
+    if skip_crawl:
+        if args.verbose > 0:
+            print("Crawl inputs unchanged, reusing previous crawl.")
+        with metrics.stage("load"):
+            return CrawlStore(locs["crawl_store"]).load_outputs(graphs=["DiGraph_Proc", "Graph_Undir"], compact=True)
+
+    stages.invalidate("crawl")
+    region_dict, region_stream = pull_regions(source)
+
+    # load previous crawl if it can be updated incrementally
+    # (from the compact store if there is one, as it loads faster)
+    previous_outputs = None
+    if args.incremental and os.path.exists(locs["crawl_store"]):
+        previous_outputs = load_crawl_outputs(locs["crawl_store"])
+    elif args.incremental and os.path.exists(locs["crawl_output"]):
+        previous_outputs = load_crawl_outputs(locs["crawl_output"])
+    if previous_outputs is not None:
+        previous_params = previous_outputs["crawl_params"]
+        if previous_params["degree"] != degree or previous_params["pursue_impermanent"] != pursue_impermanent:
+            if args.verbose > 0:
+                print("Previous crawl used different parameters, performing full crawl.")
+            previous_outputs = None
 
     # perform crawl and save results
-    crawl_outputs = aqw_wiki_crawl(starting_rooms, 
-                                   degree=degree, 
-                                   pursue_impermanent=pursue_impermanent,
-                                   condition = condition,
-                                   sleep_duration=sleep_duration, 
-                                   verbose=2)
-    save_crawl_outputs(crawl_outputs, loc=crawl_output_loc)
-
-    with open(crawl_output_loc, "r") as f:
-        crawl_outputs = json.load(f)
-    with open(color_map_loc, "r") as f:
+    # every location listed in a region is a starting room
+    with metrics.stage("crawl"):
+        if previous_outputs is not None:
+            region_to_loc_dict = dict(region_stream)
+            # (in a fixed order, so an unchanged wiki gives identical graphs and the plots can be reused)
+            starting_rooms = [v for k in region_dict.keys() if k in region_to_loc_dict for v in region_to_loc_dict[k]]
+            starting_rooms = list(dict.fromkeys(starting_rooms))
+            crawl_outputs = aqw_wiki_recrawl(previous_outputs,
+                                             starting_rooms=starting_rooms,
+                                             sleep_duration=sleep_duration,
+                                             cache=cache,
+                                             verbose=args.verbose)
+        else:
+            # a full crawl starts on the locations of each region as soon as its page arrives
+            region_to_loc_dict = {}
+            crawl_outputs = aqw_wiki_crawl([], 
+                                           degree=degree, 
+                                           pursue_impermanent=pursue_impermanent,
+                                           condition = condition,
+                                           sleep_duration=sleep_duration, 
+                                           concurrency=args.concurrency,
+                                           requests_per_second=source["requests_per_second"],
+                                           cache=cache,
+                                           journal_loc=locs["journal"],
+                                           resume=args.resume,
+                                           order=args.order,
+                                           parsers=args.parsers,
+                                           region_to_loc_dict=region_to_loc_dict,
+                                           region_stream=region_stream,
+                                           limiter=source["limiter"],
+                                           verbose=args.verbose)
+
+    with metrics.stage("save"):
+        save_region_map(region_dict, region_to_loc_dict, locs["region_map"])
+
+    # the processed graphs are built once, saved in both formats and handed to later stages in memory
+    with metrics.stage("build"):
+        graphs = build_output_graphs(crawl_outputs)
+    with metrics.stage("save"):
+        save_crawl_outputs(crawl_outputs, loc=locs["crawl_output"], graphs=graphs)
+        save_crawl_outputs(crawl_outputs, loc=locs["crawl_store"], graphs=graphs)
+    stages.record("crawl", crawl_inputs, [locs["region_map"], locs["crawl_output"], locs["crawl_store"]])
+    # the journal is only needed until the crawl outputs are saved
+    if os.path.exists(locs["journal"]):
+        os.remove(locs["journal"])
+    return dict(crawl_outputs, DiGraph_Proc=graphs[1], Graph_Undir=graphs[2])
+
+
+# builds the route indexes of the processed graphs, returning the crawl outputs and the hashes of their graphs
+# (run on its own, the processed graphs are first rebuilt from the raw graph of the saved crawl, and saved again
+# only if they changed, so unchanged outputs keep their files)
+def run_build(args, locs, stages, crawl_outputs=None):
+    from crawl_store import CrawlStore
+    from route_index import build_route_index, save_route_index, route_index_loc
+
+    graph_hashes = None
+    if crawl_outputs is None:
+        with metrics.stage("load"):
+            crawl_outputs = load_crawl_outputs(locs["crawl_store"] if os.path.exists(locs["crawl_store"]) else locs["crawl_output"])
+        with metrics.stage("build"):
+            graphs = build_output_graphs(crawl_outputs)
+        crawl_outputs = dict(crawl_outputs, DiGraph_Proc=graphs[1], Graph_Undir=graphs[2])
+        graph_hashes = {key: hash_graph(crawl_outputs[key]) for key in ["DiGraph_Proc", "Graph_Undir"]}
+        saved_hashes = None
+        if os.path.exists(locs["crawl_store"]) and os.path.exists(locs["crawl_output"]):
+            store = CrawlStore(locs["crawl_store"])
+            saved_hashes = {key: hash_graph(store.compact(key)) for key in ["DiGraph_Proc", "Graph_Undir"]}
+        if saved_hashes != graph_hashes:
+            with metrics.stage("save"):
+                save_crawl_outputs(crawl_outputs, loc=locs["crawl_output"], graphs=graphs)
+                save_crawl_outputs(crawl_outputs, loc=locs["crawl_store"], graphs=graphs)
+            # the outputs still come from the same crawl
+            stages.refresh("crawl")
+
+    if graph_hashes is None:
+        graph_hashes = {key: hash_graph(crawl_outputs[key]) for key in ["DiGraph_Proc", "Graph_Undir"]}
+
+    # route indexes (see route_index.py) only depend on the processed graphs
+    # (they record the hash of each graph as stored, which queries compare to tell whether they are up to date)
+    store = CrawlStore(locs["crawl_store"])
+    store_hashes = {key: store.graph_hash(key) for key in ["DiGraph_Proc", "Graph_Undir"]}
+    route_inputs = hash_object({"graphs": graph_hashes, "stored_graphs": store_hashes})
+    if not stages.is_fresh("routes", route_inputs):
+        stages.invalidate("routes")
+        route_index_locs = []
+        with metrics.stage("routes"):
+            for key in ["DiGraph_Proc", "Graph_Undir"]:
+                route_index_locs.append(route_index_loc(locs["crawl_store"], key))
+                save_route_index(build_route_index(crawl_outputs[key], key, graph_hash=store_hashes[key]), route_index_locs[-1])
+        stages.record("routes", route_inputs, route_index_locs)
+    return crawl_outputs, graph_hashes
+
+
+# plots the crawl outputs (loaded from the saved crawl if not given)
+def run_plot(args, locs, stages, crawl_outputs=None, graph_hashes=None):
+    from crawl_store import CrawlStore
+    from layout_cache import LayoutCache
+
+    if crawl_outputs is None:
+        with metrics.stage("load"):
+            crawl_outputs = CrawlStore(locs["crawl_store"]).load_outputs(graphs=["DiGraph_Proc", "Graph_Undir"], compact=True)
+    if graph_hashes is None:
+        graph_hashes = {key: hash_graph(crawl_outputs[key]) for key in ["DiGraph_Proc", "Graph_Undir"]}
+
+    with open(locs["color_map"], "r") as f:
         color_map = json.load(f)
-    with open(region_map_loc, "r") as f:
+    with open(locs["region_map"], "r") as f:
         region_map = json.load(f)
-    plot_crawl_outputs(crawl_outputs, 
-                       color_map, 
-                       region_map, 
-                       save_loc=f"{working_directory}/{condition}",
-                       layout="forceatlas2",
-                       r_fraction=0.9, 
-                       min_component_size=3, 
-                       strong_gravity=True,
-                       max_iter=1000
-                      )
-    # plot_crawl_outputs(crawl_outputs, 
-    #                    color_map, 
-    #                    region_map, 
-    #                    save_loc=f"{working_directory}/{condition}",
-    #                    layout="bfs",
-    #                    r_fraction=0.7, 
-    #                    min_component_size=3, 
-    #                   )
+    plot_kwargs = {"layout": args.layout,
+                   "r_fraction": 0.9,
+                   "min_component_size": 3,
+                   "strong_gravity": True,
+                   "max_iter": 1000}
+    # plot_kwargs = {"layout": "bfs",
+    #                "r_fraction": 0.7,
+    #                "min_component_size": 3}
+
+    # plots only depend on the processed graphs, map names, region maps and plot arguments
+    plot_inputs = hash_object({"DiGraph_Proc": graph_hashes["DiGraph_Proc"],
+                               "Graph_Undir": graph_hashes["Graph_Undir"],
+                               "link_to_name_dict": crawl_outputs["link_to_name_dict"],
+                               "color_map": color_map,
+                               "region_map": region_map,
+                               "plot_kwargs": plot_kwargs,
+                               "png_dpi": args.png_dpi})
+    if stages.is_fresh("plot", plot_inputs):
+        if args.verbose > 0:
+            print("Plot inputs unchanged, keeping previous plots.")
+        return None
+    stages.invalidate("plot")
+    # components whose structure is unchanged since an earlier run reuse their layouts
+    layout_cache = LayoutCache(locs["layout_cache"])
+    # components of all three graphs are laid out, and the figures rendered, by one shared pool of processes
+    pool = ProcessPoolExecutor(args.layout_workers) if args.layout_workers > 1 else None
+    try:
+        with metrics.stage("plot"):
+            plot_files = plot_crawl_outputs(crawl_outputs, 
+                                            color_map, 
+                                            region_map, 
+                                            save_loc=os.path.dirname(locs["crawl_store"]),
+                                            layout_cache=layout_cache,
+                                            png_dpi=args.png_dpi,
+                                            pool=pool,
+                                            **plot_kwargs)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    layout_cache.prune()
+    if args.verbose > 0:
+        print(f"Layouts: {layout_cache.hits} reused, {layout_cache.warm_starts} warm-started, {layout_cache.misses} computed.")
+    stages.record("plot", plot_inputs, plot_files)
+    return None
+
+
+# route queries on the saved crawl (of the condition's sub-directory, unless a store is given)
+def run_query(args):
+    import route_index
+
+    if args.store is None:
+        args.store = f"{os.getcwd()}/{args.condition}/crawl_data.npz"
+    route_index.main(args)
 
 
-if __name__ == "__main__":
-    # Create the parser
-    parser = argparse.ArgumentParser(description="AQW Wiki Crawl")
-    # Add arguments
+def main(args):
+    if args.command == "query":
+        run_query(args)
+        return
+
+    locs = output_locs(args.condition)
+    stages = StageCache(locs["stage_manifest"], force=args.force)
+    # requests, parsing, sleeps and stage timings are recorded for the whole run (see telemetry.py)
+    metrics.reset()
+    if args.progress:
+        metrics.start_progress()
+    source = None
+    try:
+        if args.command in ["regions", "crawl", "all"]:
+            source = open_page_source(args)
+        if args.command == "regions":
+            run_regions(args, locs, source)
+        crawl_outputs, graph_hashes = None, None
+        if args.command in ["crawl", "all"]:
+            crawl_outputs = run_crawl(args, locs, stages, source)
+        if args.command in ["build", "all"]:
+            crawl_outputs, graph_hashes = run_build(args, locs, stages, crawl_outputs)
+        if args.command in ["plot", "all"]:
+            run_plot(args, locs, stages, crawl_outputs, graph_hashes)
+    finally:
+        if source is not None and source["archive"] is not None:
+            source["archive"].close()
+        metrics.stop_progress()
+        # metrics are written even if a stage failed, next to the crawl outputs
+        metrics.write_json(f"{locs['metrics']}.json")
+        metrics.write_prometheus(f"{locs['metrics']}.prom")
+
+
+# options of each group of subcommands
+def add_common_arguments(parser):
     parser.add_argument("--condition", default="none", help="Condition to to filter access points on (either none or geo)")
+    parser.add_argument("--progress", action="store_true", help="Show a live progress line of requests, retries and sleeps")
+    parser.add_argument("--force", action="store_true", help="Rerun every stage, even if its inputs are unchanged")
+    parser.add_argument("--verbose", default=2, type=int, help="verbose level")
+
+
+def add_source_arguments(parser):
+    parser.add_argument("--sleep_duration", default=1, type=float, help="Seconds to sleep between site requests")
+    parser.add_argument("--concurrency", default=1, type=int, help="Maximum number of in-flight site requests (1 crawls serially)")
+    parser.add_argument("--requests_per_second", default=None, type=float, help="Global site request budget for concurrent crawls (defaults to 1/sleep_duration)")
+    parser.add_argument("--timeout", default=30, type=float, help="Seconds to wait for a site response")
+    parser.add_argument("--max_retries", default=4, type=int, help="Retries (with exponential backoff) of failed site requests")
+    parser.add_argument("--cache_dir", default=None, help="Directory of persistent page cache (no caching if not given)")
+    parser.add_argument("--cache_fresh_for", default=24*60*60, type=float, help="Seconds a cached page is served without revalidating it")
+    parser.add_argument("--cache_max_size", default=None, type=int, help="Maximum bytes of cached pages to keep")
+    parser.add_argument("--capture_archive", default=None, help="Zip file to archive every retrieved page to during a live crawl")
+    parser.add_argument("--replay_archive", default=None, help="Zip or tar archive of pages to crawl instead of the live wiki")
+
+
+def add_crawl_arguments(parser):
     parser.add_argument("--degree", default="inf", help="Degrees of separation to crawl")
     parser.add_argument("--pursue_impermanent", default=False, help="Degrees of separation to crawl")
-    parser.add_argument("--sleep_duration", default=1, help="Seconds to sleep between site requests")
-    parser.add_argument("--verbose", default=2, help="verbose level")
+    parser.add_argument("--parsers", default=0, type=int, help="Number of processes parsing pages during a concurrent crawl (0 parses in the fetching threads)")
+    parser.add_argument("--incremental", action="store_true", help="Update the previous crawl_data.json, refetching only changed pages")
+    parser.add_argument("--order", default="bfs", help="Order in which to crawl discovered locations (bfs, region or in_degree)")
+    parser.add_argument("--resume", action="store_true", help="Resume an interrupted crawl from its journal")
+    parser.add_argument("--reuse_crawl", action="store_true", help="Reuse the previous crawl if it was run with the same parameters")
+
+
+def add_plot_arguments(parser):
+    parser.add_argument("--layout", default="forceatlas2", help="Layout of graph components (forceatlas2, or fast_fa2 for large graphs)")
+    parser.add_argument("--layout_workers", default=1, type=int, help="Number of processes laying out graph components and rendering figures (1 does both in this process)")
+    parser.add_argument("--png_dpi", default=None, type=int, help="Also render the graph figures as PNG at this resolution")
+
+
+def add_query_arguments(parser):
+    parser.add_argument("--condition", default="none", help="Condition of the crawl to query (either none or geo)")
+    parser.add_argument("source", nargs="?", default=None, help="Location to route from")
+    parser.add_argument("target", nargs="?", default=None, help="Location to route to")
+    parser.add_argument("--store", default=None, help="Compact crawl store the route index is kept next to (defaults to that of the condition)")
+    parser.add_argument("--graph", default="DiGraph_Proc", help="Graph to route on (DiGraph_Proc, or Graph_Undir for reciprocated connections only)")
+    parser.add_argument("--batch", default=None, help="File of queries, one tab separated 'from to' pair or JSON [from, to] list per line (- reads stdin)")
+    parser.add_argument("--serve", action="store_true", help="Serve queries over HTTP until interrupted")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to serve queries on")
+    parser.add_argument("--port", default=8765, type=int, help="Port to serve queries on")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the route index even if it is up to date")
+    parser.add_argument("--max_tree_nodes", default=5000, type=int, help="Largest graph to store a BFS tree from every location for")
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="AQW Wiki Crawl")
+    subparsers = parser.add_subparsers(dest="command", metavar="{regions,crawl,build,plot,query}")
+    # (queries don't run any stage, so they only take the options of route_index.py)
+    commands = {"regions": ("Pull the locations of each region", [add_common_arguments, add_source_arguments]),
+                "crawl": ("Crawl the wiki and save the crawl outputs", [add_common_arguments, add_source_arguments, add_crawl_arguments]),
+                "build": ("Rebuild the processed graphs and route indexes of the saved crawl", [add_common_arguments]),
+                "plot": ("Plot the saved crawl", [add_common_arguments, add_plot_arguments]),
+                "query": ("Find routes between locations of the saved crawl", [add_query_arguments]),
+                "all": ("Crawl, build and plot (the default)", [add_common_arguments, add_source_arguments, add_crawl_arguments, add_plot_arguments])}
+    for command, (description, add_arguments) in commands.items():
+        subparser = subparsers.add_parser(command, help=description, description=description)
+        for add in add_arguments:
+            add(subparser)
+    return parser
 
-    # Parse the arguments
-    args = parser.parse_args()
-    main(args)
\ No newline at end of file
+if __name__ == "__main__":
+    # without a subcommand, the whole pipeline runs (with the options of every stage)
+    argv = sys.argv[1:]
+    if len(argv) == 0 or argv[0] not in COMMANDS + ["-h", "--help"]:
+        argv = ["all"] + argv
+    args = make_parser().parse_args(argv)
+    main(args)
@@ -1,15 +1,17 @@
-import time
-import requests
 import json
 from tqdm import tqdm
 from bs4 import BeautifulSoup
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from page_cache import get_page_text
+from aqw_async_crawl import TokenBucket
+from telemetry import metrics
 
-# retrieves list of regions 
-def get_region_dict(region_url="http://aqwwiki.wikidot.com/locations", sleep_duration=1):
-    time.sleep(sleep_duration)
-    res = requests.get(region_url)
-    map_site = BeautifulSoup(res.text, "html.parser")
+
+# parses the list of regions from the locations page
+def parse_region_dict(page_text):
+    map_site = BeautifulSoup(page_text, "html.parser")
     map_site_content = map_site.find("div", id="page-content")
     region_dict = {}
     for a in map_site_content.find("p").find_all("a"):
@@ -17,11 +19,9 @@ def get_region_dict(region_url="http://aqwwiki.wikidot.com/locations", sleep_dur
     return region_dict
 
 
-# retrieves list of locations in each region
-def get_loc_in_regions(region, sleep_duration=1):
-    time.sleep(sleep_duration)
-    res = requests.get(f"http://aqwwiki.wikidot.com/{region}")
-    map_site = BeautifulSoup(res.text, "html.parser")
+# parses the list of locations from a region page
+def parse_loc_in_region(page_text):
+    map_site = BeautifulSoup(page_text, "html.parser")
     map_site_content = map_site.find("div", id="page-content")
     links = []
     for a in map_site_content.find_all("a"):
@@ -30,19 +30,61 @@ def get_loc_in_regions(region, sleep_duration=1):
                 links.append(a["href"][1:])
         except:
             pass
-    return list(set(links))
+    return list(dict.fromkeys(links))
+
+
+# retrieves list of regions
+def get_region_dict(region_url="http://aqwwiki.wikidot.com/locations", sleep_duration=1, cache=None, limiter=None):
+    wait = limiter.wait if limiter is not None else lambda: metrics.sleep(sleep_duration, "politeness")
+    return parse_region_dict(get_page_text(region_url, cache=cache, wait=wait))
+
 
+# retrieves list of locations in each region
+def get_loc_in_regions(region, sleep_duration=1, cache=None, region_url="http://aqwwiki.wikidot.com/locations", limiter=None):
+    url = urljoin(region_url, region)
+    # fresh cached pages don't count against the request budget
+    page_text = None if cache is None else cache.fresh_text(url)
+    if page_text is None:
+        wait = limiter.wait if limiter is not None else lambda: metrics.sleep(sleep_duration, "politeness")
+        page_text = get_page_text(url, cache=cache, wait=wait)
+    return parse_loc_in_region(page_text)
+
+
+# yields (region, locations) for each region of region_dict as soon as its page arrives
+# up to `concurrency` region pages are requested at once, within the budget of limiter
+# (a TokenBucket, which may be shared with the crawl); failed regions are retried once the others are done
+def iter_region_to_loc(region_dict, region_url="http://aqwwiki.wikidot.com/locations", concurrency=8, limiter=None, cache=None):
+    if limiter is None:
+        limiter = TokenBucket(1)
+    failed_regions = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(get_loc_in_regions, v, cache=cache, region_url=region_url, limiter=limiter): k
+                   for k, v in region_dict.items()}
+        for future in as_completed(futures):
+            try:
+                locs = future.result()
+            except:
+                failed_regions.append(futures[future])
+                continue
+            yield futures[future], locs
 
-# returns map of regions to lists of locations
-def get_region_to_loc_dict(region_url="http://aqwwiki.wikidot.com/locations"):
-    region_dict = get_region_dict(region_url)
-    region_to_loc_dict = {}
-    for k, v in tqdm(region_dict.items()):
+    for k in failed_regions:
         try:
-            region_to_loc_dict[k] = get_loc_in_regions(v)
+            locs = get_loc_in_regions(region_dict[k], cache=cache, region_url=region_url, limiter=limiter)
         except:
             print(f"ERROR: Region {k}")
-    return region_to_loc_dict
+            continue
+        yield k, locs
+
+
+# returns map of regions to lists of locations (in the order regions are listed)
+def get_region_to_loc_dict(region_url="http://aqwwiki.wikidot.com/locations", cache=None, concurrency=8, limiter=None):
+    if limiter is None:
+        limiter = TokenBucket(1)
+    region_dict = get_region_dict(region_url, cache=cache, limiter=limiter)
+    pulled = dict(tqdm(iter_region_to_loc(region_dict, region_url=region_url, concurrency=concurrency, limiter=limiter, cache=cache),
+                       total=len(region_dict)))
+    return {k: pulled[k] for k in region_dict.keys() if k in pulled}
 
 
 def main():
@@ -53,4 +95,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
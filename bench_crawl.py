@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import resource
+import argparse
+import tempfile
+import numpy as np
+import matplotlib.pyplot as plt
+
+from synthetic_wiki import SyntheticWiki, start_wiki_server
+from bench_parse import bench_parse
+from http_client import configure_client
+from aqw_loc_crawl import aqw_wiki_crawl, save_crawl_outputs, plot_crawl_outputs
+
+
+##################################################################################################
+###################################### END-TO-END BENCHMARK ######################################
+##################################################################################################
+# crawls, saves and plots a synthetic wiki served from a local server, reporting
+#   pages_per_sec: pages fetched and parsed per second of crawl
+#   parse_ms_per_page: parse time of a sample of pages (without any network)
+#   {stage}_time: end-to-end time of each stage
+#   peak_rss_mb: peak resident memory of the benchmark process (including every earlier stage)
+# results can be saved and compared against a saved baseline to catch regressions
+
+# metrics where larger values are regressions (pages_per_sec is the only metric where smaller values are)
+higher_is_worse = ["parse_ms_per_page", "crawl_time", "save_time", "plot_time", "peak_rss_mb"]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_benchmark(wiki_params, stages=("crawl", "save"), concurrency=8, parsers=0, parse_sample=500,
+                  save_loc=None, region_color_map=None):
+    results = {"n_locations": wiki_params["n_locations"]}
+    wiki = SyntheticWiki(**wiki_params)
+
+    # parse time, without any network
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(wiki), size=min(parse_sample, len(wiki)), replace=False)
+    corpus = [(wiki.rooms[i], wiki.page(wiki.rooms[i])) for i in sample]
+    _, results["parse_ms_per_page"] = bench_parse(corpus, repeat=3)
+    del corpus
+
+    server, base_url = start_wiki_server(wiki_params)
+    configure_client(pool_size=max(concurrency, 10))
+    try:
+        start = time.perf_counter()
+        crawl_outputs = aqw_wiki_crawl(wiki.starting_rooms,
+                                       degree=np.inf,
+                                       sleep_duration=0,
+                                       verbose=0,
+                                       concurrency=concurrency,
+                                       requests_per_second=np.inf,
+                                       parsers=parsers,
+                                       base_url=base_url)
+        results["crawl_time"] = time.perf_counter() - start
+    finally:
+        server.terminate()
+    results["pages"] = len(crawl_outputs["link_to_name_dict"])
+    results["failed_pages"] = len(crawl_outputs["failed_pages"])
+    results["pages_per_sec"] = results["pages"] / results["crawl_time"]
+    results["peak_rss_mb_crawl"] = peak_rss_mb()
+
+    if "save" in stages or "plot" in stages:
+        loc = f"{save_loc}/crawl_data.json"
+        start = time.perf_counter()
+        save_crawl_outputs(crawl_outputs, loc)
+        results["save_time"] = time.perf_counter() - start
+        results["peak_rss_mb_save"] = peak_rss_mb()
+
+    if "plot" in stages:
+        start = time.perf_counter()
+        with open(loc, "r") as f:
+            saved_outputs = json.load(f)
+        plot_crawl_outputs(saved_outputs, region_color_map, wiki.region_to_loc_dict, save_loc)
+        plt.close("all")
+        results["plot_time"] = time.perf_counter() - start
+        results["peak_rss_mb_plot"] = peak_rss_mb()
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+# returns descriptions of metrics in results that are worse than in baseline by more than tolerance
+def find_regressions(results, baseline, tolerance=0.2):
+    regressions = []
+    for metric in higher_is_worse + ["pages_per_sec"]:
+        if metric not in results or metric not in baseline or baseline[metric] == 0:
+            continue
+        change = results[metric] / baseline[metric] - 1
+        if metric == "pages_per_sec":
+            change = -change
+        if change > tolerance:
+            regressions.append(f"{metric}: {baseline[metric]:.3f} -> {results[metric]:.3f}")
+    return regressions
+
+
+def main(args):
+    with open("region_color_map.json", "r") as f:
+        region_color_map = json.load(f)
+    region_names = [region for region in region_color_map.keys() if region != "Unknown"]
+    wiki_params = {"n_locations": args.n_locations,
+                   "mean_degree": args.mean_degree,
+                   "degree_distribution": args.degree_distribution,
+                   "region_names": region_names,
+                   "seed": args.seed}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        save_loc = tmp_dir if args.save_loc is None else args.save_loc
+        os.makedirs(save_loc, exist_ok=True)
+        results = run_benchmark(wiki_params,
+                                stages=args.stages,
+                                concurrency=args.concurrency,
+                                parsers=args.parsers,
+                                parse_sample=args.parse_sample,
+                                save_loc=save_loc,
+                                region_color_map=region_color_map)
+
+    print(f"{results['pages']} pages crawled ({results['failed_pages']} failed)")
+    print(f"crawl: {results['crawl_time']:8.2f} s, {results['pages_per_sec']:8.1f} pages/sec, "
+          f"{results['parse_ms_per_page']:.3f} parse ms/page, peak RSS {results['peak_rss_mb_crawl']:.0f} MB")
+    for stage in ["save", "plot"]:
+        if f"{stage}_time" in results:
+            print(f"{stage:>5}: {results[f'{stage}_time']:8.2f} s, peak RSS {results[f'peak_rss_mb_{stage}']:.0f} MB")
+
+    if args.results_loc is not None:
+        with open(args.results_loc, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if len(regressions) > 0:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AQW Wiki end-to-end crawl benchmark on a synthetic wiki")
+    parser.add_argument("--n_locations", default=10000, type=int, help="Number of location pages in the synthetic wiki")
+    parser.add_argument("--mean_degree", default=3, type=float, help="Mean number of access points per location")
+    parser.add_argument("--degree_distribution", default="poisson", help="Distribution of access point counts: poisson, powerlaw or fixed")
+    parser.add_argument("--seed", default=0, type=int, help="Seed of the synthetic wiki")
+    parser.add_argument("--stages", nargs="+", default=["crawl", "save"], help="Stages to run: crawl, save and/or plot (plotting large wikis is slow)")
+    parser.add_argument("--concurrency", default=8, type=int, help="Number of requests in flight")
+    parser.add_argument("--parsers", default=0, type=int, help="Number of parser processes")
+    parser.add_argument("--parse_sample", default=500, type=int, help="Number of pages to time parsing on")
+    parser.add_argument("--save_loc", default=None, help="Directory for crawl outputs and plots (a temporary directory if not set)")
+    parser.add_argument("--results_loc", default=None, help="JSON file to save results to")
+    parser.add_argument("--baseline", default=None, help="JSON file of saved results to check for regressions against")
+    parser.add_argument("--tolerance", default=0.2, type=float, help="Relative change in a metric counted as a regression")
+    args = parser.parse_args()
+    main(args)
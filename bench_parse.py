@@ -0,0 +1,79 @@
+import os
+import time
+import argparse
+import numpy as np
+
+from bs4 import FeatureNotFound
+
+from page_parser import parse_page_record
+
+
+##################################################################################################
+###################################### PARSE-TIME BENCHMARK ######################################
+##################################################################################################
+# times parse_page_record over a corpus of saved wiki pages (one page per file, e.g. the bodies of a page cache)
+# records of each parser configuration are checked against those of the first (full-page) configuration
+def load_corpus(corpus_dir, max_pages=None):
+    corpus = []
+    for name in sorted(os.listdir(corpus_dir)):
+        path = os.path.join(corpus_dir, name)
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                corpus.append((name, f.read()))
+        if max_pages is not None and len(corpus) >= max_pages:
+            break
+    return corpus
+
+
+def parse_records(corpus, features="html.parser", restrict=True):
+    records = []
+    for name, page_text in corpus:
+        try:
+            records.append(parse_page_record(name, page_text, features=features, restrict=restrict))
+        except AttributeError:
+            # pages whose access points can't be located
+            records.append(None)
+    return records
+
+
+def bench_parse(corpus, features="html.parser", restrict=True, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        records = parse_records(corpus, features=features, restrict=restrict)
+        times.append(time.perf_counter() - start)
+    return records, 1000 * min(times) / len(corpus)
+
+
+def main(args):
+    corpus = load_corpus(args.corpus_dir, max_pages=args.max_pages)
+    if len(corpus) == 0:
+        raise ValueError(f"no pages found in {args.corpus_dir}")
+    print(f"{len(corpus)} pages, {sum(len(page_text) for _, page_text in corpus) / len(corpus) / 1000:.1f} kB/page")
+
+    reference_records = None
+    reference_ms = None
+    for features in args.features:
+        for restrict in [False, True]:
+            try:
+                records, ms_per_page = bench_parse(corpus, features=features, restrict=restrict, repeat=args.repeat)
+            except FeatureNotFound:
+                print(f"{features}: not installed")
+                break
+            if reference_records is None:
+                reference_records = records
+                reference_ms = ms_per_page
+            mismatches = int(np.sum([r != ref for r, ref in zip(records, reference_records)]))
+            scope = "restricted" if restrict else "full page"
+            print(f"{features:>12} {scope:>10}: {ms_per_page:8.3f} ms/page ({reference_ms / ms_per_page:5.2f}x), "
+                  f"{mismatches} records differ from the first configuration")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AQW Wiki page parse benchmark")
+    parser.add_argument("corpus_dir", help="Directory of saved wiki pages")
+    parser.add_argument("--features", nargs="+", default=["html.parser", "lxml"], help="BeautifulSoup tree builders to compare")
+    parser.add_argument("--max_pages", default=None, type=int, help="Maximum number of pages to parse")
+    parser.add_argument("--repeat", default=3, type=int, help="Number of timed passes over the corpus (fastest is reported)")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,218 @@
+import numpy as np
+
+
+##################################################################################################
+######################################## COMPACT GRAPH ###########################################
+##################################################################################################
+# integer-indexed graph for the processing between the crawl and the plots, where networkx copies dominate
+#   names: node names, indexed by node id (node_idx maps names back to ids)
+#   indptr, indices: successors (neighbors if undirected) of each node (CSR), in insertion order
+#   attrs: integer node attributes, MISSING where a node doesn't have one
+# filtering, relabeling and edge selection are array operations that return new graphs sharing nothing mutable,
+# and only layouts and drawing need to_networkx
+# the reverse adjacency (predecessors) is built on first use
+# node and edge order are deterministic but needn't match networkx's equivalent operations: relabel keeps the order
+# names first appear in (as nx.relabel_nodes does), but predecessors of merged nodes follow node order rather than edge
+# insertion order, reciprocated orders neighbors by edge, and networkx subgraph views can list nodes in set order
+# (so the graphs built by build_output_graphs can differ in order from the networkx pipeline they replaced),
+# and code downstream must not rely on node or edge order
+# (networkx is only imported to convert to and from networkx graphs, so reading a store doesn't load it)
+MISSING = np.iinfo(np.int64).min
+
+
+class CompactGraph:
+    __slots__ = ["names", "node_idx", "directed", "indptr", "indices", "attrs", "_rindptr", "_rindices"]
+
+    def __init__(self, names, indptr, indices, directed=True, attrs=None):
+        self.names = list(names)
+        self.node_idx = {name: i for i, name in enumerate(self.names)}
+        self.directed = directed
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.attrs = {} if attrs is None else attrs
+        self._rindptr = None
+        self._rindices = None
+
+    @classmethod
+    def from_networkx(cls, G):
+        names = list(G.nodes())
+        node_idx = {name: i for i, name in enumerate(names)}
+        degrees = np.fromiter((len(G.adj[name]) for name in names), dtype=np.int64, count=len(names))
+        indptr = np.concatenate([[0], np.cumsum(degrees)]).astype(np.int64)
+        indices = np.fromiter((node_idx[v] for name in names for v in G.adj[name]), dtype=np.int64, count=int(degrees.sum()))
+        attrs = {}
+        attr_names = {attr for _, data in G.nodes(data=True) for attr in data}
+        for attr in sorted(attr_names):
+            values = [data.get(attr, None) for _, data in G.nodes(data=True)]
+            if not all(value is None or isinstance(value, (int, np.integer)) for value in values):
+                raise ValueError(f"node attribute {attr} isn't an integer")
+            attrs[attr] = np.array([MISSING if value is None else value for value in values], dtype=np.int64)
+        return cls(names, indptr, indices, directed=G.is_directed(), attrs=attrs)
+
+    # graph of the edges src[k] -> dst[k] (node ids into names), with each node's successors in edge order
+    # (undirected edges are given once, and each node's neighbors are in the order of the edges it is part of)
+    @classmethod
+    def from_edges(cls, names, src, dst, directed=True, attrs=None):
+        src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+        if not directed:
+            # both directions of each edge, interleaved so each node sees its edges in order (self-loops once)
+            pairs = np.stack([np.stack([src, dst], axis=1), np.stack([dst, src], axis=1)], axis=1).reshape(-1, 2)
+            keep = np.ones(len(pairs), dtype=bool)
+            keep[1::2] = src != dst
+            src, dst = pairs[keep, 0], pairs[keep, 1]
+        order = np.argsort(src, kind="stable")
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=len(names)))]).astype(np.int64)
+        return cls(names, indptr, dst[order], directed=directed, attrs=attrs)
+
+    def to_networkx(self):
+        import networkx as nx
+        G = nx.DiGraph() if self.directed else nx.Graph()
+        G.add_nodes_from(self.nodes(data=True))
+        src, dst = self.edge_arrays()
+        names = self.names
+        G.add_edges_from(zip([names[u] for u in src.tolist()], [names[v] for v in dst.tolist()]))
+        return G
+
+    # node-link data, as written by nx.node_link_data
+    def node_link_data(self):
+        src, dst = self.edge_arrays()
+        names = self.names
+        return {"directed": self.directed,
+                "multigraph": False,
+                "graph": {},
+                "nodes": [{**data, "id": name} for name, data in self.nodes(data=True)],
+                "edges": [{"source": names[u], "target": names[v]} for u, v in zip(src.tolist(), dst.tolist())]}
+
+    # read-only parts of the networkx interface, enough for hash_graph and assign_by_neighbor
+    def is_directed(self):
+        return self.directed
+
+    def number_of_nodes(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.node_idx
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def nodes(self, data=False):
+        if not data:
+            return list(self.names)
+        attrs = {attr: values.tolist() for attr, values in self.attrs.items()}
+        return [(name, {attr: values[i] for attr, values in attrs.items() if values[i] != MISSING})
+                for i, name in enumerate(self.names)]
+
+    def edges(self):
+        src, dst = self.edge_arrays()
+        names = self.names
+        return [(names[u], names[v]) for u, v in zip(src.tolist(), dst.tolist())]
+
+    def neighbors(self, name):
+        i = self.node_idx[name]
+        return [self.names[j] for j in self.indices[self.indptr[i]:self.indptr[i+1]].tolist()]
+
+    def predecessors(self, name):
+        rindptr, rindices = self.reverse()
+        i = self.node_idx[name]
+        return [self.names[j] for j in rindices[rindptr[i]:rindptr[i+1]].tolist()]
+
+    # source and target of every edge (each undirected edge once, from the earlier node, as nx iterates them)
+    def edge_arrays(self):
+        src = np.repeat(np.arange(len(self.names), dtype=np.int64), np.diff(self.indptr))
+        dst = self.indices
+        if not self.directed:
+            once = dst >= src
+            src, dst = src[once], dst[once]
+        return src, dst
+
+    # predecessors of each node (CSR)
+    def reverse(self):
+        if not self.directed:
+            return self.indptr, self.indices
+        if self._rindptr is None:
+            src = np.repeat(np.arange(len(self.names), dtype=np.int64), np.diff(self.indptr))
+            order = np.argsort(self.indices, kind="stable")
+            self._rindptr = np.concatenate([[0], np.cumsum(np.bincount(self.indices, minlength=len(self.names)))]).astype(np.int64)
+            self._rindices = src[order]
+        return self._rindptr, self._rindices
+
+    # in-degree plus out-degree (degree if undirected)
+    def degrees(self):
+        degrees = np.diff(self.indptr)
+        if self.directed:
+            degrees = degrees + np.diff(self.reverse()[0])
+        return degrees
+
+    # subgraph of the nodes where keep is true, in the same order
+    def subgraph(self, keep):
+        keep = np.asarray(keep, dtype=bool)
+        new_id = np.cumsum(keep) - 1
+        src = np.repeat(np.arange(len(self.names), dtype=np.int64), np.diff(self.indptr))
+        kept = keep[src] & keep[self.indices]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(new_id[src[kept]], minlength=int(keep.sum())))]).astype(np.int64)
+        return CompactGraph([name for name, k in zip(self.names, keep.tolist()) if k], indptr, new_id[self.indices[kept]],
+                            directed=self.directed, attrs={attr: values[keep] for attr, values in self.attrs.items()})
+
+    # graph with nodes renamed by mapping (nodes not in it keep their names), as nx.relabel_nodes does:
+    # nodes mapped to the same name are merged, in the order their names first appear, with the attributes of the last
+    # (successors are in networkx's order, predecessors of merged nodes aren't, see above)
+    def relabel(self, mapping):
+        names = [mapping.get(name, name) for name in self.names]
+        new_names = list(dict.fromkeys(names))
+        new_idx = {name: i for i, name in enumerate(new_names)}
+        new_id = np.fromiter((new_idx[name] for name in names), dtype=np.int64, count=len(names))
+        reversed_first = np.unique(new_id[::-1], return_index=True)[1]
+        last = len(names) - 1 - reversed_first
+        src, dst = self.edge_arrays()
+        src, dst = new_id[src], new_id[dst]
+        if not self.directed:
+            src, dst = np.minimum(src, dst), np.maximum(src, dst)
+        # merged nodes can share edges, so only the first of each is kept
+        first = np.sort(np.unique(src * len(new_names) + dst, return_index=True)[1])
+        return CompactGraph.from_edges(new_names, src[first], dst[first], directed=self.directed,
+                                       attrs={attr: values[last] for attr, values in self.attrs.items()})
+
+    # undirected graph of the edges whose reverse is also an edge, with nodes in the order they appear in those edges
+    # (node attributes are dropped)
+    def reciprocated(self):
+        n = len(self.names)
+        src, dst = self.edge_arrays()
+        keys = src * n + dst
+        both = np.isin(dst * n + src, keys)
+        src, dst = src[both], dst[both]
+        endpoints = np.stack([src, dst], axis=1).reshape(-1)
+        nodes = endpoints[np.sort(np.unique(endpoints, return_index=True)[1])]
+        new_id = np.full(n, -1, dtype=np.int64)
+        new_id[nodes] = np.arange(len(nodes))
+        once = src <= dst
+        return CompactGraph.from_edges([self.names[i] for i in nodes.tolist()], new_id[src[once]], new_id[dst[once]], directed=False)
+
+    # undirected graph with an edge wherever there is an edge in either direction
+    def to_undirected(self):
+        if not self.directed:
+            return self
+        src, dst = self.edge_arrays()
+        lo, hi = np.minimum(src, dst), np.maximum(src, dst)
+        first = np.sort(np.unique(lo * len(self.names) + hi, return_index=True)[1])
+        return CompactGraph.from_edges(self.names, src[first], dst[first], directed=False, attrs=dict(self.attrs))
+
+
+# compact graph of a networkx graph, node-link data (as saved in crawl_data.json) or compact graph
+def as_compact(data, directed=True):
+    import networkx as nx
+    if isinstance(data, CompactGraph):
+        return data
+    if isinstance(data, nx.Graph):
+        return CompactGraph.from_networkx(data)
+    return CompactGraph.from_networkx(nx.node_link_graph(data, directed=directed))
+
+
+# networkx graph of a compact graph, node-link data or networkx graph
+def as_networkx(data, directed=True):
+    import networkx as nx
+    if isinstance(data, nx.Graph):
+        return data
+    if isinstance(data, CompactGraph):
+        return data.to_networkx()
+    return nx.node_link_graph(data, directed=directed)
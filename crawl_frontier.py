@@ -0,0 +1,114 @@
+import heapq
+from collections import deque
+
+
+##################################################################################################
+######################################## CRAWL FRONTIERS #########################################
+##################################################################################################
+# a frontier holds rooms waiting to be crawled, each with its hop distance from the starting rooms
+# push(room, hops, parent) adds a room (parent is the room whose access points it was found in)
+# seen(room) is called every time a room is found as an access point, whether or not it is pushed
+# pop() returns the next (room, hops) to crawl
+# engines may push a room again when a shorter path to it is found, and skip stale entries on pop
+
+
+# crawls rooms in the order they are discovered (breadth first)
+class BFSFrontier:
+    def __init__(self):
+        self.queue = deque()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def push(self, room, hops, parent=None):
+        self.queue.append((room, hops))
+        return None
+
+    def seen(self, room):
+        return None
+
+    def pop(self):
+        return self.queue.popleft()
+
+
+# crawls rooms with the smallest priority first (ties broken breadth first)
+# priority(room, hops, parent) is evaluated once, when the room is pushed
+class PriorityFrontier:
+    def __init__(self, priority):
+        self.priority = priority
+        self.heap = []
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, room, hops, parent=None):
+        heapq.heappush(self.heap, (self.priority(room, hops, parent), hops, self.counter, room))
+        self.counter += 1
+        return None
+
+    def seen(self, room):
+        return None
+
+    def pop(self):
+        _, hops, _, room = heapq.heappop(self.heap)
+        return room, hops
+
+
+# crawls a region at a time, in the order regions are listed in region_to_loc_dict
+# rooms that aren't listed in any region are crawled with the region they were discovered from
+class RegionFrontier(PriorityFrontier):
+    def __init__(self, region_to_loc_dict):
+        self.room_to_rank = {}
+        for rank, locs in enumerate(region_to_loc_dict.values()):
+            for loc in locs:
+                self.room_to_rank.setdefault(loc, rank)
+        super().__init__(self.region_priority)
+
+    def region_priority(self, room, hops, parent):
+        if room not in self.room_to_rank:
+            self.room_to_rank[room] = self.room_to_rank.get(parent, len(self.room_to_rank))
+        return self.room_to_rank[room]
+
+
+# crawls the rooms listed as an access point most often so far first
+# priorities change as rooms are seen, so outdated heap entries are skipped on pop
+class InDegreeFrontier:
+    def __init__(self):
+        self.heap = []
+        self.in_degree = {}
+        self.pending = {} # room -> hops of its pending entry
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, room, hops, parent=None):
+        self.pending[room] = hops
+        heapq.heappush(self.heap, (-self.in_degree.get(room, 0), hops, room))
+        return None
+
+    def seen(self, room):
+        self.in_degree[room] = self.in_degree.get(room, 0) + 1
+        if room in self.pending:
+            heapq.heappush(self.heap, (-self.in_degree[room], self.pending[room], room))
+        return None
+
+    def pop(self):
+        while True:
+            neg_in_degree, hops, room = heapq.heappop(self.heap)
+            if self.pending.get(room, None) == hops and -neg_in_degree == self.in_degree.get(room, 0):
+                del self.pending[room]
+                return room, hops
+
+
+def make_frontier(order="bfs", region_to_loc_dict=None):
+    if order == "bfs":
+        return BFSFrontier()
+    elif order == "region":
+        if region_to_loc_dict is None:
+            raise ValueError("region ordering requires region_to_loc_dict")
+        return RegionFrontier(region_to_loc_dict)
+    elif order == "in_degree":
+        return InDegreeFrontier()
+    else:
+        raise ValueError(f"{order} not a recognized crawl order")
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+
+
+##################################################################################################
+######################################## CRAWL JOURNAL ###########################################
+##################################################################################################
+# append-only record of a crawl in progress, one JSON object per line:
+#   {"params": {...}}                       crawl parameters (first line)
+#   {"page": room, "result": [...]}         completed page result
+#   {"scheduled": [room, hops]}             room added to the frontier at a hop distance from the starting rooms
+#   {"expanded": [room, hops]}              frontier entry whose access points have been scheduled
+# records are buffered and written in batches (every `batch_size` records or `flush_interval` seconds)
+# so journaling doesn't add a disk sync to every page
+class CrawlJournal:
+    def __init__(self, loc, params, resume=False, batch_size=50, flush_interval=5.0):
+        self.loc = loc
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+        # compare parameters as they round-trip through the journal
+        params = json.loads(json.dumps(params))
+        self.results = {}
+        self.scheduled = []
+        self.expanded = set()
+        if resume and os.path.exists(loc):
+            journal_params = self.load()
+            if journal_params != params:
+                raise ValueError(f"journal {loc} was written by a crawl with different parameters")
+            self.f = open(loc, "a")
+        else:
+            self.f = open(loc, "w")
+            self.write({"params": params})
+            self.flush()
+
+    # reads back a journal, discarding a partially written final line
+    def load(self):
+        journal_params = None
+        good_offset = 0
+        with open(self.loc, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                good_offset += len(line)
+                if "params" in record:
+                    journal_params = record["params"]
+                elif "page" in record:
+                    self.results[record["page"]] = record["result"]
+                elif "scheduled" in record:
+                    self.scheduled.append(tuple(record["scheduled"]))
+                elif "expanded" in record:
+                    self.expanded.add(tuple(record["expanded"]))
+        # drop the partial line so appended records start on a fresh line
+        if good_offset < os.path.getsize(self.loc):
+            with open(self.loc, "r+b") as f:
+                f.truncate(good_offset)
+        return journal_params
+
+    # frontier entries that were scheduled but not expanded before the journal was written
+    def pending_frontier(self):
+        return [entry for entry in self.scheduled if entry not in self.expanded]
+
+    # restores hop distances and pushes the pending frontier entries onto a frontier
+    def restore_frontier(self, frontier, hops):
+        for room, room_hops in self.scheduled:
+            hops[room] = min(hops.get(room, room_hops), room_hops)
+        for room, room_hops in self.pending_frontier():
+            frontier.push(room, room_hops)
+        return None
+
+    def write(self, record):
+        self.buffer.append(json.dumps(record) + "\n")
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush > self.flush_interval:
+            self.flush()
+        return None
+
+    def record_page(self, room, result):
+        return self.write({"page": room, "result": result})
+
+    def record_scheduled(self, room, hops):
+        return self.write({"scheduled": [room, hops]})
+
+    def record_expanded(self, room, hops):
+        return self.write({"expanded": [room, hops]})
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.f.write("".join(self.buffer))
+            self.buffer = []
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.last_flush = time.monotonic()
+        return None
+
+    def close(self):
+        if not self.f.closed:
+            self.flush()
+            self.f.close()
+        return None
@@ -0,0 +1,188 @@
+import json
+import hashlib
+import struct
+import zipfile
+import numpy as np
+
+from compact_graph import CompactGraph
+
+##################################################################################################
+##################################### COMPACT CRAWL STORE ########################################
+##################################################################################################
+# binary alternative to crawl_data.json, saved as an uncompressed .npz file (readable with np.load)
+# every wiki extension and map name is interned once in a string table, and everything else refers to it by index
+#   strings: utf-8 string table, NUL separated
+#   metadata: utf-8 JSON of crawl_params, crawl_time, requests and other small outputs
+#   names_keys, names_values: link_to_name_dict
+#   permanence_keys, permanence_values: link_to_permanence_dict
+#   hops_keys, hops_values: link_to_hops_dict
+#   page_hash_keys, page_hash_values: link_to_page_hash_dict (sha256 digests, 32 bytes per row)
+#   access_keys, access_indptr, access_indices: link_to_access_points_dict (CSR)
+#   failed_pages: extensions whose pages couldn't be retrieved
+#   {graph}_nodes, {graph}_indptr, {graph}_indices: nodes and successors (neighbors if undirected) of each graph (CSR)
+#   {graph}_attr_{name}: integer node attribute (MISSING where a node doesn't have it)
+# for graph in DiGraph_Raw, DiGraph_Proc and Graph_Undir
+# arrays are stored uncompressed, so each one can be memory-mapped on its own
+GRAPH_KEYS = ["DiGraph_Raw", "DiGraph_Proc", "Graph_Undir"]
+DICT_KEYS = ["link_to_name_dict", "link_to_permanence_dict", "link_to_access_points_dict", "link_to_hops_dict", "link_to_page_hash_dict", "failed_pages"]
+FORMAT_VERSION = 1
+
+
+class StringTable:
+    def __init__(self):
+        self.ids = {}
+
+    def intern(self, s):
+        if s not in self.ids:
+            if "\x00" in s:
+                raise ValueError(f"{s!r} can't be stored in a string table")
+            self.ids[s] = len(self.ids)
+        return self.ids[s]
+
+    def intern_all(self, strings):
+        return np.fromiter((self.intern(s) for s in strings), dtype=np.int32)
+
+    def to_array(self):
+        return np.frombuffer("\x00".join(self.ids.keys()).encode("utf-8"), dtype=np.uint8)
+
+
+def graph_arrays(G, name, strings):
+    if not isinstance(G, CompactGraph):
+        G = CompactGraph.from_networkx(G)
+    arrays = {f"{name}_nodes": strings.intern_all(G.names),
+              f"{name}_indptr": G.indptr,
+              f"{name}_indices": G.indices.astype(np.int32)}
+    for attr, values in sorted(G.attrs.items()):
+        arrays[f"{name}_attr_{attr}"] = values
+    return arrays
+
+
+# saves crawl outputs (with graphs as networkx or compact graphs under GRAPH_KEYS) to a compact store
+def save_crawl_store(crawl_outputs, loc="crawl_data.npz"):
+    strings = StringTable()
+    arrays = {}
+    metadata = {k: v for k, v in crawl_outputs.items() if k not in GRAPH_KEYS + DICT_KEYS}
+    metadata["format_version"] = FORMAT_VERSION
+
+    name_dict = crawl_outputs["link_to_name_dict"]
+    arrays["names_keys"] = strings.intern_all(name_dict.keys())
+    arrays["names_values"] = strings.intern_all(name_dict.values())
+    permanence_dict = crawl_outputs["link_to_permanence_dict"]
+    arrays["permanence_keys"] = strings.intern_all(permanence_dict.keys())
+    arrays["permanence_values"] = np.array(list(permanence_dict.values()), dtype=bool)
+    if "link_to_hops_dict" in crawl_outputs:
+        hops_dict = crawl_outputs["link_to_hops_dict"]
+        arrays["hops_keys"] = strings.intern_all(hops_dict.keys())
+        arrays["hops_values"] = np.array(list(hops_dict.values()), dtype=np.int64)
+    if "link_to_page_hash_dict" in crawl_outputs:
+        page_hash_dict = crawl_outputs["link_to_page_hash_dict"]
+        arrays["page_hash_keys"] = strings.intern_all(page_hash_dict.keys())
+        arrays["page_hash_values"] = np.frombuffer(b"".join(bytes.fromhex(h) for h in page_hash_dict.values()), dtype=np.uint8).reshape(-1, 32)
+    if "link_to_access_points_dict" in crawl_outputs:
+        access_dict = crawl_outputs["link_to_access_points_dict"]
+        arrays["access_keys"] = strings.intern_all(access_dict.keys())
+        arrays["access_indptr"] = np.concatenate([[0], np.cumsum([len(v) for v in access_dict.values()])]).astype(np.int64)
+        arrays["access_indices"] = strings.intern_all(a for access in access_dict.values() for a in access)
+    if "failed_pages" in crawl_outputs:
+        arrays["failed_pages"] = strings.intern_all(crawl_outputs["failed_pages"])
+
+    for key in GRAPH_KEYS:
+        arrays.update(graph_arrays(crawl_outputs[key], key, strings))
+    arrays["strings"] = strings.to_array()
+    arrays["metadata"] = np.frombuffer(json.dumps(metadata).encode("utf-8"), dtype=np.uint8)
+    with open(loc, "wb") as f:
+        np.savez(f, **arrays)
+
+
+# memory-maps the array `name` of an uncompressed .npz file (falling back on reading it if it is compressed)
+def npz_memmap(loc, name):
+    with zipfile.ZipFile(loc) as zf:
+        info = zf.getinfo(f"{name}.npy")
+        if info.compress_type != zipfile.ZIP_STORED:
+            return np.load(loc)[name]
+    with open(loc, "rb") as f:
+        # skip the zip local file header to the start of the .npy file
+        f.seek(info.header_offset)
+        name_length, extra_length = struct.unpack("<HH", f.read(30)[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if np.prod(shape) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(loc, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran_order else "C")
+
+
+# lazily loaded crawl store: arrays are memory-mapped, and the string table and graphs are only decoded when used
+class CrawlStore:
+    def __init__(self, loc="crawl_data.npz"):
+        self.loc = loc
+        with zipfile.ZipFile(loc) as zf:
+            self.names = {name[:-len(".npy")] for name in zf.namelist()}
+        self.arrays = {}
+        self._strings = None
+        self.metadata = json.loads(bytes(self.array("metadata")).decode("utf-8"))
+
+    def array(self, name):
+        if name not in self.arrays:
+            self.arrays[name] = npz_memmap(self.loc, name)
+        return self.arrays[name]
+
+    @property
+    def strings(self):
+        if self._strings is None:
+            self._strings = bytes(self.array("strings")).decode("utf-8").split("\x00")
+        return self._strings
+
+    def lookup(self, ids):
+        strings = self.strings
+        return [strings[i] for i in np.asarray(ids).tolist()]
+
+    # nodes (as string table ids) and CSR adjacency of a graph, without building a networkx graph
+    def csr(self, key):
+        return self.array(f"{key}_nodes"), self.array(f"{key}_indptr"), self.array(f"{key}_indices")
+
+    def compact(self, key):
+        nodes, indptr, indices = self.csr(key)
+        prefix = f"{key}_attr_"
+        attrs = {name[len(prefix):]: np.asarray(self.array(name)) for name in sorted(self.names) if name.startswith(prefix)}
+        return CompactGraph(self.lookup(nodes), indptr, indices, directed=key != "Graph_Undir", attrs=attrs)
+
+    # sha256 of a graph as stored (node names, adjacency and node attributes), without building it
+    def graph_hash(self, key):
+        h = hashlib.sha256()
+        nodes, _, _ = self.csr(key)
+        h.update("\x00".join(self.lookup(nodes)).encode("utf-8"))
+        prefix = f"{key}_attr_"
+        for name in [f"{key}_indptr", f"{key}_indices"] + sorted(name for name in self.names if name.startswith(prefix)):
+            h.update(name.encode("utf-8"))
+            h.update(np.ascontiguousarray(self.array(name)).tobytes())
+        return h.hexdigest()
+
+    def graph(self, key):
+        return self.compact(key).to_networkx()
+
+    # crawl outputs as saved by save_crawl_outputs, with the graphs in `graphs` loaded as networkx graphs
+    # (or as compact graphs, see compact_graph.py)
+    def load_outputs(self, graphs=GRAPH_KEYS, compact=False):
+        crawl_outputs = {k: v for k, v in self.metadata.items() if k != "format_version"}
+        crawl_outputs["link_to_name_dict"] = dict(zip(self.lookup(self.array("names_keys")), self.lookup(self.array("names_values"))))
+        crawl_outputs["link_to_permanence_dict"] = dict(zip(self.lookup(self.array("permanence_keys")), self.array("permanence_values").tolist()))
+        if "hops_keys" in self.names:
+            crawl_outputs["link_to_hops_dict"] = dict(zip(self.lookup(self.array("hops_keys")), self.array("hops_values").tolist()))
+        if "page_hash_keys" in self.names:
+            crawl_outputs["link_to_page_hash_dict"] = dict(zip(self.lookup(self.array("page_hash_keys")),
+                                                               (bytes(row).hex() for row in self.array("page_hash_values"))))
+        if "access_keys" in self.names:
+            indptr = self.array("access_indptr").tolist()
+            access_points = self.lookup(self.array("access_indices"))
+            crawl_outputs["link_to_access_points_dict"] = {link: access_points[indptr[i]:indptr[i + 1]]
+                                                           for i, link in enumerate(self.lookup(self.array("access_keys")))}
+        if "failed_pages" in self.names:
+            crawl_outputs["failed_pages"] = self.lookup(self.array("failed_pages"))
+        for key in graphs:
+            crawl_outputs[key] = self.compact(key) if compact else self.graph(key)
+        return crawl_outputs
@@ -0,0 +1,300 @@
+import numpy as np
+
+
+##################################################################################################
+################################## BARNES-HUT FORCEATLAS2 ########################################
+##################################################################################################
+# ForceAtlas2 (Jacomy et al. 2014) for large graphs, vectorized with numpy
+#   attraction: linear along each edge, computed from edge arrays (O(edges) per iteration)
+#   repulsion: approximated with a Barnes-Hut quadtree (O(n log n) per iteration rather than O(n^2))
+#   gravity: towards the center, proportional to mass (strong gravity) or constant
+# nodes have mass degree + 1, and move with the adaptive speed of ForceAtlas2
+# the layout stops early once nodes move less than tol times the layout's spread over check_every iterations
+# with no initial positions, the layout starts from a multilevel layout of successively coarsened graphs
+# (instead of a kamada-kawai layout, which takes O(n^2) time and memory)
+
+
+# morton codes of points on a 2^depth x 2^depth grid (x and y bits interleaved)
+def morton_codes(ix, iy, depth):
+    codes = np.zeros(len(ix), dtype=np.int64)
+    for bit in range(depth):
+        codes |= ((ix >> bit) & 1) << (2 * bit)
+        codes |= ((iy >> bit) & 1) << (2 * bit + 1)
+    return codes
+
+
+# quadtree of points, as arrays of occupied cells per level
+# cells of each level are sorted by morton code, so the children of a cell are a contiguous range of the next level,
+# and the points of a leaf are a contiguous range of points sorted by code
+class QuadTree:
+    def __init__(self, pos, mass, depth=None):
+        n = len(pos)
+        if depth is None:
+            depth = int(np.clip(np.ceil(np.log(max(n, 2)) / np.log(4)) + 3, 4, 20))
+        self.depth = depth
+        lo = pos.min(axis=0)
+        self.width = max(float(np.max(pos.max(axis=0) - lo)), 1e-12) * (1 + 1e-9)
+        grid = np.minimum(((pos - lo) / self.width * 2**depth).astype(np.int64), 2**depth - 1)
+        codes = morton_codes(grid[:, 0], grid[:, 1], depth)
+        self.order = np.argsort(codes, kind="stable")
+        self.point_codes = codes
+
+        # per level: cell codes, total mass, center of mass, number of points and first point (in sorted order)
+        sorted_codes = codes[self.order]
+        self.codes, self.mass, self.com, self.count, self.start = [], [], [], [], []
+        for level in range(depth + 1):
+            level_codes = sorted_codes >> (2 * (depth - level))
+            cells, start, inverse = np.unique(level_codes, return_index=True, return_inverse=True)
+            cell_mass = np.bincount(inverse, weights=mass[self.order])
+            com = np.stack([np.bincount(inverse, weights=mass[self.order] * pos[self.order, dim]) for dim in range(2)], axis=1)
+            self.codes.append(cells)
+            self.mass.append(cell_mass)
+            self.com.append(com / cell_mass[:, None])
+            self.count.append(np.bincount(inverse))
+            self.start.append(start)
+
+    # deepest level whose occupied cells hold at least group_size points on average
+    def group_level(self, group_size):
+        levels = [level for level in range(self.depth + 1) if len(self.codes[level]) * group_size <= len(self.order)]
+        return max(levels, default=0)
+
+    def cell_of(self, points, level):
+        return self.point_codes[points] >> (2 * (self.depth - level))
+
+    # ranges of child cells (in the next level) of cells of a level
+    def children(self, cells, level):
+        child_codes = self.codes[level + 1]
+        codes = self.codes[level][cells]
+        return np.searchsorted(child_codes, 4 * codes), np.searchsorted(child_codes, 4 * codes + 4)
+
+
+# expands pairs (owner, [lo, hi)) into pairs (owner, k) for k in lo..hi-1
+def expand_ranges(owners, lo, hi):
+    counts = hi - lo
+    rep_owners = np.repeat(owners, counts)
+    offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rep_owners, np.repeat(lo, counts) + offsets
+
+
+# repulsion of every point from every other point, approximating groups of points further away than
+# their cell width / theta by their center of mass
+# (force on i from j: scaling_ratio * mass_i * mass_j * (pos_i - pos_j) / dist^2)
+def barnes_hut_repulsion(pos, mass, scaling_ratio=2.0, theta=1.2, tree=None, group_size=8):
+    if tree is None:
+        tree = QuadTree(pos, mass)
+    n = len(pos)
+    force = np.zeros_like(pos)
+
+    def add_forces(points, sources_pos, sources_mass):
+        diff = pos[points] - sources_pos
+        d2 = np.maximum(np.einsum("ij,ij->i", diff, diff), 1e-12)
+        f = diff * (scaling_ratio * mass[points] * sources_mass / d2)[:, None]
+        for dim in range(2):
+            force[:, dim] += np.bincount(points, weights=f[:, dim], minlength=n)
+
+    # near the root, groups of nearby points (the occupied cells of group_level) are tested against cells at once:
+    # a cell far enough from a group (including the group's own extent) repels every point of the group
+    # as it would the group's center
+    group_level = tree.group_level(group_size)
+    group_start, group_count = tree.start[group_level], tree.count[group_level]
+    sorted_pos = pos[tree.order]
+    group_min = np.minimum.reduceat(sorted_pos, group_start, axis=0)
+    group_max = np.maximum.reduceat(sorted_pos, group_start, axis=0)
+    group_center = (group_min + group_max) / 2
+    group_extent = np.linalg.norm(group_max - group_min, axis=1)
+    # repulsion per unit mass at the center of each group
+    group_force = np.zeros((len(group_start), 2))
+
+    # pairs of (group, cell) still to be resolved, starting from the root
+    groups = np.arange(len(group_start))
+    cells = np.zeros(len(groups), dtype=np.int64)
+    for level in range(group_level + 1):
+        com = tree.com[level][cells]
+        diff = group_center[groups] - com
+        d2 = np.einsum("ij,ij->i", diff, diff)
+        inside = tree.codes[group_level][groups] >> (2 * (group_level - level)) == tree.codes[level][cells]
+        cell_width = np.where(tree.count[level][cells] == 1, 0, tree.width / 2**level)
+        accept = ~inside & (cell_width + group_extent[groups] < theta * np.sqrt(d2))
+        f = diff[accept] * (scaling_ratio * tree.mass[level][cells[accept]] / d2[accept])[:, None]
+        for dim in range(2):
+            group_force[:, dim] += np.bincount(groups[accept], weights=f[:, dim], minlength=len(group_start))
+        groups, cells = groups[~accept], cells[~accept]
+        if level < group_level:
+            lo, hi = tree.children(cells, level)
+            idx, children = expand_ranges(np.arange(len(groups)), lo, hi)
+            groups, cells = groups[idx], children
+    force[tree.order] += mass[tree.order, None] * np.repeat(group_force, group_count, axis=0)
+
+    # then each point of a group is tested against the cells left, down to the leaves
+    idx, sorted_idx = expand_ranges(np.arange(len(groups)), group_start[groups], group_start[groups] + group_count[groups])
+    points, cells = tree.order[sorted_idx], cells[idx]
+    for level in range(group_level, tree.depth + 1):
+        if len(points) == 0:
+            break
+        if level > group_level:
+            lo, hi = tree.children(cells, level - 1)
+            idx, children = expand_ranges(np.arange(len(points)), lo, hi)
+            points, cells = points[idx], children
+        com = tree.com[level][cells]
+        diff = pos[points] - com
+        dist = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+        inside = tree.cell_of(points, level) == tree.codes[level][cells]
+        single = tree.count[level][cells] == 1
+        # far cells (and cells of a single other point) act as one point at their center of mass
+        accept = ~inside & (single | (tree.width / 2**level < theta * dist))
+        add_forces(points[accept], com[accept], tree.mass[level][cells[accept]])
+        # a point alone in its cell has nothing else to be repelled by there
+        keep = ~accept & ~(inside & single)
+        points, cells = points[keep], cells[keep]
+
+    # pairs left at the deepest level are near points sharing a leaf: compute them exactly
+    if len(points) > 0:
+        start = tree.start[tree.depth][cells]
+        idx, sorted_idx = expand_ranges(np.arange(len(points)), start, start + tree.count[tree.depth][cells])
+        points, others = points[idx], tree.order[sorted_idx]
+        distinct = points != others
+        points, others = points[distinct], others[distinct]
+        # coincident points are pushed apart in opposite directions
+        coincident = np.all(pos[points] == pos[others], axis=1)
+        offset = 1e-6 * (coincident * np.sign(others - points))[:, None]
+        add_forces(points, pos[others] + offset, mass[others])
+    return force
+
+
+def edge_arrays(G):
+    node_idx = {node: idx for idx, node in enumerate(G.nodes())}
+    edges = np.array([(node_idx[u], node_idx[v]) for u, v in G.edges() if u != v], dtype=np.int64).reshape(-1, 2)
+    return edges[:, 0], edges[:, 1]
+
+
+# ForceAtlas2 on arrays (positions are updated in place)
+def fa2_iterations(pos, mass, sources, targets, max_iter=1000, scaling_ratio=2.0, gravity=1.0, strong_gravity=False,
+                   theta=1.2, jitter_tolerance=1.0, tol=1e-2, check_every=10, cooling=0.7):
+    n = len(pos)
+    speed = 1.0
+    speed_efficiency = 1.0
+    prev_force = np.zeros_like(pos)
+    temperature = 1.0
+    checkpoint = pos.copy()
+    prev_movement = np.inf
+    for iteration in range(max_iter):
+        # linear attraction along edges
+        diff = pos[sources] - pos[targets]
+        attraction = np.zeros_like(pos)
+        for dim in range(2):
+            attraction[:, dim] = np.bincount(targets, weights=diff[:, dim], minlength=n) - np.bincount(sources, weights=diff[:, dim], minlength=n)
+
+        repulsion = barnes_hut_repulsion(pos, mass, scaling_ratio, theta)
+
+        pos_centered = pos - np.mean(pos, axis=0)
+        if strong_gravity:
+            gravities = -gravity * mass[:, None] * pos_centered
+        else:
+            norm = np.linalg.norm(pos_centered, axis=1)
+            gravities = -gravity * mass[:, None] * pos_centered / np.where(norm > 0, norm, 1)[:, None]
+        force = attraction + repulsion + gravities
+
+        # adaptive speed: slow down when nodes swing back and forth, speed up while they travel in one direction
+        swinging = mass * np.linalg.norm(force - prev_force, axis=1)
+        traction = mass * np.linalg.norm(force + prev_force, axis=1) / 2
+        total_swinging, total_traction = swinging.sum(), traction.sum()
+        opt_jitter = 0.05 * np.sqrt(n)
+        jitter = jitter_tolerance * max(np.sqrt(opt_jitter), min(10, opt_jitter * total_traction / n**2))
+        if total_traction > 0 and total_swinging / total_traction > 2.0:
+            if speed_efficiency > 0.05:
+                speed_efficiency *= 0.5
+            jitter = max(jitter, jitter_tolerance)
+        target_speed = np.inf if total_swinging == 0 else jitter * speed_efficiency * total_traction / total_swinging
+        if total_swinging > jitter * total_traction:
+            if speed_efficiency > 0.05:
+                speed_efficiency *= 0.7
+        elif speed < 1000:
+            speed_efficiency *= 1.3
+        speed = speed + min(target_speed - speed, 0.5 * speed)
+
+        pos += force * (temperature * speed / (1 + np.sqrt(speed * swinging)))[:, None]
+        prev_force = force
+
+        # every check_every iterations, measure how far nodes moved (relative to the size of the layout)
+        # stop once they barely move, and cool the layout down once it jitters in place rather than settling
+        # (with strong gravity, ForceAtlas2 can keep swinging around its equilibrium indefinitely)
+        if (iteration + 1) % check_every == 0:
+            spread = max(np.sqrt(np.mean(np.sum((pos - pos.mean(axis=0))**2, axis=1))), 1e-12)
+            movement = np.mean(np.linalg.norm(pos - checkpoint, axis=1)) / spread
+            if movement < tol:
+                break
+            if movement > 0.9 * prev_movement:
+                temperature *= cooling
+            prev_movement = movement
+            checkpoint = pos.copy()
+    return pos
+
+
+# coarsens a graph (as edge arrays) by merging a random matching of pairs of neighbors
+# returns the number of coarse nodes, the coarse node of each node, and the coarse edges
+def coarsen(n, sources, targets, rng):
+    parent = -np.ones(n, dtype=np.int64)
+    n_coarse = 0
+    for e in rng.permutation(len(sources)):
+        u, v = sources[e], targets[e]
+        if parent[u] < 0 and parent[v] < 0 and u != v:
+            parent[u] = parent[v] = n_coarse
+            n_coarse += 1
+    # unmatched nodes join the group of a matched neighbor if they have one (e.g. the leaves of a hub)
+    for a, b in ((sources, targets), (targets, sources)):
+        join = (parent[a] < 0) & (parent[b] >= 0)
+        parent[a[join]] = parent[b[join]]
+    unmatched = np.flatnonzero(parent < 0)
+    parent[unmatched] = n_coarse + np.arange(len(unmatched))
+    n_coarse += len(unmatched)
+    coarse_edges = np.unique(np.sort(np.stack([parent[sources], parent[targets]], axis=1), axis=1), axis=0)
+    coarse_edges = coarse_edges[coarse_edges[:, 0] != coarse_edges[:, 1]]
+    return n_coarse, parent, coarse_edges[:, 0], coarse_edges[:, 1]
+
+
+# initial positions from a multilevel layout: the graph is coarsened until it is small (or stops shrinking),
+# the coarsest graph is laid out from random positions, and each finer graph starts from its coarser graph's
+# layout (plus a little jitter) and is refined for a few iterations
+def multilevel_positions(n, sources, targets, mass, rng, min_size=50, level_iter=100, **fa2_params):
+    levels = []
+    n_level, s_level, t_level, m_level = n, sources, targets, mass
+    while n_level > min_size:
+        n_coarse, parent, s_coarse, t_coarse = coarsen(n_level, s_level, t_level, rng)
+        if n_coarse > 0.9 * n_level:
+            break
+        levels.append((parent, n_level, s_level, t_level, m_level))
+        m_level = np.bincount(parent, weights=m_level, minlength=n_coarse)
+        n_level, s_level, t_level = n_coarse, s_coarse, t_coarse
+
+    pos = rng.uniform(-1, 1, size=(n_level, 2)) * np.sqrt(n_level)
+    fa2_iterations(pos, m_level, s_level, t_level, max_iter=level_iter, **fa2_params)
+    for parent, n_fine, s_fine, t_fine, m_fine in reversed(levels):
+        spread = np.sqrt(np.mean(np.sum((pos - pos.mean(axis=0))**2, axis=1))) / np.sqrt(len(pos))
+        pos = pos[parent] + rng.normal(scale=max(spread, 1e-3), size=(n_fine, 2))
+        if n_fine < n:
+            fa2_iterations(pos, m_fine, s_fine, t_fine, max_iter=level_iter, **fa2_params)
+    return pos
+
+
+def fast_fa2_layout(G, pos=None, max_iter=1000, scaling_ratio=2.0, gravity=1.0, strong_gravity=False, theta=1.2,
+                    jitter_tolerance=1.0, tol=1e-2, seed=0, multilevel=True):
+    nodes = list(G.nodes())
+    n = len(nodes)
+    if n == 0:
+        return {}
+    if n == 1:
+        return {nodes[0]: np.zeros(2)}
+    rng = np.random.default_rng(seed)
+    sources, targets = edge_arrays(G)
+    mass = np.array([G.degree(node) + 1 for node in nodes], dtype=float)
+    fa2_params = {"scaling_ratio": scaling_ratio, "gravity": gravity, "strong_gravity": strong_gravity,
+                  "theta": theta, "jitter_tolerance": jitter_tolerance, "tol": tol}
+
+    if pos is not None and all(node in pos for node in nodes):
+        pos_arr = np.array([pos[node] for node in nodes], dtype=float)
+    elif multilevel:
+        pos_arr = multilevel_positions(n, sources, targets, mass, rng, **fa2_params)
+    else:
+        pos_arr = rng.uniform(-1, 1, size=(n, 2)) * np.sqrt(n)
+    fa2_iterations(pos_arr, mass, sources, targets, max_iter=max_iter, **fa2_params)
+    return dict(zip(nodes, pos_arr))
@@ -0,0 +1,182 @@
+import numpy as np
+
+
+##################################################################################################
+####################################### GRAPH ANALYTICS ##########################################
+##################################################################################################
+# hop-distance statistics from breadth-first searches
+#   bfs_levels: hop distance of every node reachable from a set of sources, from one BFS
+#   level_profile: number of nodes at each hop distance from a set of sources
+#   hub_level_profiles: level profile from each of a set of hubs
+#   diameter: exact diameter of a connected graph with iFUB (iterative fringe upper bound), usually a handful of BFSs
+#     rather than one per node (Crescenzi et al. 2013, "On computing the diameter of real-world undirected graphs")
+# directed graphs are searched along successors (use G.to_undirected(as_view=True) to ignore direction),
+# except by diameter, which ignores direction
+
+
+# hop distance of every node reachable from sources, in the order nodes are reached
+def bfs_levels(G, sources):
+    adj = G.adj
+    levels = {source: 0 for source in sources}
+    frontier = list(levels.keys())
+    level = 0
+    while len(frontier) > 0:
+        level += 1
+        next_frontier = []
+        for node in frontier:
+            for neighbor in adj[node]:
+                if neighbor not in levels:
+                    levels[neighbor] = level
+                    next_frontier.append(neighbor)
+        frontier = next_frontier
+    return levels
+
+
+# number of nodes at each hop distance from sources (profile[k] nodes are k hops from the nearest source)
+# np.cumsum(profile)[k] is the number of nodes within k hops
+def level_profile(G, sources):
+    levels = bfs_levels(G, sources)
+    return np.bincount(np.fromiter(levels.values(), dtype=np.int64, count=len(levels)))
+
+
+# level profile from each hub on its own (the adjacency is only built once)
+def hub_level_profiles(G, hubs):
+    nodes, indptr, indices = adjacency_csr(G)
+    node_idx = {node: i for i, node in enumerate(nodes)}
+    profiles = {}
+    for hub in hubs:
+        if hub in node_idx:
+            dist = csr_bfs(indptr, indices, [node_idx[hub]])
+            profiles[hub] = np.bincount(dist[dist >= 0])
+    return profiles
+
+
+# nodes of G, and the successors of the i-th node as indices[indptr[i]:indptr[i+1]] (node indices into nodes)
+def adjacency_csr(G):
+    nodes = list(G.nodes())
+    node_idx = {node: i for i, node in enumerate(nodes)}
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    indices = []
+    for i, node in enumerate(nodes):
+        nbrs = G.adj[node]
+        indices.extend(node_idx[v] for v in nbrs)
+        indptr[i+1] = indptr[i] + len(nbrs)
+    return nodes, indptr, np.array(indices, dtype=np.int64)
+
+
+# successors of each node of frontier (node indices), with the node each one is a successor of
+def csr_neighbors(indptr, indices, frontier):
+    starts, counts = indptr[frontier], indptr[frontier+1] - indptr[frontier]
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(frontier, counts), indices[np.repeat(starts, counts) + offsets]
+
+
+# hop distance from sources (node indices) to every node of a csr adjacency, -1 if unreachable
+def csr_bfs(indptr, indices, sources):
+    dist = np.full(len(indptr) - 1, -1, dtype=np.int64)
+    frontier = np.unique(np.asarray(sources, dtype=np.int64))
+    dist[frontier] = 0
+    level = 0
+    while frontier.size > 0:
+        level += 1
+        _, nbrs = csr_neighbors(indptr, indices, frontier)
+        frontier = np.unique(nbrs[dist[nbrs] < 0])
+        dist[frontier] = level
+    return dist
+
+
+# BFS tree from source (a node index): the parent of every node on a shortest path from source
+# (-1 if unreachable, source for itself); each node's parent is its lowest-indexed predecessor one hop closer
+def csr_bfs_tree(indptr, indices, source):
+    parent = np.full(len(indptr) - 1, -1, dtype=np.int64)
+    parent[source] = source
+    frontier = np.array([source], dtype=np.int64)
+    while frontier.size > 0:
+        origins, nbrs = csr_neighbors(indptr, indices, frontier)
+        unseen = parent[nbrs] < 0
+        frontier, first = np.unique(nbrs[unseen], return_index=True)
+        parent[frontier] = origins[unseen][first]
+    return parent
+
+
+# eccentricities of sources (node indices) of a symmetric csr adjacency
+# runs 64 BFSs at once, one per bit of a uint64 per node: each level, a node is reached by every source
+# that reached one of its neighbors in the last level
+def csr_eccentricities(indptr, indices, sources):
+    sources = np.asarray(sources, dtype=np.int64)
+    n = len(indptr) - 1
+    # rows without neighbors are masked out (reduceat returns an element of the next row for them)
+    has_nbrs = indptr[1:] > indptr[:-1]
+    row_starts = np.minimum(indptr[:-1], max(len(indices) - 1, 0))
+    ecc = np.zeros(len(sources), dtype=np.int64)
+    bits = np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))
+    for batch_start in range(0, len(sources), 64):
+        batch = sources[batch_start:batch_start+64]
+        frontier = np.zeros(n, dtype=np.uint64)
+        np.bitwise_or.at(frontier, batch, bits[:len(batch)])
+        visited = frontier.copy()
+        level = 0
+        while len(indices) > 0:
+            reached = np.bitwise_or.reduceat(frontier[indices], row_starts)
+            reached[~has_nbrs] = 0
+            frontier = reached & ~visited
+            active = np.bitwise_or.reduce(frontier)
+            if active == 0:
+                break
+            level += 1
+            visited |= frontier
+            # sources still reaching new nodes have eccentricity at least level
+            ecc[batch_start:batch_start+len(batch)][(active & bits[:len(batch)]) != 0] = level
+    return ecc
+
+
+def eccentricity(G, node):
+    return max(bfs_levels(G, [node]).values())
+
+
+# exact diameter of a connected graph, ignoring edge direction
+def diameter(G):
+    if G.number_of_nodes() <= 1:
+        return 0
+    if G.is_directed():
+        G = G.to_undirected(as_view=True)
+    nodes, indptr, indices = adjacency_csr(G)
+    degrees = indptr[1:] - indptr[:-1]
+
+    # double sweep from the node of highest degree: the node furthest from a far node gives a lower bound,
+    # and the middle of the path between them is a central node to run iFUB from
+    dist = csr_bfs(indptr, indices, [np.argmax(degrees)])
+    a = np.argmax(dist)
+    dist_a = csr_bfs(indptr, indices, [a])
+    b = np.argmax(dist_a)
+    lower = dist_a[b]
+    dist_b = csr_bfs(indptr, indices, [b])
+    on_path = np.flatnonzero((dist_a + dist_b == lower) & (dist_a == lower // 2))
+    root = on_path[0]
+
+    # iFUB: nodes at level i of a BFS from root have eccentricity at most 2i, so once the largest eccentricity
+    # of the nodes at levels >= i exceeds 2(i - 1), no node closer to root can do better
+    dist = csr_bfs(indptr, indices, [root])
+    i = dist.max()
+    lower = max(lower, i)
+    upper = 2 * i
+    while upper > lower:
+        fringe = np.flatnonzero(dist == i)
+        for batch_start in range(0, len(fringe), 64):
+            lower = max(lower, csr_eccentricities(indptr, indices, fringe[batch_start:batch_start+64]).max())
+            if lower > 2 * (i - 1):
+                return int(lower)
+        upper = 2 * (i - 1)
+        i -= 1
+    return int(lower)
+
+
+# diameters of the connected (weakly connected, ignoring direction, if directed) components of G
+def component_diameters(G):
+    import networkx as nx
+    if G.is_directed():
+        components = nx.weakly_connected_components(G)
+        G = G.to_undirected(as_view=True)
+    else:
+        components = nx.connected_components(G)
+    return [diameter(G.subgraph(component)) for component in components]
@@ -1,17 +1,122 @@
 import os
+import io
+import gzip
 import json
-import requests
-from bs4 import BeautifulSoup
 import networkx as nx
 import numpy as np
-import random
 import packcircles as pc
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MaxNLocator
 import matplotlib.colors as mcolors
 
+from layout_cache import canonical_subgraph, config_hash, component_hash, warm_start_positions
+from fast_layout import fast_fa2_layout
 
-def multi_component_graph(G, layout="kamada_kawai", r_fraction=1.0, padding=2, min_component_size=1, **layout_params):
+
+# lays out one component, centered at the origin
+# pos_init (positions of every node, e.g. from warm_start_positions) replaces the initial layout where the layout takes one
+def layout_component(subG, layout="kamada_kawai", layout_params={}, pos_init=None):
+    if layout == "kamada_kawai":
+        pos_subG = nx.kamada_kawai_layout(subG, pos=pos_init, center=(0,0), **layout_params)
+    elif layout == "spring":
+        pos_subG = nx.spring_layout(subG, pos=pos_init, center=(0,0), **layout_params)
+    elif layout == "spiral":
+        pos_subG = nx.spiral_layout(subG, center=(0,0), **layout_params)
+    elif layout == "spectral":
+        pos_subG = nx.spectral_layout(subG, center=(0,0), **layout_params)
+    elif layout == "forceatlas2":
+        if pos_init is None:
+            pos_init = nx.kamada_kawai_layout(subG, center=(0,0))
+        pos_subG = nx.forceatlas2_layout(subG, pos=pos_init, **layout_params)
+        center = np.mean(np.array(list(pos_subG.values())), axis=0)
+        pos_subG = {k:v-center for k,v in pos_subG.items()}
+    elif layout == "fast_fa2":
+        # barnes-hut forceatlas2 for large components (see fast_layout.py)
+        pos_subG = fast_fa2_layout(subG, pos=pos_init, **layout_params)
+        center = np.mean(np.array(list(pos_subG.values())), axis=0)
+        pos_subG = {k:v-center for k,v in pos_subG.items()}
+    elif layout == "bfs":
+        max_deg_node = max(subG.degree, key=lambda x: x[1])[0]
+        pos_subG = nx.bfs_layout(subG.to_undirected(), start=max_deg_node, center=(0,0))
+    elif layout == "arf":
+        pos_subG = nx.arf_layout(subG, pos=pos_init, **layout_params)
+        center = np.mean(np.array(list(pos_subG.values())), axis=0)
+        pos_subG = {k:v-center for k,v in pos_subG.items()}
+    else:
+        raise ValueError(f"{layout} not a recognized layout")
+    return pos_subG
+
+
+# iteration parameter (and its default) of iterative layouts
+warm_start_iterations = {"forceatlas2": ("max_iter", 100), "fast_fa2": ("max_iter", 1000), "spring": ("iterations", 50), "arf": ("max_iter", 1000)}
+
+
+# plans the layout of a component: returns its cached layout if its structure is unchanged,
+# or the layout parameters and initial positions to lay it out with
+# (warm-starting from the cached positions of its surviving nodes if there are any)
+def plan_component_layout(subG, layout, layout_params, layout_cache):
+    if layout_cache is None:
+        return None, layout_params, None
+    config = config_hash(subG.is_directed(), layout, layout_params)
+    key = component_hash(subG, layout, layout_params)
+    pos_subG = layout_cache.get(key)
+    if pos_subG is not None:
+        layout_cache.hits += 1
+        layout_cache.record(key, config, pos_subG.keys())
+        return pos_subG, layout_params, None
+
+    pos_init = None
+    prev_pos = layout_cache.previous_positions(subG, config)
+    if prev_pos is not None:
+        pos_init = warm_start_positions(subG, prev_pos)
+    if pos_init is None:
+        layout_cache.misses += 1
+    else:
+        layout_cache.warm_starts += 1
+        # a warm start begins close to equilibrium, so iterative layouts get a fraction of their iterations
+        iter_param, default_iter = warm_start_iterations.get(layout, (None, None))
+        if iter_param is not None:
+            n_iter = layout_params.get(iter_param, default_iter)
+            layout_params = dict(layout_params, **{iter_param: max(1, int(n_iter * layout_cache.warm_start_fraction))})
+    return None, layout_params, pos_init
+
+
+# lays out each component of subG_list, reusing cached layouts where possible
+# with a pool (a concurrent.futures executor, which can be shared between calls), components are laid out
+# in parallel, largest first so the slowest layouts start earliest; components smaller than min_pool_size
+# are laid out in this process meanwhile, as they take less time than sending them to a worker
+# (layouts only depend on their component, parameters and initial positions, so the results don't depend on the pool)
+def layout_components(subG_list, layout="kamada_kawai", layout_params={}, layout_cache=None, pool=None, min_pool_size=50):
+    pos_list = [None] * len(subG_list)
+    jobs = []
+    for idx, subG in enumerate(subG_list):
+        pos_subG, job_params, pos_init = plan_component_layout(subG, layout, layout_params, layout_cache)
+        if pos_subG is None:
+            jobs.append((idx, job_params, pos_init))
+        else:
+            pos_list[idx] = pos_subG
+
+    jobs = sorted(jobs, key=lambda job: -subG_list[job[0]].number_of_nodes())
+    computed = [idx for idx, _, _ in jobs]
+    futures = []
+    if pool is not None:
+        futures = [(idx, pool.submit(layout_component, subG_list[idx], layout, job_params, pos_init))
+                   for idx, job_params, pos_init in jobs if subG_list[idx].number_of_nodes() >= min_pool_size]
+        jobs = [job for job in jobs if subG_list[job[0]].number_of_nodes() < min_pool_size]
+    for idx, job_params, pos_init in jobs:
+        pos_list[idx] = layout_component(subG_list[idx], layout, job_params, pos_init)
+    for idx, future in futures:
+        pos_list[idx] = future.result()
+
+    if layout_cache is not None:
+        for idx in computed:
+            subG = subG_list[idx]
+            layout_cache.put(component_hash(subG, layout, layout_params), config_hash(subG.is_directed(), layout, layout_params), pos_list[idx])
+    return pos_list
+
+
+# lays out each component of G and packs them together
+# with a layout_cache (see layout_cache.py), unchanged components reuse their previous layouts
+# with a pool, components are laid out in parallel (see layout_components)
+def multi_component_graph(G, layout="kamada_kawai", r_fraction=1.0, padding=2, min_component_size=1, layout_cache=None, pool=None, **layout_params):
     subG_list = [] # list of subcomponents
     pos_subG_list = [] # list of subcomponent positions
     r_list = [] # list of subcomponent radii
@@ -22,51 +127,29 @@ def multi_component_graph(G, layout="kamada_kawai", r_fraction=1.0, padding=2, m
     else:
         components = nx.connected_components(G)
 
+    # determine subgraphs and apply position layout
+    subG_all = [canonical_subgraph(G, component) for component in components if len(component) >= min_component_size]
+    pos_all = layout_components(subG_all, layout, layout_params, layout_cache=layout_cache, pool=pool)
+
     # loop through each connected component
-    for component in components:
-        if len(component) >= min_component_size:
-            # determine subgraph and apply kamada kawai position layout
-            subG = G.subgraph(component)
-            if layout == "kamada_kawai":
-                pos_subG = nx.kamada_kawai_layout(subG, center=(0,0), **layout_params)
-            elif layout == "spring":
-                pos_subG = nx.spring_layout(subG, center=(0,0), **layout_params)
-            elif layout == "spiral":
-                pos_subG = nx.spiral_layout(subG, center=(0,0), **layout_params)
-            elif layout == "spectral":
-                pos_subG = nx.spectral_layout(subG, center=(0,0), **layout_params)
-            elif layout == "forceatlas2":
-                pos_kk = nx.kamada_kawai_layout(subG, center=(0,0))
-                pos_subG = nx.forceatlas2_layout(subG, pos=pos_kk, **layout_params)
-                center = np.mean(np.array(list(pos_subG.values())), axis=0)
-                pos_subG = {k:v-center for k,v in pos_subG.items()}
-            elif layout == "bfs":
-                max_deg_node = max(subG.degree, key=lambda x: x[1])[0]
-                pos_subG = nx.bfs_layout(subG.to_undirected(), start=max_deg_node, center=(0,0))
-            elif layout == "arf":
-                pos_subG = nx.arf_layout(subG, **layout_params)
-                center = np.mean(np.array(list(pos_subG.values())), axis=0)
-                pos_subG = {k:v-center for k,v in pos_subG.items()}
-            else:
-                raise ValueError(f"{layout} not a recognized layout")
+    for subG, pos_subG in zip(subG_all, pos_all):
+        # compute e_lens
+        e_lens = []
+        for u, v in subG.edges():
+            e_len = np.linalg.norm(pos_subG[u] - pos_subG[v])
+            e_lens.append(e_len)
+        # (isolated nodes have no edges, so keep their scale)
+        min_e_len = np.min(e_lens) if len(e_lens) > 0 else 1.0
+        pos_subG_rescale = {k: v/min_e_len for k, v in pos_subG.items()}
     
-            # compute e_lens
-            e_lens = []
-            for u, v in subG.edges():
-                e_len = np.linalg.norm(pos_subG[u] - pos_subG[v])
-                e_lens.append(e_len)
-            min_e_len = np.min(e_lens)
-            max_e_len = np.max(e_lens)
-            pos_subG_rescale = {k: v/min_e_len for k, v in pos_subG.items()}
+        # record positions and subgraphs
+        subG_list.append(subG)
+        pos_subG_list.append(pos_subG_rescale)
     
-            # record positions and subgraphs
-            subG_list.append(subG)
-            pos_subG_list.append(pos_subG_rescale)
-    
-            # compute max node distance from center (to determine radius)
-            pos_subG_arr = np.array(list(pos_subG_rescale.values()))
-            max_r = np.max(np.linalg.norm(pos_subG_arr, axis=1))
-            r_list.append(max_r + padding)
+        # compute max node distance from center (to determine radius)
+        pos_subG_arr = np.array(list(pos_subG_rescale.values()))
+        max_r = np.max(np.linalg.norm(pos_subG_arr, axis=1))
+        r_list.append(max_r + padding)
 
     # perform circle packing for circles associated with each component
     r_list_argsort = np.argsort(r_list)
@@ -79,31 +162,162 @@ def multi_component_graph(G, layout="kamada_kawai", r_fraction=1.0, padding=2, m
         for k, v in pos_subG_list[idx].items():
             pos_subG_rescale_shift[k] = v + np.array([x,y])  - center
 
+    if layout_cache is not None:
+        layout_cache.save()
     return pos_subG_rescale_shift
 
 
-def to_cytoscape(G, pos, node_to_color_map, node_to_info_map=None, save_loc=None):
-    elements = []
-    for node in pos.keys():
-        data = {'id': node, 'color': mcolors.to_hex(node_to_color_map[node])}
-        if node_to_info_map is not None:
-            data['info'] = node_to_info_map[node]
-        node_data = {
-            'data': data,
-            'position': {'x': pos[node][0], 'y': pos[node][1]}
-        }
-        elements.append(node_data)
-    
-    for source, target in G.edges():
-        if source in pos.keys() and target in pos.keys():
-            edge_data = {
-                'data': {'id': f'{source}-{target}', 
-                         'source': str(source), 
-                         'target': str(target)}
-            }
-            elements.append(edge_data)
+def cytoscape_node(node, pos, node_to_color_map, node_to_info_map=None):
+    data = {'id': node, 'color': mcolors.to_hex(node_to_color_map[node])}
+    if node_to_info_map is not None:
+        data['info'] = node_to_info_map[node]
+    return {'data': data, 'position': {'x': pos[node][0], 'y': pos[node][1]}}
+
 
+def cytoscape_edge(source, target):
+    return {'data': {'id': f'{source}-{target}', 'source': str(source), 'target': str(target)}}
+
+
+# cytoscape elements of the nodes of G with positions (or of nodes, if given) and the edges between them
+def iter_cytoscape_elements(G, pos, node_to_color_map, node_to_info_map=None, nodes=None):
+    if nodes is None:
+        for node in pos.keys():
+            yield cytoscape_node(node, pos, node_to_color_map, node_to_info_map)
+        for source, target in G.edges():
+            if source in pos.keys() and target in pos.keys():
+                yield cytoscape_edge(source, target)
+        return
+
+    nodes = [node for node in nodes if node in pos]
+    for node in nodes:
+        yield cytoscape_node(node, pos, node_to_color_map, node_to_info_map)
+    # edges in the order G.edges() gives them (each undirected edge once)
+    node_set = set(nodes)
+    seen = set()
+    for source in nodes:
+        for target in G.adj[source]:
+            if target in node_set and (G.is_directed() or target not in seen):
+                yield cytoscape_edge(source, target)
+        seen.add(source)
+
+
+def to_cytoscape(G, pos, node_to_color_map, node_to_info_map=None, save_loc=None):
+    elements = list(iter_cytoscape_elements(G, pos, node_to_color_map, node_to_info_map))
     if save_loc is not None:
         with open(save_loc, "w") as f:
             json.dump(elements, f, indent=4)
-    return elements
\ No newline at end of file
+    return elements
+
+
+# gzip file opened for writing text, without a timestamp (so unchanged contents give identical files)
+def open_gzip(loc):
+    return io.TextIOWrapper(gzip.GzipFile(loc, mode="wb", mtime=0), encoding="utf-8")
+
+
+# writes elements as a JSON array to each of files, one element at a time
+def write_json_array(files, elements):
+    n = 0
+    for f in files:
+        f.write("[")
+    for element in elements:
+        text = ("," if n > 0 else "") + json.dumps(element, separators=(",", ":"))
+        for f in files:
+            f.write(text)
+        n += 1
+    for f in files:
+        f.write("]")
+    return n
+
+
+# streams cytoscape elements to disk and returns the paths of the files written
+#   save_loc: every element in one JSON file, plus a gzipped copy (save_loc.gz) for servers of precompressed files
+#   bundle_loc: level-of-detail bundle directory, for viewers that load the graph a piece at a time
+#     index.json.gz: node and edge counts, and each chunk's file, size, bounding box and regions
+#     overview.json.gz: one node per region (info of node_to_info_map, or chunk if there is none)
+#       at the mean position of its nodes, with edges weighted by the number of edges between regions
+#     chunk_{i}.json.gz: elements of whole components, small components grouped up to chunk_size nodes
+# only the elements of one chunk are held in memory at a time
+def export_cytoscape(G, pos, node_to_color_map, node_to_info_map=None, save_loc=None, bundle_loc=None, chunk_size=500):
+    written = []
+    if save_loc is not None:
+        with open(save_loc, "w") as f, open_gzip(f"{save_loc}.gz") as f_gz:
+            write_json_array([f, f_gz], iter_cytoscape_elements(G, pos, node_to_color_map, node_to_info_map))
+        written += [save_loc, f"{save_loc}.gz"]
+    if bundle_loc is None:
+        return written
+
+    os.makedirs(bundle_loc, exist_ok=True)
+    for name in os.listdir(bundle_loc):
+        if name.startswith("chunk_") and name.endswith(".json.gz"):
+            os.remove(os.path.join(bundle_loc, name))
+
+    # group components into chunks, largest first
+    if G.is_directed():
+        components = nx.weakly_connected_components(G.subgraph(pos.keys()))
+    else:
+        components = nx.connected_components(G.subgraph(pos.keys()))
+    components = sorted((list(c) for c in components), key=len, reverse=True)
+    chunks = []
+    for component in components:
+        if len(chunks) > 0 and len(chunks[-1]) + len(component) <= chunk_size:
+            chunks[-1] += component
+        else:
+            chunks.append(component)
+
+    # nodes of each chunk in graph order, so the chunks don't depend on the order components are found in
+    # (sorted into their chunks in one pass over the graph)
+    node_to_chunk = {node: i for i, chunk in enumerate(chunks) for node in chunk}
+    chunks = [[] for _ in chunks]
+    for node in G.nodes():
+        if node in node_to_chunk:
+            chunks[node_to_chunk[node]].append(node)
+
+    node_to_region = {}
+    region_to_chunks = {}
+    chunk_index = []
+    for i, chunk in enumerate(chunks):
+        loc = os.path.join(bundle_loc, f"chunk_{i}.json.gz")
+        with open_gzip(loc) as f:
+            n_elements = write_json_array([f], iter_cytoscape_elements(G, pos, node_to_color_map, node_to_info_map, nodes=chunk))
+        written.append(loc)
+        xy = np.array([pos[node] for node in chunk])
+        regions = {}
+        for node in chunk:
+            region = str(node_to_info_map[node]) if node_to_info_map is not None else f"chunk {i}"
+            node_to_region[node] = region
+            regions[region] = None
+        for region in regions:
+            region_to_chunks.setdefault(region, []).append(i)
+        chunk_index.append({"file": f"chunk_{i}.json.gz",
+                            "nodes": len(chunk),
+                            "edges": n_elements - len(chunk),
+                            "bbox": [float(v) for v in np.concatenate([xy.min(axis=0), xy.max(axis=0)])],
+                            "regions": list(regions.keys())})
+
+    # overview graph of regions
+    region_nodes = {}
+    for node, region in node_to_region.items():
+        region_nodes.setdefault(region, []).append(node)
+    region_edges = {}
+    for source, target in G.edges():
+        if source in node_to_region and target in node_to_region and node_to_region[source] != node_to_region[target]:
+            edge = (node_to_region[source], node_to_region[target])
+            region_edges[edge] = region_edges.get(edge, 0) + 1
+    overview = []
+    for region, nodes in region_nodes.items():
+        colors = [mcolors.to_hex(node_to_color_map[node]) for node in nodes]
+        center = np.mean(np.array([pos[node] for node in nodes]), axis=0)
+        overview.append({'data': {'id': region, 'color': max(dict.fromkeys(colors), key=colors.count), 'size': len(nodes),
+                                  'chunks': region_to_chunks[region]},
+                         'position': {'x': float(center[0]), 'y': float(center[1])}})
+    for (source, target), weight in region_edges.items():
+        overview.append({'data': {'id': f'{source}-{target}', 'source': source, 'target': target, 'weight': weight}})
+    with open_gzip(os.path.join(bundle_loc, "overview.json.gz")) as f:
+        write_json_array([f], overview)
+    with open_gzip(os.path.join(bundle_loc, "index.json.gz")) as f:
+        json.dump({"nodes": len(node_to_region),
+                   "edges": sum(chunk["edges"] for chunk in chunk_index),
+                   "overview": "overview.json.gz",
+                   "chunks": chunk_index}, f)
+    written += [os.path.join(bundle_loc, "overview.json.gz"), os.path.join(bundle_loc, "index.json.gz")]
+    return written
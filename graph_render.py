@@ -0,0 +1,136 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.colors as mcolors
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.ticker import MaxNLocator
+from xml.sax.saxutils import escape
+
+
+##################################################################################################
+######################################## GRAPH RENDERING #########################################
+##################################################################################################
+# renders graph figures from position arrays, in the style of nx.draw (labelled circles, black edges, arrowheads
+# on directed edges), without creating an artist per node and edge
+#   render_svg: writes SVG directly, with one path per node color, one path for all edges and one for all arrowheads
+#   render_png: rasterizes the same figure with batched matplotlib collections
+# renders take plain arrays (see render_arrays), so they can be sent to worker processes cheaply
+# sizes are in points (1/72 inch), as in matplotlib: node_size is the area of a node, as in nx.draw
+MARGIN = 0.05
+
+
+# node names, positions, colors (as hex) and edges (as node indices) of the nodes of G with positions
+def render_arrays(G, pos, node_to_color_map, default_color="lightblue"):
+    names = [node for node in G.nodes() if node in pos]
+    node_idx = {node: i for i, node in enumerate(names)}
+    xy = np.array([pos[node] for node in names], dtype=float).reshape(-1, 2)
+    colors = [mcolors.to_hex(node_to_color_map.get(node, default_color)) for node in names]
+    edges = np.array([(node_idx[u], node_idx[v]) for u, v in G.edges() if u in node_idx and v in node_idx], dtype=np.int64).reshape(-1, 2)
+    return names, xy, colors, edges
+
+
+# positions in points on a figure of figsize inches (y pointing down), fitted inside the margins like matplotlib axes
+# (each axis is scaled on its own, as nx.draw does)
+def figure_coordinates(xy, figsize, pad):
+    width, height = 72 * figsize[0], 72 * figsize[1]
+    lo, hi = xy.min(axis=0), xy.max(axis=0)
+    span = np.where(hi > lo, hi - lo, 1.0)
+    inner = np.array([width, height]) * (1 - 2 * MARGIN) - 2 * pad
+    scaled = (xy - lo) / span * inner + np.array([width, height]) * MARGIN + pad
+    scaled[:, 1] = height - scaled[:, 1]
+    return scaled
+
+
+# edge segments shortened to the node boundaries, and arrowhead triangles at their targets (if directed)
+def edge_geometry(pts, edges, radius, directed, arrow_size):
+    start, end = pts[edges[:, 0]], pts[edges[:, 1]]
+    delta = end - start
+    length = np.linalg.norm(delta, axis=1, keepdims=True)
+    unit = np.divide(delta, length, out=np.zeros_like(delta), where=length > 0)
+    if not directed:
+        return start, end, None
+    # arrowheads touch the target node, and their edges stop at their base
+    tip = end - unit * radius
+    base = tip - unit * arrow_size
+    normal = np.stack([-unit[:, 1], unit[:, 0]], axis=1) * arrow_size * 0.4
+    heads = np.stack([tip, base + normal, base - normal], axis=1)
+    return start + unit * radius, base, heads
+
+
+def fmt(values):
+    return ",".join(f"{v:.2f}" for v in values)
+
+
+def render_svg(names, xy, colors, edges, save_loc, directed=False, figsize=(48, 32), node_size=1000,
+               with_labels=True, font_size=12, arrow_size=10):
+    width, height = 72 * figsize[0], 72 * figsize[1]
+    radius = np.sqrt(node_size) / 2
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{figsize[0]}in" height="{figsize[1]}in" viewBox="0 0 {width} {height}">\n',
+           f'<rect width="{width}" height="{height}" fill="white"/>\n']
+    if len(names) > 0:
+        pts = figure_coordinates(xy, figsize, radius)
+        start, end, heads = edge_geometry(pts, edges, radius, directed, arrow_size)
+        if len(edges) > 0:
+            d = "".join(f"M{fmt(a)}L{fmt(b)}" for a, b in zip(start, end))
+            out.append(f'<path d="{d}" fill="none" stroke="black" stroke-width="1"/>\n')
+        if heads is not None and len(heads) > 0:
+            d = "".join(f"M{fmt(h[0])}L{fmt(h[1])}L{fmt(h[2])}Z" for h in heads)
+            out.append(f'<path d="{d}" fill="black"/>\n')
+        # nodes of a color as one path of circles
+        by_color = {}
+        for i, color in enumerate(colors):
+            by_color.setdefault(color, []).append(i)
+        for color, idx in by_color.items():
+            d = "".join(f"M{x - radius:.2f},{y:.2f}a{radius:.2f},{radius:.2f} 0 1,0 {2 * radius:.2f},0a{radius:.2f},{radius:.2f} 0 1,0 {-2 * radius:.2f},0"
+                        for x, y in pts[idx])
+            out.append(f'<path d="{d}" fill="{color}"/>\n')
+        if with_labels:
+            out.append(f'<g font-family="DejaVu Sans, sans-serif" font-size="{font_size}" text-anchor="middle" dominant-baseline="central">\n')
+            out += [f'<text x="{x:.2f}" y="{y:.2f}">{escape(str(name))}</text>\n' for name, (x, y) in zip(names, pts)]
+            out.append('</g>\n')
+    out.append('</svg>\n')
+    with open(save_loc, "w") as f:
+        f.writelines(out)
+
+
+def render_png(names, xy, colors, edges, save_loc, directed=False, figsize=(48, 32), node_size=1000,
+               with_labels=True, font_size=12, arrow_size=10, dpi=100):
+    width, height = 72 * figsize[0], 72 * figsize[1]
+    radius = np.sqrt(node_size) / 2
+    fig = plt.figure(figsize=figsize)
+    # an axes covering the figure in points, with y pointing down as in render_svg
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_xlim(0, width)
+    ax.set_ylim(height, 0)
+    ax.axis("off")
+    if len(names) > 0:
+        pts = figure_coordinates(xy, figsize, radius)
+        start, end, heads = edge_geometry(pts, edges, radius, directed, arrow_size)
+        ax.add_collection(LineCollection(np.stack([start, end], axis=1), colors="black", linewidths=1))
+        if heads is not None:
+            ax.add_collection(PolyCollection(heads, facecolors="black", edgecolors="none"))
+        ax.scatter(pts[:, 0], pts[:, 1], s=node_size, c=colors, zorder=2)
+        if with_labels:
+            for name, (x, y) in zip(names, pts):
+                ax.text(x, y, str(name), fontsize=font_size, ha="center", va="center", zorder=3)
+    fig.savefig(save_loc, dpi=dpi)
+    plt.close(fig)
+
+
+# renders a graph to svg_loc, and to png_loc if given (run in worker processes by plot_crawl_outputs)
+def render_graph(names, xy, colors, edges, svg_loc, png_loc=None, png_dpi=100, **render_kwargs):
+    render_svg(names, xy, colors, edges, svg_loc, **render_kwargs)
+    if png_loc is not None:
+        render_png(names, xy, colors, edges, png_loc, dpi=png_dpi, **render_kwargs)
+
+
+# locations within each number of hops of a location
+def render_nodes_degree(nodes_from_start, start, save_loc):
+    fig, ax = plt.subplots(figsize=[6, 4])
+    ax.plot(nodes_from_start, 'o-')
+    ax.xaxis.set_major_locator(MaxNLocator(integer=True))
+    ax.yaxis.set_major_locator(MaxNLocator(integer=True))
+    ax.set_xlabel(f"Degrees from {start}")
+    ax.set_ylabel("Locations")
+    fig.tight_layout()
+    fig.savefig(save_loc, dpi=300)
+    plt.close(fig)
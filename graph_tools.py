@@ -1,5 +1,8 @@
+import numpy as np
 import networkx as nx
 
+from compact_graph import CompactGraph, as_compact
+
 ##################################################################################################
 ################################# GRAPH UTILITY FUNCTIONS ########################################
 ##################################################################################################
@@ -11,55 +14,82 @@ def try_remove_edge(G, a, b):
         return None
 
 
+# removes edges into nodes that aren't reciprocated, then nodes left without edges
+# (G may be a networkx or compact graph, and the result is of the same kind)
 def remove_unreciprocated_nodes(G, nodes):
-    G = G.copy()
+    compact = as_compact(G)
     for target in nodes:
-        # find nodes that point to target
-        incoming = list(G.predecessors(target))
-        for predecessor in incoming:
-            # remove edge if it isn't reciprocated
-            if not G.has_edge(target, predecessor):
-                G.remove_edge(predecessor, target)
+        if target not in compact:
+            raise nx.NetworkXError(f"The node {target} is not in the digraph.")
+    n = compact.number_of_nodes()
+    is_target = np.zeros(n, dtype=bool)
+    is_target[[compact.node_idx[target] for target in nodes]] = True
+
+    # edges predecessor -> target without target -> predecessor
+    src = np.repeat(np.arange(n, dtype=np.int64), np.diff(compact.indptr))
+    dst = compact.indices
+    unreciprocated = is_target[dst] & ~np.isin(dst * n + src, src * n + dst)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(src[~unreciprocated], minlength=n))]).astype(np.int64)
+    pruned = CompactGraph(compact.names, indptr, dst[~unreciprocated], directed=compact.directed, attrs=compact.attrs)
 
     # remove isolated nodes
-    isolated_nodes = list(nx.isolates(G))
-    G.remove_nodes_from(isolated_nodes)
-    return G
+    pruned = pruned.subgraph(pruned.degrees() > 0)
+    return pruned if isinstance(G, CompactGraph) else pruned.to_networkx()
 
 
-def assign_by_neighbor(G, node_to_value_dict):
+# labels unlabeled nodes with the value of their labeled neighbors, spreading outwards from the labeled nodes
+# one hop at a time (a multi-source BFS, so each node and edge is visited once)
+# a node reached at hop k takes the value of its neighbors labeled at hop k-1; if they disagree, ties decides:
+#   None: the node is left unlabeled (and doesn't pass a value on)
+#   "majority": the most common value (the one labeled first if several are)
+#   "first": the value of the neighbor labeled first
+# nodes are labeled in a deterministic order (seeds in the order of node_to_value_dict, then by hop and discovery)
+# nodes with a None value are left unlabeled
+# with return_hops, the hop distance of each labeled node from the nearest seed is returned too
+def assign_by_neighbor(G, node_to_value_dict, ties=None, return_hops=False):
+    if ties not in [None, "majority", "first"]:
+        raise ValueError(f"{ties} not a recognized tie policy")
     node_to_value_dict = node_to_value_dict.copy()
-    uncategorized_nodes = set(G.nodes()) - set(node_to_value_dict.keys())
-    indeterminate_nodes = set()
-
-    # handle components that have no value at any node
-    components = [c for c in nx.connected_components(G)]
-    for c in components:
-        any_value = False
-        for node in c:
-            if node_to_value_dict.get(node, None) is not None:
-                any_value = True
-                break
-        if not any_value:
-            c_set = set(c)
-            indeterminate_nodes = indeterminate_nodes.union(c_set)
-            uncategorized_nodes = uncategorized_nodes - c_set
-
-    node_to_value_dict_prog = 0
-    while len(node_to_value_dict) > node_to_value_dict_prog:
-        node_to_value_dict_prog = len(node_to_value_dict)
-        for node in uncategorized_nodes:
-            possible_values = set()
+    node_to_hops_dict = {node: 0 for node, value in node_to_value_dict.items() if value is not None and node in G}
+    # order in which nodes were labeled
+    rank = {node: i for i, node in enumerate(node_to_hops_dict.keys())}
+    visited = set(node_to_value_dict.keys())
+    frontier = list(node_to_hops_dict.keys())
+    hops = 0
+    while len(frontier) > 0:
+        hops += 1
+        # unvisited neighbors of the last hop, in the order they are reached
+        candidates = []
+        for node in frontier:
             for neighbor in G.neighbors(node):
-                possible_value = node_to_value_dict.get(neighbor, None)
-                if possible_value is not None:
-                    possible_values.add(possible_value)
-            if len(possible_values) == 0:
-                pass
-            elif len(possible_values) == 1:
-                node_to_value_dict[node] = list(possible_values)[0]
-                uncategorized_nodes = uncategorized_nodes - {node}
+                if neighbor not in visited:
+                    visited.add(neighbor)
+                    candidates.append(neighbor)
+
+        # values only come from the last hop, so the order candidates are labeled in doesn't matter
+        frontier = []
+        for node in candidates:
+            labeled = [neighbor for neighbor in G.neighbors(node) if node_to_hops_dict.get(neighbor, None) == hops - 1]
+            values = list(dict.fromkeys(node_to_value_dict[neighbor] for neighbor in labeled))
+            if len(values) == 1:
+                value = values[0]
+            elif ties is None:
+                continue
+            elif ties == "first":
+                value = node_to_value_dict[min(labeled, key=lambda neighbor: rank[neighbor])]
             else:
-                uncategorized_nodes = uncategorized_nodes - {node}
-        n_uncategorized_nodes_prev = len(uncategorized_nodes)
-    return node_to_value_dict
\ No newline at end of file
+                counts = {value: 0 for value in values}
+                for neighbor in labeled:
+                    counts[node_to_value_dict[neighbor]] += 1
+                first = {}
+                for neighbor in sorted(labeled, key=lambda neighbor: rank[neighbor]):
+                    first.setdefault(node_to_value_dict[neighbor], rank[neighbor])
+                value = min(values, key=lambda value: (-counts[value], first[value]))
+            node_to_value_dict[node] = value
+            node_to_hops_dict[node] = hops
+            rank[node] = len(rank)
+            frontier.append(node)
+
+    if return_hops:
+        return node_to_value_dict, node_to_hops_dict
+    return node_to_value_dict
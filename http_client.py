@@ -0,0 +1,91 @@
+import time
+import random
+import requests
+from requests.adapters import HTTPAdapter
+
+from telemetry import metrics
+
+
+##################################################################################################
+###################################### POOLED HTTP CLIENT ########################################
+##################################################################################################
+# status codes worth retrying (rate limiting and server errors)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# shared HTTP client for all wiki requests
+# reuses keep-alive connections from a pool, negotiates gzip/deflate compression,
+# applies (connect, read) timeouts and retries connection errors, timeouts and
+# 5xx/429 responses with jittered exponential backoff
+class WikiClient:
+    def __init__(self, timeout=(10, 30), max_retries=4, backoff_base=1.0, backoff_max=60.0, pool_size=16):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self.requests = 0
+        self.retries = 0
+
+    # seconds to wait before retry number `attempt` (full jitter, honoring Retry-After if the server sent one)
+    def backoff(self, attempt, res=None):
+        if res is not None and res.headers.get("Retry-After", "").isdigit():
+            return min(self.backoff_max, float(res.headers["Retry-After"]))
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    # GET url, returning the final response
+    # raises requests.RequestException if the request still fails after max_retries retries
+    def get(self, url, headers=None):
+        attempt = 0
+        while True:
+            self.requests += 1
+            metrics.inc("http_attempts_total")
+            try:
+                res = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                res = None
+            if res is not None and (res.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries):
+                if res.status_code in RETRY_STATUS_CODES:
+                    res.raise_for_status()
+                return res
+            metrics.sleep(self.backoff(attempt, res), "backoff")
+            attempt += 1
+            self.retries += 1
+            metrics.inc("http_retries_total")
+
+
+default_client = WikiClient()
+
+
+# replaces the shared client (e.g. to change its timeouts or pool size)
+def configure_client(**client_params):
+    global default_client
+    default_client = WikiClient(**client_params)
+    return default_client
+
+
+# installs any client with a get(url, headers) method as the shared client (e.g. to replay an archive)
+def set_default_client(client):
+    global default_client
+    default_client = client
+    return default_client
+
+
+# (every request is recorded in telemetry, whichever client is installed)
+def http_get(url, headers=None):
+    start = time.perf_counter()
+    try:
+        res = default_client.get(url, headers=headers)
+    except requests.RequestException:
+        metrics.inc("http_failures_total")
+        raise
+    metrics.observe("http_request_seconds", time.perf_counter() - start)
+    metrics.inc("http_requests_total", status=res.status_code)
+    metrics.inc("http_response_bytes_total", len(res.content))
+    return res
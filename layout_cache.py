@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import networkx as nx
+
+
+##################################################################################################
+####################################### LAYOUT CACHE #############################################
+##################################################################################################
+# persistent cache of component layouts for multi_component_graph
+# each layout is stored under a hash of its component's structure (nodes and edges) and layout parameters,
+# so unchanged components are never laid out again
+# an index per layout configuration records the last layout each node appeared in, so a changed component
+# can be warm-started from the positions its surviving nodes had rather than laid out from scratch
+LAYOUT_CACHE_VERSION = 1
+
+
+# component subgraph with nodes and edges (undirected edges as sorted pairs) in sorted order
+# (layouts depend on node order, so laying out the canonical subgraph makes a layout a function of its hash)
+def canonical_subgraph(G, component):
+    subG = G.__class__()
+    subG.add_nodes_from(sorted(component))
+    edges = G.subgraph(component).edges()
+    if not G.is_directed():
+        edges = [tuple(sorted(edge)) for edge in edges]
+    subG.add_edges_from(sorted(edges))
+    return subG
+
+
+def config_hash(directed, layout, layout_params):
+    config = [LAYOUT_CACHE_VERSION, directed, layout, layout_params]
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def component_hash(subG, layout, layout_params):
+    structure = [config_hash(subG.is_directed(), layout, layout_params), list(subG.nodes()), list(subG.edges())]
+    return hashlib.sha256(json.dumps(structure, default=str).encode("utf-8")).hexdigest()
+
+
+# initial positions for subG from a previous layout of some of its nodes
+# new nodes are placed near the mean of their placed neighbors, spreading outwards from the surviving nodes,
+# and nodes with no placed neighbors are placed near the center
+def warm_start_positions(subG, prev_pos, seed=0):
+    pos = {node: np.array(prev_pos[node], dtype=float) for node in subG.nodes() if node in prev_pos}
+    if len(pos) == 0:
+        return None
+    rng = np.random.default_rng(seed)
+    # jitter on the scale of an edge, so new nodes don't start on top of each other
+    edge_lens = [np.linalg.norm(pos[u] - pos[v]) for u, v in subG.edges() if u in pos and v in pos]
+    scale = np.median(edge_lens) if len(edge_lens) > 0 and np.median(edge_lens) > 0 else 1.0
+
+    unplaced = [node for node in subG.nodes() if node not in pos]
+    while len(unplaced) > 0:
+        placed_now = {}
+        for node in unplaced:
+            neighbors = [pos[v] for v in nx.all_neighbors(subG, node) if v in pos]
+            if len(neighbors) > 0:
+                placed_now[node] = np.mean(neighbors, axis=0) + scale * rng.normal(scale=0.5, size=2)
+        if len(placed_now) == 0:
+            center = np.mean(np.array(list(pos.values())), axis=0)
+            placed_now = {node: center + scale * rng.normal(size=2) for node in unplaced}
+        pos.update(placed_now)
+        unplaced = [node for node in unplaced if node not in pos]
+    return pos
+
+
+# warm-started layouts run for warm_start_fraction of the iterations of a layout from scratch
+class LayoutCache:
+    def __init__(self, cache_dir=".layout_cache", warm_start_fraction=0.2):
+        self.cache_dir = cache_dir
+        self.warm_start_fraction = warm_start_fraction
+        os.makedirs(cache_dir, exist_ok=True)
+        self.indexes = {}
+        self.used = set()
+        self.hits = 0
+        self.warm_starts = 0
+        self.misses = 0
+
+    def layout_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def index_path(self, config):
+        return os.path.join(self.cache_dir, f"index_{config}.json")
+
+    # atomic write (an interrupted run never leaves a partial layout behind)
+    def write_json(self, path, obj):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, "w") as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, path)
+
+    def read_json(self, path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    # map of node to the key of the last layout it appeared in, for a layout configuration
+    def index(self, config):
+        if config not in self.indexes:
+            self.indexes[config] = self.read_json(self.index_path(config)) or {}
+        return self.indexes[config]
+
+    def get(self, key):
+        cached = self.read_json(self.layout_path(key))
+        if cached is None:
+            return None
+        return {node: np.array(xy) for node, xy in zip(cached["nodes"], cached["pos"])}
+
+    def put(self, key, config, pos):
+        self.write_json(self.layout_path(key), {"nodes": list(pos.keys()), "pos": [[float(x), float(y)] for x, y in pos.values()]})
+        self.record(key, config, pos.keys())
+
+    # records that the nodes were laid out by the layout under key in this run
+    def record(self, key, config, nodes):
+        self.used.add(key)
+        index = self.index(config)
+        for node in nodes:
+            index[node] = key
+
+    # positions of the nodes of subG in the previous layout most of its surviving nodes were part of
+    # (positions from different layouts are in different frames, so only one layout is used)
+    def previous_positions(self, subG, config):
+        index = self.index(config)
+        keys = [index[node] for node in subG.nodes() if node in index]
+        if len(keys) == 0:
+            return None
+        values, counts = np.unique(keys, return_counts=True)
+        return self.get(values[np.argmax(counts)])
+
+    def save(self):
+        for config, index in self.indexes.items():
+            self.write_json(self.index_path(config), index)
+
+    # removes layouts neither used since the cache was opened nor referred to by an index
+    # (call once every graph of a run has been laid out, as graphs sharing a configuration share an index)
+    def prune(self):
+        self.save()
+        referenced = set(self.used)
+        for name in os.listdir(self.cache_dir):
+            if name.startswith("index_"):
+                referenced.update((self.read_json(os.path.join(self.cache_dir, name)) or {}).values())
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json") and not name.startswith("index_") and name[:-len(".json")] not in referenced:
+                os.remove(os.path.join(self.cache_dir, name))
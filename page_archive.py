@@ -0,0 +1,137 @@
+import os
+import re
+import tarfile
+import zipfile
+import threading
+from urllib.parse import urlsplit, quote, unquote
+
+import requests
+
+
+##################################################################################################
+########################################## PAGE ARCHIVE ##########################################
+##################################################################################################
+# archive of wiki pages keyed by url path (so it can be replayed against any host)
+# archives are written as zip files, one entry per page, and read from zip or tar (optionally compressed) files
+def archive_key(url):
+    parts = urlsplit(url)
+    key = re.sub("/+", "/", "/" + parts.path)
+    if parts.query:
+        key = f"{key}?{parts.query}"
+    return key
+
+
+# url key of an archive member: members are named by quoted url keys when written by PageArchive, but archives
+# of saved pages may also be named by plain wiki extensions (e.g. "battleon"), possibly inside a directory
+def member_key(name):
+    return archive_key(unquote(os.path.basename(name)))
+
+
+class PageArchive:
+    def __init__(self, loc, mode="r"):
+        self.loc = loc
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.pages = None # url key -> text, for archives read fully into memory
+        self.members = {} # url key -> zip member name
+        if mode == "w":
+            self.zf = zipfile.ZipFile(loc, "w", compression=zipfile.ZIP_DEFLATED)
+            self.keys = set()
+        elif zipfile.is_zipfile(loc):
+            self.zf = zipfile.ZipFile(loc, "r")
+            for name in self.zf.namelist():
+                if not name.endswith("/"):
+                    self.members.setdefault(member_key(name), name)
+            self.keys = set(self.members.keys())
+        elif tarfile.is_tarfile(loc):
+            # compressed tar files don't allow random access, so read every page up front
+            self.zf = None
+            self.pages = {}
+            with tarfile.open(loc, "r:*") as tf:
+                for member in tf.getmembers():
+                    if member.isfile():
+                        self.pages.setdefault(member_key(member.name), tf.extractfile(member).read().decode("utf-8"))
+            self.keys = set(self.pages.keys())
+        else:
+            raise ValueError(f"{loc} is not a zip or tar archive")
+
+    def __len__(self):
+        return len(self.keys)
+
+    # iterates over the url keys of archived pages
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __contains__(self, url):
+        return archive_key(url) in self.keys
+
+    # returns the archived text of url, or None if it isn't archived
+    def get(self, url):
+        key = archive_key(url)
+        if key not in self.keys:
+            return None
+        if self.pages is not None:
+            return self.pages[key]
+        with self.lock:
+            return self.zf.read(self.members[key]).decode("utf-8")
+
+    # archives the text of url (the first capture of a page is kept)
+    def add(self, url, text):
+        key = archive_key(url)
+        with self.lock:
+            if key not in self.keys:
+                self.members[key] = quote(key, safe="")
+                self.zf.writestr(self.members[key], text.encode("utf-8"))
+                self.keys.add(key)
+        return None
+
+    def close(self):
+        if self.zf is not None:
+            self.zf.close()
+        return None
+
+
+##################################################################################################
+################################### REPLAY / CAPTURE CLIENTS #####################################
+##################################################################################################
+# minimal stand-in for requests.Response
+class ArchivedResponse:
+    def __init__(self, url, text):
+        self.url = url
+        self.status_code = 404 if text is None else 200
+        self.text = "" if text is None else text
+        self.content = self.text.encode("utf-8")
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code != 200:
+            raise requests.HTTPError(f"{self.status_code} Error: {self.url} not in archive", response=self)
+        return None
+
+
+# serves requests from an archive instead of the wiki (pages that aren't archived are 404s)
+class ReplayClient:
+    def __init__(self, archive):
+        self.archive = archive
+        self.requests = 0
+        self.retries = 0
+
+    def get(self, url, headers=None):
+        self.requests += 1
+        return ArchivedResponse(url, self.archive.get(url))
+
+
+# forwards requests to another client, archiving every successfully retrieved page
+class CaptureClient:
+    def __init__(self, client, archive):
+        self.client = client
+        self.archive = archive
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def get(self, url, headers=None):
+        res = self.client.get(url, headers=headers)
+        if res.status_code == 200:
+            self.archive.add(url, res.text)
+        return res
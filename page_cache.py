@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+from http_client import http_get
+from telemetry import metrics
+
+
+##################################################################################################
+##################################### PERSISTENT PAGE CACHE ######################################
+##################################################################################################
+# on-disk cache of wiki pages
+# bodies are content-addressed (stored under the sha256 of their text) so identical pages share storage
+# each url has a small metadata file recording its body hash and ETag/Last-Modified validators
+# entries validated within `fresh_for` seconds are served without touching the network,
+# older entries are revalidated with a conditional GET
+# entries older than `max_age` seconds are evicted, as are the oldest entries once bodies exceed `max_size` bytes
+class PageCache:
+    def __init__(self, cache_dir=".page_cache", fresh_for=24*60*60, max_age=30*24*60*60, max_size=None):
+        self.cache_dir = cache_dir
+        self.fresh_for = fresh_for
+        self.max_age = max_age
+        self.max_size = max_size
+        self.meta_dir = os.path.join(cache_dir, "meta")
+        self.body_dir = os.path.join(cache_dir, "bodies")
+        os.makedirs(self.meta_dir, exist_ok=True)
+        os.makedirs(self.body_dir, exist_ok=True)
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evict()
+
+    def meta_path(self, url):
+        return os.path.join(self.meta_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def body_path(self, body_hash):
+        return os.path.join(self.body_dir, body_hash)
+
+    # atomic write (readers never see a partially written file)
+    def write_file(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read_meta(self, url):
+        try:
+            with open(self.meta_path(url), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def read_body(self, meta):
+        try:
+            with open(self.body_path(meta["sha256"]), "rb") as f:
+                return f.read().decode("utf-8")
+        except FileNotFoundError:
+            return None
+
+    def store(self, url, text, etag=None, last_modified=None):
+        body = text.encode("utf-8")
+        body_hash = hashlib.sha256(body).hexdigest()
+        if not os.path.exists(self.body_path(body_hash)):
+            self.write_file(self.body_path(body_hash), body)
+        meta = {"url": url,
+                "sha256": body_hash,
+                "size": len(body),
+                "etag": etag,
+                "last_modified": last_modified,
+                "validated_at": time.time()}
+        self.write_file(self.meta_path(url), json.dumps(meta).encode("utf-8"))
+        return meta
+
+    def invalidate(self, url):
+        try:
+            os.remove(self.meta_path(url))
+        except FileNotFoundError:
+            pass
+        return None
+
+    # returns the cached text of url if it was validated recently enough, otherwise None
+    def fresh_text(self, url):
+        meta = self.read_meta(url)
+        if meta is None or time.time() - meta["validated_at"] > self.fresh_for:
+            return None
+        text = self.read_body(meta)
+        if text is not None:
+            self.hits += 1
+            metrics.inc("page_cache_hits_total")
+        return text
+
+    # fetches url, using stored validators to make the request conditional
+    def fetch(self, url):
+        text, _ = self.conditional_fetch(url)
+        return text
+
+    # fetches url with a conditional GET, returning its text and whether it changed since it was cached
+    def conditional_fetch(self, url):
+        meta = self.read_meta(url)
+        old_text = None if meta is None else self.read_body(meta)
+        if old_text is None:
+            meta = None
+
+        headers = {}
+        if meta is not None:
+            if meta["etag"] is not None:
+                headers["If-None-Match"] = meta["etag"]
+            if meta["last_modified"] is not None:
+                headers["If-Modified-Since"] = meta["last_modified"]
+        res = http_get(url, headers=headers)
+
+        # page unchanged, refresh validation time and serve stored body
+        if res.status_code == 304 and meta is not None:
+            self.revalidated += 1
+            meta["validated_at"] = time.time()
+            self.write_file(self.meta_path(url), json.dumps(meta).encode("utf-8"))
+            return old_text, False
+
+        # only successful responses are cached
+        self.misses += 1
+        if res.status_code == 200:
+            self.store(url, res.text, etag=res.headers.get("ETag"), last_modified=res.headers.get("Last-Modified"))
+        return res.text, res.text != old_text
+
+    # removes expired entries, then the least recently validated entries until under max_size
+    def evict(self):
+        now = time.time()
+        metas = []
+        for name in os.listdir(self.meta_dir):
+            path = os.path.join(self.meta_dir, name)
+            try:
+                with open(path, "r") as f:
+                    meta = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                # drop unreadable metadata (and stray temporary files)
+                os.remove(path)
+                continue
+            if self.max_age is not None and now - meta["validated_at"] > self.max_age:
+                os.remove(path)
+            else:
+                metas.append((path, meta))
+
+        if self.max_size is not None:
+            metas = sorted(metas, key=lambda x: x[1]["validated_at"], reverse=True)
+            total_size = 0
+            kept_metas = []
+            seen_hashes = set()
+            for path, meta in metas:
+                if meta["sha256"] not in seen_hashes:
+                    total_size += meta["size"]
+                if total_size > self.max_size:
+                    os.remove(path)
+                else:
+                    seen_hashes.add(meta["sha256"])
+                    kept_metas.append((path, meta))
+            metas = kept_metas
+
+        # remove bodies no longer referenced by any url
+        referenced = {meta["sha256"] for _, meta in metas}
+        for name in os.listdir(self.body_dir):
+            if name not in referenced:
+                os.remove(os.path.join(self.body_dir, name))
+        return None
+
+
+# returns the text of url, going through the cache if one is given
+# wait is called before any network access (e.g. to sleep between site requests)
+def get_page_text(url, cache=None, wait=None):
+    if cache is not None:
+        text = cache.fresh_text(url)
+        if text is not None:
+            return text
+    if wait is not None:
+        wait()
+    if cache is None:
+        return http_get(url).text
+    return cache.fetch(url)
@@ -0,0 +1,152 @@
+import re
+from bs4 import BeautifulSoup
+
+
+##################################################################################################
+########################################## PAGE RECORDS ##########################################
+##################################################################################################
+# compact summary of a wiki page, holding everything the crawl needs from it
+#   tags: text of the page-tags element
+#   map_name: text following the "map name" header (None if there is no such header)
+#   inline_access: whether access points are written inline with the "access points" header
+#   access_lines: text of each item in the list of access points
+#   access_hrefs: wiki extensions linked directly from each item in the list of access points
+class PageRecord:
+    __slots__ = ["map_extension", "tags", "map_name", "inline_access", "access_lines", "access_hrefs"]
+
+    def __init__(self, map_extension, tags, map_name=None, inline_access=False, access_lines=(), access_hrefs=()):
+        self.map_extension = map_extension
+        self.tags = tags
+        self.map_name = map_name
+        self.inline_access = inline_access
+        self.access_lines = tuple(access_lines)
+        self.access_hrefs = tuple(tuple(hrefs) for hrefs in access_hrefs)
+
+    @property
+    def is_location(self):
+        return "location" in self.tags
+
+    @property
+    def is_permanent(self):
+        return "seasonal" not in self.tags and "rare" not in self.tags
+
+    # hrefs of access points, or only of those where keep (one flag per access line) is true
+    def hrefs(self, keep=None):
+        if keep is None:
+            return [href for hrefs in self.access_hrefs for href in hrefs]
+        return [href for flag, hrefs in zip(keep, self.access_hrefs) if flag for href in hrefs]
+
+    def __eq__(self, other):
+        return isinstance(other, PageRecord) and all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    def __repr__(self):
+        return f"PageRecord({self.map_extension!r}, map_name={self.map_name!r}, access_lines={len(self.access_lines)})"
+
+
+##################################################################################################
+########################################## PAGE PARSING ##########################################
+##################################################################################################
+content_start_pattern = re.compile(r"""<div[^>]*\bid=["']page-content["']""")
+tags_start_pattern = re.compile(r"""<div[^>]*\bclass=["'][^"']*\bpage-tags\b""")
+
+
+# cuts a wiki page down to the page-content element through the page-tags element
+# (skips tokenizing the header, side bar and footer, which make up most of a wikidot page)
+# returns the full page if the elements can't be located
+def restrict_page_text(page_text):
+    content_match = content_start_pattern.search(page_text)
+    tags_match = tags_start_pattern.search(page_text)
+    if content_match is None or tags_match is None or tags_match.start() < content_match.start():
+        return page_text
+    tags_end = page_text.find("</div>", tags_match.end())
+    if tags_end < 0:
+        return page_text
+    return page_text[content_match.start():tags_end + len("</div>")]
+
+
+# parses a wiki page into a PageRecord
+# returns None if the page has no tags (typically because the request failed)
+# features selects the BeautifulSoup tree builder (e.g. "lxml" if it is installed)
+def parse_page_record(map_extension, page_text, features="html.parser", restrict=True):
+    if restrict:
+        page_text = restrict_page_text(page_text)
+    map_site = BeautifulSoup(page_text, features)
+
+    page_tags = map_site.find("div", {"class": "page-tags"})
+    if page_tags is None:
+        return None
+    tags = page_tags.get_text()
+
+    # no access points if not a location
+    if "location" not in tags:
+        return PageRecord(map_extension, tags)
+
+    # find the "access points" and "map name" headers in a single pass over the headers
+    map_site_content = map_site.find("div", id="page-content")
+    access_header = None
+    map_name_header = None
+    for strong in map_site_content.find_all("strong"):
+        s = strong.string
+        if s:
+            s_lower = s.lower()
+            if access_header is None and "access points" in s_lower:
+                access_header = strong
+            if map_name_header is None and "map name" in s_lower:
+                map_name_header = strong
+            if access_header is not None and map_name_header is not None:
+                break
+
+    # the map name follows its header
+    map_name = None
+    if map_name_header is not None and map_name_header.next_sibling is not None:
+        map_name = map_name_header.next_sibling.get_text().strip()
+
+    # get parent of the "access points" header and all of its text
+    access_header_parent = access_header.parent
+    extra_text_in_header = access_header_parent.get_text().lower().split("access points")[-1]
+
+    # check if there's significant text in the header after "access points" are mentioned
+    # we assume in this case that access points are included inline with the header
+    # we assume this will be something like "/join map_name", not a meaningful access point
+    if len(extra_text_in_header) > 4:
+        return PageRecord(map_extension, tags, map_name=map_name, inline_access=True)
+
+    # get sibling following the "access points" header parent
+    # this will contain the list of access points if they weren't in the header
+    access_list = access_header_parent.find_next_sibling()
+
+    # check if next sibling is None
+    tries = 0
+    while access_list is None and tries < 5:
+        access_header_parent = access_header_parent.parent
+        if access_header_parent is None:
+            break
+        else:
+            access_list = access_header_parent.find_next_sibling()
+            tries +=1
+
+    # check if next sibling is a div
+    if access_list.name == "div":
+        # if it is, access points are likely in collapsible content
+        # we descend structure to find the contained ul / list
+        access_list = access_list.find("div", {"class": "collapsible-block-unfolded"})
+        access_list = access_list.find("div", {"class": "collapsible-block-content"})
+        access_list = access_list.find("ul")
+
+    # otherwise, we assume the next sibling is the ul / list of access points itself
+    # record the text and links of each li element
+    access_lines = []
+    access_hrefs = []
+    for a in access_list.find_all("li", recursive=False):
+        hrefs = []
+        for link in a.find_all("a", href=True, recursive=False):
+            link_href = link["href"].strip("/")
+            if not "." in link_href:
+                hrefs.append(link_href)
+        access_lines.append(a.get_text())
+        access_hrefs.append(hrefs)
+
+    return PageRecord(map_extension, tags,
+                      map_name=map_name,
+                      access_lines=access_lines,
+                      access_hrefs=access_hrefs)
@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from crawl_store import CrawlStore, npz_memmap
+from compact_graph import as_networkx
+from graph_analytics import adjacency_csr, csr_bfs_tree
+
+
+##################################################################################################
+######################################### ROUTE INDEX ############################################
+##################################################################################################
+# precomputed answers to "how do I get from A to B" on a processed graph (DiGraph_Proc or Graph_Undir)
+# saved as an uncompressed .npz file next to the crawl outputs (route_index_{graph}.npz), whose arrays are memory-mapped
+#   strings: utf-8 node names, NUL separated
+#   metadata: utf-8 JSON of the graph key, whether it is directed, the format version and the hash of the stored graph
+#   it was built from (see CrawlStore.graph_hash), which decides whether the index is up to date
+#   indptr, indices: successors of each node (CSR)
+#   scc: strongly connected component of each node, numbered in topological order of the condensation
+#   reach: bitset of the components reachable from each component (bit j of row i is byte j // 8, bit j % 8)
+#   parents: BFS tree from every node (row i is the parent of each node on a shortest route from node i, -1 if unreachable)
+# reachability is a single bit lookup, and a route is read off the source's tree in as many steps as it has hops
+# trees take memory quadratic in the number of nodes, so they are only stored for graphs of up to max_tree_nodes,
+# and otherwise built on first use by the querying process
+ROUTE_INDEX_VERSION = 1
+
+
+def route_index_loc(store_loc, key="DiGraph_Proc"):
+    return os.path.join(os.path.dirname(os.path.abspath(store_loc)), f"route_index_{key}.npz")
+
+
+# strongly connected components of G numbered in topological order, and the bitset of components reachable from each
+# (networkx is only needed to build indexes, so it isn't imported by queries)
+def reachability_bitsets(G):
+    import networkx as nx
+    node_idx = {node: i for i, node in enumerate(G.nodes())}
+    if G.is_directed():
+        C = nx.condensation(G)
+        order = {c: i for i, c in enumerate(nx.topological_sort(C))}
+        scc = np.array([order[C.graph["mapping"][node]] for node in G.nodes()], dtype=np.int32)
+        successors = {order[c]: [order[d] for d in C.successors(c)] for c in C.nodes()}
+    else:
+        scc = np.zeros(len(node_idx), dtype=np.int32)
+        for i, component in enumerate(nx.connected_components(G)):
+            scc[[node_idx[node] for node in component]] = i
+        successors = {i: [] for i in range(scc.max() + 1 if len(scc) > 0 else 0)}
+
+    # components after c in topological order are done before c (python ints are the bitsets while building)
+    n_scc = len(successors)
+    reach = [0] * n_scc
+    for c in reversed(range(n_scc)):
+        bits = 1 << c
+        for d in successors[c]:
+            bits |= reach[d]
+        reach[c] = bits
+    n_bytes = (n_scc + 7) // 8
+    reach = np.frombuffer(b"".join(bits.to_bytes(n_bytes, "little") for bits in reach), dtype=np.uint8).reshape(n_scc, n_bytes)
+    return scc, reach
+
+
+def build_route_index(G, key="DiGraph_Proc", max_tree_nodes=5000, graph_hash=None):
+    G = as_networkx(G)
+    nodes, indptr, indices = adjacency_csr(G)
+    if any("\x00" in str(node) for node in nodes):
+        raise ValueError(f"node names of {key} can't be stored in a route index")
+    scc, reach = reachability_bitsets(G)
+    arrays = {"strings": np.frombuffer("\x00".join(map(str, nodes)).encode("utf-8"), dtype=np.uint8),
+              "indptr": indptr,
+              "indices": indices.astype(np.int32),
+              "scc": scc,
+              "reach": reach}
+    if len(nodes) <= max_tree_nodes:
+        parents = np.empty((len(nodes), len(nodes)), dtype=np.int32)
+        for i in range(len(nodes)):
+            parents[i] = csr_bfs_tree(indptr, indices, i)
+        arrays["parents"] = parents
+    metadata = {"format_version": ROUTE_INDEX_VERSION, "graph": key, "directed": G.is_directed(), "graph_hash": graph_hash}
+    arrays["metadata"] = np.frombuffer(json.dumps(metadata).encode("utf-8"), dtype=np.uint8)
+    return arrays
+
+
+def save_route_index(arrays, loc):
+    tmp_loc = f"{loc}.tmp"
+    with open(tmp_loc, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_loc, loc)
+
+
+class RouteIndex:
+    def __init__(self, loc):
+        self.loc = loc
+        self.metadata = json.loads(bytes(npz_memmap(loc, "metadata")).decode("utf-8"))
+        if self.metadata["format_version"] != ROUTE_INDEX_VERSION:
+            raise ValueError(f"{loc} is a route index of another version, rebuild it")
+        self.nodes = bytes(npz_memmap(loc, "strings")).decode("utf-8").split("\x00")
+        self.node_idx = {node: i for i, node in enumerate(self.nodes)}
+        self.scc = npz_memmap(loc, "scc")
+        self.reach = npz_memmap(loc, "reach")
+        try:
+            self.parents = npz_memmap(loc, "parents")
+        except KeyError:
+            self.parents = None
+        self.indptr = None
+        self.indices = None
+        # trees built on first use, when the index doesn't store them
+        self.trees = {}
+
+    def idx(self, node):
+        if node not in self.node_idx:
+            raise KeyError(f"{node} is not a location of {self.metadata['graph']}")
+        return self.node_idx[node]
+
+    def reachable(self, source, target):
+        a, b = self.scc[self.idx(source)], self.scc[self.idx(target)]
+        return bool((self.reach[a, b >> 3] >> (b & 7)) & 1)
+
+    def tree(self, i):
+        if self.parents is not None:
+            return self.parents[i]
+        if i not in self.trees:
+            if self.indptr is None:
+                self.indptr, self.indices = npz_memmap(self.loc, "indptr"), npz_memmap(self.loc, "indices")
+            self.trees[i] = csr_bfs_tree(self.indptr, self.indices, i)
+        return self.trees[i]
+
+    # shortest route from source to target (a list of locations starting with source), or None if there isn't one
+    def route(self, source, target):
+        if not self.reachable(source, target):
+            return None
+        i, j = self.idx(source), self.idx(target)
+        parent = self.tree(i)
+        path = [j]
+        while path[-1] != i:
+            path.append(int(parent[path[-1]]))
+        return [self.nodes[k] for k in reversed(path)]
+
+    def query(self, source, target):
+        try:
+            route = self.route(source, target)
+        except KeyError as e:
+            return {"from": source, "to": target, "error": e.args[0]}
+        return {"from": source, "to": target, "reachable": route is not None,
+                "hops": None if route is None else len(route) - 1, "route": route}
+
+    def batch_query(self, pairs):
+        return [self.query(source, target) for source, target in pairs]
+
+
+# route index of a graph of a crawl store, rebuilt if it is missing or was built from another version of the graph
+# (the store is rewritten by every crawl, so its contents are compared rather than its modification time)
+def load_route_index(store_loc, key="DiGraph_Proc", rebuild=False, max_tree_nodes=5000):
+    loc = route_index_loc(store_loc, key)
+    store = CrawlStore(store_loc)
+    graph_hash = store.graph_hash(key)
+    if not rebuild and os.path.exists(loc):
+        try:
+            index = RouteIndex(loc)
+        except ValueError:
+            index = None
+        if index is not None and index.metadata.get("graph_hash") == graph_hash:
+            return index
+    save_route_index(build_route_index(store.graph(key), key, max_tree_nodes=max_tree_nodes, graph_hash=graph_hash), loc)
+    return RouteIndex(loc)
+
+
+##################################################################################################
+######################################### QUERY SERVER ###########################################
+##################################################################################################
+# long-lived local server, so the index is opened once for many queries
+#   GET /route?from=A&to=B[&graph=Graph_Undir]: route from A to B
+#   POST /routes[?graph=Graph_Undir] with a JSON list of [from, to] pairs: routes for each pair
+def make_handler(indexes, default_key):
+    class RouteHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, obj):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def get_index(self, params):
+            key = params.get("graph", [default_key])[0]
+            if key not in indexes:
+                self.send_json(404, {"error": f"no route index for {key}"})
+                return None
+            return indexes[key]
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            if url.path != "/route" or "from" not in params or "to" not in params:
+                self.send_json(404, {"error": "expected /route?from=A&to=B"})
+                return
+            index = self.get_index(params)
+            if index is not None:
+                self.send_json(200, index.query(params["from"][0], params["to"][0]))
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/routes":
+                self.send_json(404, {"error": "expected /routes"})
+                return
+            index = self.get_index(parse_qs(url.query))
+            if index is None:
+                return
+            try:
+                pairs = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                pairs = [(source, target) for source, target in pairs]
+            except (ValueError, TypeError):
+                self.send_json(400, {"error": "expected a JSON list of [from, to] pairs"})
+                return
+            self.send_json(200, index.batch_query(pairs))
+
+        def log_message(self, format, *args):
+            pass
+
+    return RouteHandler
+
+
+def serve(indexes, default_key="DiGraph_Proc", host="127.0.0.1", port=8765):
+    server = ThreadingHTTPServer((host, port), make_handler(indexes, default_key))
+    print(f"Serving routes on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# from and to of a line of a batch file: separated by a tab, or as a JSON [from, to] list
+# (location names can contain spaces, so they aren't split on other whitespace)
+def parse_query_line(line):
+    line = line.rstrip("\r\n")
+    if line.lstrip().startswith("["):
+        pair = json.loads(line)
+    else:
+        pair = line.split("\t")
+    if not isinstance(pair, list) or len(pair) != 2 or not all(isinstance(node, str) and node != "" for node in pair):
+        raise ValueError("expected a tab separated 'from to' pair, or a JSON [from, to] list")
+    return pair[0], pair[1]
+
+
+def main(args):
+    if args.serve:
+        indexes = {key: load_route_index(args.store, key, rebuild=args.rebuild, max_tree_nodes=args.max_tree_nodes)
+                   for key in ["DiGraph_Proc", "Graph_Undir"]}
+        serve(indexes, default_key=args.graph, host=args.host, port=args.port)
+        return
+
+    index = load_route_index(args.store, args.graph, rebuild=args.rebuild, max_tree_nodes=args.max_tree_nodes)
+    if args.batch is not None:
+        # one query per line (see parse_query_line), one JSON result per line
+        f = sys.stdin if args.batch == "-" else open(args.batch, "r")
+        try:
+            lines = [line for line in f if line.strip() != ""]
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        for line in lines:
+            try:
+                source, target = parse_query_line(line)
+            except ValueError as e:
+                print(json.dumps({"line": line.rstrip("\r\n"), "error": str(e)}))
+                continue
+            print(json.dumps(index.query(source, target)))
+    elif args.source is not None and args.target is not None:
+        result = index.query(args.source, args.target)
+        if "error" in result:
+            print(result["error"])
+        elif result["route"] is None:
+            print(f"{args.target} can't be reached from {args.source}")
+        else:
+            print(f"{result['hops']} hops: " + " -> ".join(result["route"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Routes between AQW locations")
+    parser.add_argument("store", help="Compact crawl store (crawl_data.npz) the route index is kept next to")
+    parser.add_argument("source", nargs="?", default=None, help="Location to route from")
+    parser.add_argument("target", nargs="?", default=None, help="Location to route to")
+    parser.add_argument("--graph", default="DiGraph_Proc", help="Graph to route on (DiGraph_Proc, or Graph_Undir for reciprocated connections only)")
+    parser.add_argument("--batch", default=None, help="File of queries, one tab separated 'from to' pair or JSON [from, to] list per line (- reads stdin)")
+    parser.add_argument("--serve", action="store_true", help="Serve queries over HTTP until interrupted")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to serve queries on")
+    parser.add_argument("--port", default=8765, type=int, help="Port to serve queries on")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the route index even if it is up to date")
+    parser.add_argument("--max_tree_nodes", default=5000, type=int, help="Largest graph to store a BFS tree from every location for")
+    args = parser.parse_args()
+    main(args)
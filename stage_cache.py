@@ -0,0 +1,76 @@
+import os
+import json
+import hashlib
+import tempfile
+
+
+##################################################################################################
+###################################### STAGE ARTIFACT CACHE ######################################
+##################################################################################################
+# manifest of the pipeline stages of the last run (crawl, plot)
+# each stage records a hash of its inputs and the sha256 of every file it wrote
+# a stage can be skipped when its inputs hash the same and its output files are unchanged since it ran
+def hash_object(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def hash_file(loc):
+    h = hashlib.sha256()
+    with open(loc, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# hash of the nodes (with attributes, in order, as layouts depend on node order) and edges of a graph
+# (edges are sorted, as the order neighbors are stored in changes when a graph is saved and reloaded)
+def hash_graph(G):
+    edges = G.edges() if G.is_directed() else [sorted(edge) for edge in G.edges()]
+    return hash_object([G.is_directed(), list(G.nodes(data=True)), sorted(map(list, edges))])
+
+
+class StageCache:
+    def __init__(self, loc="stage_manifest.json", force=False):
+        self.loc = loc
+        self.force = force
+        self.root = os.path.dirname(os.path.abspath(loc))
+        try:
+            with open(loc, "r") as f:
+                self.manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.manifest = {}
+
+    # output paths are stored relative to the manifest, so the directory can be moved
+    def path(self, rel_path):
+        return os.path.join(self.root, rel_path)
+
+    def is_fresh(self, stage, inputs_hash):
+        entry = self.manifest.get(stage)
+        if self.force or entry is None or entry["inputs"] != inputs_hash:
+            return False
+        for rel_path, file_hash in entry["outputs"].items():
+            if not os.path.exists(self.path(rel_path)) or hash_file(self.path(rel_path)) != file_hash:
+                return False
+        return True
+
+    def record(self, stage, inputs_hash, outputs):
+        self.manifest[stage] = {"inputs": inputs_hash,
+                                "outputs": {os.path.relpath(os.path.abspath(loc), self.root): hash_file(loc) for loc in outputs}}
+        self.save()
+
+    # re-hashes the outputs of a stage that were rewritten from the same inputs
+    def refresh(self, stage):
+        entry = self.manifest.get(stage)
+        if entry is not None:
+            self.record(stage, entry["inputs"], [self.path(rel_path) for rel_path in entry["outputs"]])
+
+    def invalidate(self, stage):
+        if self.manifest.pop(stage, None) is not None:
+            self.save()
+
+    # atomic write, so an interrupted run never leaves a manifest vouching for half-written outputs
+    def save(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(tmp_path, self.loc)
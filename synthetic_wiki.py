@@ -0,0 +1,233 @@
+import threading
+import multiprocessing
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+##################################################################################################
+######################################## SYNTHETIC WIKI ##########################################
+##################################################################################################
+# access point text, split into lines that read as geographic and lines that don't
+geo_lines = ["North of screen 2.", "Walk through the door on the east side of town.", "Take the stairs down.",
+             "Southwest of the bridge.", "Exit through the west of screen 1."]
+non_geo_lines = ["Talk to the guard.", "Type /join in chat.", "Click the map button.",
+                 "Talk to the statue in the museum.", "Use the event hub."]
+
+# relative frequency of each way the wiki lays out access points (see get_connected_rooms)
+#   list: ul following the "access points" header
+#   sublist: ul whose items have their own sub-bullets
+#   collapsible: ul in a collapsible-block div
+#   climb: ul following an ancestor of the "access points" header
+#   inline: access points written inline with the header (only used for rooms no crawl path depends on)
+layout_weights = {"list": 0.6, "sublist": 0.15, "collapsible": 0.15, "climb": 0.05, "inline": 0.05}
+
+# page header, side bar and footer, which make up most of a wikidot page
+chrome_top = ("<html><head><title>{title} - AQW</title></head><body><div id=\"container\"><div id=\"header\">"
+              + "".join(f"<p><a href=\"/nav-{i}\">Navigation {i}</a></p>" for i in range(60))
+              + "</div><div id=\"side-bar\">"
+              + "".join(f"<li><a href=\"/side-{i}\">Side bar {i}</a></li>" for i in range(120))
+              + "</div><div id=\"main-content\"><div id=\"page-title\">{title}</div>")
+chrome_bottom = ("<div style=\"clear:both\"></div><div id=\"footer\">"
+                 + "".join(f"<p><a href=\"/footer-{i}\">Footer {i}</a></p>" for i in range(60))
+                 + "</div></div></div></body></html>")
+
+
+# deterministic wiki of n_locations location pages, with quest (non-location) pages and region pages
+# access point counts follow degree_distribution ("poisson", "powerlaw" or "fixed") with mean mean_degree
+# regions are contiguous blocks of rooms, each a tree of access points hanging off the first hub town
+# pages are rendered on request, so large wikis only hold their link structure in memory
+class SyntheticWiki:
+    def __init__(self, n_locations=10000, mean_degree=3, degree_distribution="poisson", n_quests=None,
+                 region_names=None, hub_names=("battleon", "battleontown", "castle"), seasonal_fraction=0.05,
+                 rare_fraction=0.02, seasonal_region_fraction=0.3, cross_region_fraction=0.02, listed_fraction=0.3, seed=0):
+        rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.rooms = [f"loc-{i}" for i in range(n_locations)]
+        self.quests = [f"quest-{i}" for i in range(n_locations // 20 if n_quests is None else n_quests)]
+        # the first rooms are named after the hub towns that plot_crawl_outputs filters connections to
+        self.map_names = [f"loc{i}" for i in range(n_locations)]
+        self.map_names[:len(hub_names)] = hub_names[:n_locations]
+
+        # number of access points listed on each page
+        if degree_distribution == "poisson":
+            degrees = rng.poisson(mean_degree, n_locations)
+        elif degree_distribution == "powerlaw":
+            # pareto with shape 2 has mean 2 * scale, so scale by mean_degree / 2
+            degrees = np.floor(rng.pareto(2, n_locations) * mean_degree / 2 + 1).astype(int)
+        elif degree_distribution == "fixed":
+            degrees = np.full(n_locations, int(mean_degree))
+        else:
+            raise ValueError(f"{degree_distribution} not a recognized degree distribution")
+        degrees = np.minimum(degrees, n_locations - 1)
+
+        # regions are contiguous blocks of rooms
+        if region_names is None:
+            region_names = [f"Region {k}" for k in range(max(1, n_locations // 200))]
+        self.region_names = list(region_names)
+        blocks = np.array_split(np.arange(n_locations), len(self.region_names))
+        block_start = np.zeros(n_locations, dtype=int)
+        block_end = np.zeros(n_locations, dtype=int)
+        for block in blocks:
+            if len(block) > 0:
+                block_start[block] = block[0]
+                block_end[block] = block[-1] + 1
+
+        # spanning tree: each room is listed as an access point of an earlier room in its region,
+        # and the first room of each region is listed as an access point of the first hub town
+        # (region roots don't list the hub back, so regions are only joined by the hub and cross-region access points)
+        access = [[] for _ in range(n_locations)]
+        has_children = np.zeros(n_locations, dtype=bool)
+        for i in range(1, n_locations):
+            if i == block_start[i]:
+                parent = 0
+            else:
+                parent = int(rng.integers(block_start[i], i))
+            access[parent].append(i)
+            has_children[parent] = True
+
+        # remaining access points go to random rooms in the same region, or anywhere with probability cross_region_fraction
+        extra = np.maximum(degrees - np.array([len(a) for a in access]), 0)
+        rooms_with_extra = np.repeat(np.arange(n_locations), extra)
+        targets = np.where(rng.random(len(rooms_with_extra)) < cross_region_fraction,
+                           rng.integers(0, n_locations, len(rooms_with_extra)),
+                           block_start[rooms_with_extra]
+                           + np.floor(rng.random(len(rooms_with_extra)) * (block_end - block_start)[rooms_with_extra]).astype(int))
+        for i, t in zip(rooms_with_extra.tolist(), targets.tolist()):
+            if t != i and t not in access[i]:
+                access[i].append(t)
+        self.access = access
+
+        layouts = list(layout_weights.keys())
+        layout_p = np.array(list(layout_weights.values()))
+        self.layouts = rng.choice(len(layouts), size=n_locations, p=layout_p / layout_p.sum())
+        self.layouts[has_children & (self.layouts == layouts.index("inline"))] = layouts.index("list")
+        self.layout_names = layouts
+
+        # tags: some locations are seasonal or rare
+        draws = rng.random(n_locations)
+        self.tags = np.where(draws < seasonal_fraction, "location seasonal",
+                             np.where(draws < seasonal_fraction + rare_fraction, "location rare", "location"))
+        self.tags[:len(hub_names)] = "location"
+        # some regions are entered through a seasonal room, which splits them off the permanent graph
+        for block in blocks[1:]:
+            if len(block) > 0 and rng.random() < seasonal_region_fraction:
+                self.tags[block[0]] = "location seasonal"
+
+        # quest pages are listed alongside access points of some rooms
+        self.quest_links = {}
+        if len(self.quests) > 0:
+            for i in rng.choice(n_locations, size=len(self.quests), replace=False):
+                self.quest_links[int(i)] = self.quests[int(rng.integers(0, len(self.quests)))]
+
+        # region pages list the first room of the region and a random sample of the rest
+        # like main, crawls start from every room listed in a region
+        listed = rng.random(n_locations) < listed_fraction
+        listed[block_start] = True
+        self.region_to_loc_dict = {name: [self.rooms[i] for i in block if listed[i]] for name, block in zip(self.region_names, blocks)}
+        self.starting_rooms = [self.rooms[i] for i in np.flatnonzero(listed)]
+        self.region_pages = {f"region-{k}": name for k, name in enumerate(self.region_names)}
+        self.room_index = {room: i for i, room in enumerate(self.rooms)}
+
+    def __len__(self):
+        return len(self.rooms)
+
+    # text of an access point line, fixed per (room, access point) pair
+    def access_line(self, i, j):
+        lines = geo_lines if (i * 31 + j * 17 + self.seed) % 3 else non_geo_lines
+        return lines[(i + j) % len(lines)]
+
+    def access_list(self, i, layout):
+        items = []
+        for j in self.access[i]:
+            link = f"<a href=\"/{self.rooms[j]}\">Location {j}</a>"
+            if layout == "sublist":
+                items.append(f"<li>{link}<ul><li>{self.access_line(i, j)}</li><li>{self.access_line(j, i)}</li></ul></li>")
+            else:
+                items.append(f"<li>{link} {self.access_line(i, j)}</li>")
+        if i in self.quest_links:
+            items.append(f"<li><a href=\"/{self.quest_links[i]}\">Quest</a> Talk to the quest giver.</li>")
+        items.append(f"<li><a href=\"/image-{i}.png\">Screenshot</a></li>")
+        return "<ul>" + "".join(items) + "</ul>"
+
+    def location_content(self, i):
+        layout = self.layout_names[self.layouts[i]]
+        name = f"<p><strong>Map name:</strong> {self.map_names[i]}</p>"
+        header = "<p><strong>Access Points:</strong></p>"
+        if layout == "inline":
+            return name + f"<p><strong>Access Points:</strong> /join {self.map_names[i]} from anywhere</p>"
+        elif layout == "collapsible":
+            return (name + header + "<div class=\"collapsible-block\"><div class=\"collapsible-block-folded\"><a>+ show</a></div>"
+                    + "<div class=\"collapsible-block-unfolded\"><div class=\"collapsible-block-unfolded-link\"><a>- hide</a></div>"
+                    + f"<div class=\"collapsible-block-content\">{self.access_list(i, layout)}</div></div></div>")
+        elif layout == "climb":
+            return f"<div>{name}{header}</div>{self.access_list(i, layout)}"
+        return name + header + self.access_list(i, layout) + "<p><strong>Notes:</strong></p><p>Has monsters.</p>"
+
+    # html of the page at path (e.g. "/loc-12"), or None if there is no such page
+    def page(self, path):
+        ext = path.strip("/")
+        if ext in self.room_index:
+            i = self.room_index[ext]
+            content, tags = self.location_content(i), self.tags[i]
+        elif ext.startswith("quest-"):
+            content, tags = "<p><strong>Rewards:</strong> gold</p>", "quest"
+        elif ext == "locations":
+            content = "<p>" + " | ".join(f"<a href=\"/{k}\">{v}</a>" for k, v in self.region_pages.items()) + "</p>"
+            tags = "region"
+        elif ext in self.region_pages:
+            locs = self.region_to_loc_dict[self.region_pages[ext]]
+            content = "<ul>" + "".join(f"<li><a href=\"/{loc}\">{loc}</a></li>" for loc in locs) + "</ul>"
+            tags = "region"
+        else:
+            return None
+        return (chrome_top.format(title=ext) + f"<div id=\"page-content\">{content}</div>"
+                + f"<div class=\"page-tags\"><span><a href=\"/system:page-tags/tag/{tags}\">{tags}</a></span></div>"
+                + chrome_bottom)
+
+
+##################################################################################################
+######################################## LOCAL WIKI SERVER #######################################
+##################################################################################################
+def make_handler(wiki):
+    class WikiHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            page = wiki.page(self.path.split("?")[0])
+            body = ("Page not found" if page is None else page).encode("utf-8")
+            self.send_response(404 if page is None else 200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            return None
+    return WikiHandler
+
+
+# serves wiki on a background thread, returning the server (its url is f"http://{host}:{server.server_port}/")
+# port 0 picks a free port; stop it with server.shutdown()
+def serve_wiki(wiki, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), make_handler(wiki))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_wiki_process(queue, wiki_params, host, port):
+    server = ThreadingHTTPServer((host, port), make_handler(SyntheticWiki(**wiki_params)))
+    server.daemon_threads = True
+    queue.put(server.server_port)
+    server.serve_forever()
+
+
+# builds and serves SyntheticWiki(**wiki_params) in a separate process, so serving pages doesn't compete with
+# the crawl for the interpreter (or count towards its memory use)
+# returns the process and the url of the wiki; stop it with process.terminate()
+def start_wiki_server(wiki_params, host="127.0.0.1", port=0):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_wiki_process, args=(queue, wiki_params, host, port), daemon=True)
+    process.start()
+    return process, f"http://{host}:{queue.get()}/"
@@ -0,0 +1,291 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+##################################################################################################
+########################################### TELEMETRY ############################################
+##################################################################################################
+# process-wide metrics of a run, recorded by the http client, page parsing, politeness sleeps and pipeline stages
+#   counters: running totals (requests, bytes, retries, failures, sleep seconds, ...)
+#   histograms: counts of observations per bucket (request latency, parse time per page)
+#   stages: wall and CPU seconds spent in each stage of the pipeline (region pull, crawl, save, layouts, renders)
+# series are keyed by name and labels (e.g. sleep_seconds_total{reason="backoff"}), and updated under a lock,
+# since requests are made from crawl worker threads
+# CPU seconds are of this process (process_time), except for work done in other threads or processes, which
+# measures its own (see timed_call and timed_iter); stages running at the same time overlap in both
+# written as JSON (write_json) and in the Prometheus text exposition format (write_prometheus), with an
+# optional live progress line (start_progress)
+PROMETHEUS_PREFIX = "aqw_"
+
+# upper bounds (seconds) of latency buckets, from cached and replayed pages to slow wiki responses
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {"http_requests_total": "Wiki requests made, by final status code",
+               "http_attempts_total": "HTTP attempts, including retries",
+               "http_retries_total": "Retried HTTP attempts",
+               "http_failures_total": "Wiki requests that failed after every retry",
+               "http_response_bytes_total": "Bytes of wiki responses received",
+               "http_request_seconds": "Latency of wiki requests, including retries",
+               "page_cache_hits_total": "Pages served from the page cache without a request",
+               "pages_parsed_total": "Wiki pages parsed",
+               "page_parse_seconds": "Time to parse a wiki page",
+               "sleep_seconds_total": "Seconds slept, by reason (politeness, rate_limit or backoff)",
+               "stage_wall_seconds": "Wall-clock seconds spent in each pipeline stage",
+               "stage_cpu_seconds": "CPU seconds spent in each pipeline stage",
+               "stage_runs_total": "Times each pipeline stage ran"}
+
+
+def series_key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    # estimated q-quantile, interpolating within its bucket (as Prometheus' histogram_quantile does)
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lo = 0.0 if i == 0 else self.buckets[i-1]
+                return lo + (self.buckets[i] - lo) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Telemetry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+        self.progress_thread = None
+        self.progress_stop = threading.Event()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters = {}
+            self.histograms = {}
+            self.stages = {}
+            self.active_stages = []
+
+    def inc(self, name, value=1, **labels):
+        key = series_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = series_key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def counter(self, name, **labels):
+        return self.counters.get(series_key(name, labels), 0)
+
+    # total of a counter over all of its labels
+    def total(self, name):
+        return sum(value for (key_name, _), value in self.counters.items() if key_name == name)
+
+    def record_stage(self, name, wall, cpu, runs=1):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "runs": 0})
+            stage["wall_seconds"] += wall
+            stage["cpu_seconds"] += cpu
+            stage["runs"] += runs
+
+    # times the body of a with block as a run of stage `name`
+    @contextmanager
+    def stage(self, name):
+        with self.lock:
+            self.active_stages.append(name)
+        start, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield None
+        finally:
+            self.record_stage(name, time.perf_counter() - start, time.process_time() - start_cpu)
+            with self.lock:
+                self.active_stages.remove(name)
+
+    # items of iterable, with the time spent producing them counted as stage `name` (as one run)
+    # (CPU time is of the iterating thread, as iterables are often drained by a thread of their own)
+    def timed_iter(self, name, iterable):
+        iterator = iter(iterable)
+        runs = 1
+        while True:
+            start, start_cpu = time.perf_counter(), time.thread_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.record_stage(name, time.perf_counter() - start, time.thread_time() - start_cpu, runs=runs)
+                runs = 0
+            yield item
+
+    def sleep(self, seconds, reason):
+        if seconds > 0:
+            time.sleep(seconds)
+            self.inc("sleep_seconds_total", seconds, reason=reason)
+
+    # request, parse and sleep totals, and latency quantiles (the figures of the progress line)
+    def summary(self):
+        with self.lock:
+            latency = Histogram()
+            parse = Histogram()
+            for (name, _), histogram in self.histograms.items():
+                target = latency if name == "http_request_seconds" else parse if name == "page_parse_seconds" else None
+                if target is not None:
+                    target.counts = [a + b for a, b in zip(target.counts, histogram.counts)]
+                    target.sum += histogram.sum
+                    target.count += histogram.count
+            return {"elapsed_seconds": time.time() - self.started,
+                    "requests": self.total("http_requests_total"),
+                    "bytes": self.total("http_response_bytes_total"),
+                    "retries": self.total("http_retries_total"),
+                    "failures": self.total("http_failures_total"),
+                    "cache_hits": self.total("page_cache_hits_total"),
+                    "pages_parsed": self.total("pages_parsed_total"),
+                    "request_seconds": latency.sum,
+                    "parse_seconds": parse.sum,
+                    "sleep_seconds": self.total("sleep_seconds_total"),
+                    "latency_p50": latency.quantile(0.5),
+                    "latency_p90": latency.quantile(0.9),
+                    "latency_p99": latency.quantile(0.99)}
+
+    def to_json(self):
+        summary = self.summary()
+        with self.lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({"labels": dict(labels), "value": value})
+            histograms = {}
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                histograms.setdefault(name, []).append({"labels": dict(labels),
+                                                        "buckets": list(histogram.buckets),
+                                                        "counts": list(histogram.counts),
+                                                        "sum": histogram.sum,
+                                                        "count": histogram.count})
+            return {"started": self.started,
+                    "summary": summary,
+                    "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                    "counters": counters,
+                    "histograms": histograms}
+
+    def to_prometheus(self, prefix=PROMETHEUS_PREFIX):
+        lines = []
+        def header(name, kind):
+            if name in METRIC_HELP:
+                lines.append(f"# HELP {prefix}{name} {METRIC_HELP[name]}")
+            lines.append(f"# TYPE {prefix}{name} {kind}")
+        def labels_text(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if len(labels) == 0:
+                return ""
+            return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in labels) + "}"
+
+        with self.lock:
+            last = None
+            for (name, labels), value in sorted(self.counters.items()):
+                if name != last:
+                    header(name, "counter")
+                    last = name
+                lines.append(f"{prefix}{name}{labels_text(labels)} {value}")
+            last = None
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if name != last:
+                    header(name, "histogram")
+                    last = name
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{prefix}{name}_bucket{labels_text(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{prefix}{name}_sum{labels_text(labels)} {histogram.sum}")
+                lines.append(f"{prefix}{name}_count{labels_text(labels)} {histogram.count}")
+            for name, field, kind in [("stage_wall_seconds", "wall_seconds", "gauge"),
+                                      ("stage_cpu_seconds", "cpu_seconds", "gauge"),
+                                      ("stage_runs_total", "runs", "counter")]:
+                if len(self.stages) > 0:
+                    header(name, kind)
+                for stage, values in self.stages.items():
+                    lines.append(f"{prefix}{name}{labels_text([('stage', stage)])} {values[field]}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, loc):
+        tmp_loc = f"{loc}.tmp"
+        with open(tmp_loc, "w") as f:
+            json.dump(self.to_json(), f, indent=4)
+        os.replace(tmp_loc, loc)
+
+    def write_prometheus(self, loc):
+        tmp_loc = f"{loc}.tmp"
+        with open(tmp_loc, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_loc, loc)
+
+    def progress_line(self):
+        s = self.summary()
+        stage = self.active_stages[-1] if len(self.active_stages) > 0 else "idle"
+        p50 = "-" if s["latency_p50"] is None else f"{1000 * s['latency_p50']:.0f} ms"
+        return (f"[{stage} {s['elapsed_seconds']:.0f}s] {s['requests']} requests ({s['bytes'] / 1e6:.1f} MB, p50 {p50}), "
+                f"{s['retries']} retries, {s['failures']} failures, {s['cache_hits']} cached, "
+                f"{s['pages_parsed']} parsed, {s['sleep_seconds']:.0f}s asleep")
+
+    # rewrites a progress line on stream every `interval` seconds, until stop_progress
+    def start_progress(self, interval=1.0, stream=sys.stderr):
+        if self.progress_thread is not None:
+            return None
+        self.progress_stop.clear()
+        def run():
+            while not self.progress_stop.wait(interval):
+                stream.write("\r\033[K" + self.progress_line())
+                stream.flush()
+            stream.write("\r\033[K" + self.progress_line() + "\n")
+            stream.flush()
+        self.progress_thread = threading.Thread(target=run, daemon=True)
+        self.progress_thread.start()
+        return None
+
+    def stop_progress(self):
+        if self.progress_thread is not None:
+            self.progress_stop.set()
+            self.progress_thread.join()
+            self.progress_thread = None
+        return None
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# calls function, returning its result with the wall and CPU seconds it took
+# (module-level, so work sent to other processes can time itself, see plot_crawl_outputs)
+def timed_call(function, *args, **kwargs):
+    start, start_cpu = time.perf_counter(), time.process_time()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start, time.process_time() - start_cpu
+
+
+# the metrics of this process
+metrics = Telemetry()